@@ -0,0 +1,41 @@
+import sys
+import dotenv
+import os
+import tempfile
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+dotenv.load_dotenv()
+
+# Alerts are what is being measured, so they must not be skipped
+os.environ["BENCHMARK_MODE"] = "False"
+os.environ["ALERTS_DIR"] = tempfile.mkdtemp()
+os.environ["ALERTS_DB"] = os.path.join(os.environ["ALERTS_DIR"], "alerts.db")
+os.environ["ALERTS_BASELINES"] = os.path.join(os.environ["ALERTS_DIR"], "baselines.json")
+
+from alert_manager import AlertManager
+import timeit
+import time
+
+CALLS = 2000
+
+# Value above every threshold, so that every call fires an alert
+FIRING = 10 ** 12
+
+def inline_check(alert_manager):
+    """
+    The alert is evaluated and dumped in the callback, as it was done before the alert worker.
+    """
+    alert_manager.evaluate_alert("cpu_usage", FIRING, "bench", time.time())
+    alert_manager.dump_alerts({"alert": "cpu_usage", "host": "bench", "value": FIRING})
+
+# Run the benchmark
+if __name__ == "__main__":
+    alert_manager = AlertManager("Linux")
+
+    inline = timeit.timeit(lambda: inline_check(alert_manager), number=CALLS)
+    queued = timeit.timeit(lambda: alert_manager.check_alerts("cpu_usage", FIRING, "bench"), number=CALLS)
+    alert_manager.close()
+
+    print(f"Callback cost of a firing alert over {CALLS} calls:")
+    print(f"inline: {inline / CALLS * 1e6:.1f} us")
+    print(f"queued: {queued / CALLS * 1e6:.1f} us")
+    print(f"Worker: {alert_manager.alert_worker.stats()}")
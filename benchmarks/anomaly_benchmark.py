@@ -0,0 +1,61 @@
+import sys
+import os
+import random
+import timeit
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from alert_rules import RuleEngine
+
+SAMPLES = 20000
+
+# Threshold of the Linux cpu_usage alert
+THRESHOLD = 50
+
+def busy_host(rng):
+    """
+    A build host: high CPU usage all the time, with the noise of jobs starting and ending.
+    """
+    return [min(100.0, max(0.0, rng.gauss(75, 8))) for _ in range(SAMPLES)]
+
+def idle_host(rng):
+    """
+    An idle host with a runaway process every 2000 samples, well below the threshold.
+    """
+    values = [max(0.0, rng.gauss(5, 1.5)) for _ in range(SAMPLES)]
+    for start in range(1000, SAMPLES, 2000):
+        for i in range(start, start + 20):
+            values[i] = rng.gauss(35, 2)
+    return values
+
+def run(detector, values):
+    """
+    This function returns the number of times the alert fired, and the share of the samples it spent firing.
+    """
+    engine = RuleEngine({"cpu_usage": {"threshold": THRESHOLD, "message": "", "detector": detector}})
+    fired = firing = 0
+
+    for i, value in enumerate(values):
+        event = engine.evaluate("cpu_usage", value, "bench", float(i))
+        if event is not None and event["state"] == "firing":
+            fired += 1
+        firing += engine.rules["cpu_usage"].firing
+
+    return fired, firing / len(values) * 100
+
+# Compares the fixed threshold with the anomaly detectors on a busy host (every firing is a false positive)
+# and on an idle host with 10 runaway processes (every firing is a true positive)
+if __name__ == "__main__":
+    rng = random.Random(42)
+    busy, idle = busy_host(rng), idle_host(rng)
+
+    print(f"{'detector':<12}{'busy: fired':>12}{'firing':>9}{'idle: fired':>13}{'firing':>9}{'cost per value':>17}")
+    for detector in ("threshold", "ewma", "robust"):
+        engine = RuleEngine({"cpu_usage": {"threshold": THRESHOLD, "message": "", "detector": detector}})
+        cost = timeit.timeit(lambda: engine.evaluate("cpu_usage", 42.0, "bench", 0.0), number=SAMPLES) / SAMPLES
+
+        busy_fired, busy_firing = run(detector, busy)
+        idle_fired, idle_firing = run(detector, idle)
+        print(
+            f"{detector:<12}{busy_fired:>12}{busy_firing:>8.1f}%{idle_fired:>13}{idle_firing:>8.1f}%"
+            f"{cost * 1e6:>14.2f} us"
+        )
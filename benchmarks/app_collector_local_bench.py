@@ -11,25 +11,25 @@ import timeit
 def benchmark_system_monitor():
     monitor = SystemMonitor()
 
-    cpu = timeit.timeit(lambda: monitor.cpu_callback(None), number=20000)
+    cpu = timeit.timeit(lambda: monitor.callbacks["cpu_usage"](None), number=20000)
     if cpu:
         print("CPU")
-    ram = timeit.timeit(lambda: monitor.ram_callback(None), number=20000)
+    ram = timeit.timeit(lambda: monitor.callbacks["ram_usage"](None), number=20000)
     if ram:
         print("RAM")
-    disk = timeit.timeit(lambda: monitor.disk_callback(None), number=20000)
+    disk = timeit.timeit(lambda: monitor.callbacks["disk_busy_time_total"](None), number=20000)
     if disk:
         print("disk")
-    disk_read = timeit.timeit(lambda: monitor.disk_read_callback(None), number=20000)
+    disk_read = timeit.timeit(lambda: monitor.callbacks["disk_read_total"](None), number=20000)
     if disk_read:
         print("disk_read")
-    disk_write = timeit.timeit(lambda: monitor.disk_write_callback(None), number=20000)
+    disk_write = timeit.timeit(lambda: monitor.callbacks["disk_write_total"](None), number=20000)
     if disk_write:
         print("disk_write")
-    network_recv = timeit.timeit(lambda: monitor.network_recv_callback(None), number=20000)
+    network_recv = timeit.timeit(lambda: monitor.callbacks["network_recv_total"](None), number=20000)
     if network_recv:
         print("network_recv")
-    network_sent = timeit.timeit(lambda: monitor.network_sent_callback(None), number=20000)
+    network_sent = timeit.timeit(lambda: monitor.callbacks["network_sent_total"](None), number=20000)
     if network_sent:
         print("network_sent")
 
@@ -45,7 +45,7 @@ def benchmark_system_monitor():
 def stats(n):
     benchmark_results = []
 
-    for _ in range(n):
+    for i in range(n):
         print(f"Iteration {i}")
         benchmark_results.append(benchmark_system_monitor())
     
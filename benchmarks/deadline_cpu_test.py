@@ -0,0 +1,87 @@
+import sys
+import os
+import subprocess
+import time
+from collections import namedtuple
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+import system_snapshot
+from system_snapshot import SnapshotSampler
+from device_filter import DeviceFilter
+
+SAMPLES = 10
+
+CpuTimes = namedtuple("CpuTimes", ("user", "system", "idle"))
+
+class FakeCpuTimes:
+    """
+    CPU times growing by the same amount at every call: every core is busy half of the time.
+    """
+    def __init__(self, cores=2):
+        self.cores = cores
+        self.calls = 0
+
+    def __call__(self, percpu=False):
+        self.calls += 1
+        times = CpuTimes(user=self.calls, system=self.calls, idle=2 * self.calls)
+        return [times] * self.cores if percpu else times
+
+def sample_with_deadline(breakdown):
+    """
+    This function samples the CPU source SAMPLES times through the deadline's thread pool,
+    and returns the total and the breakdown of every sample.
+    """
+    cpu_times = system_snapshot.cpu_times
+    system_snapshot.cpu_times = FakeCpuTimes()
+
+    sampler = SnapshotSampler(max_age=0, sources=("cpu",))
+    try:
+        sampler.set_breakdown({"cpu": DeviceFilter()} if breakdown else {})
+        sampler.set_deadline(1.0)
+
+        usages = []
+        for _ in range(SAMPLES):
+            snapshot = sampler.get()
+            assert not snapshot.stale, "the cpu source missed the deadline"
+            usages.append((snapshot.cpu_usage, snapshot.breakdown.get("cpu")))
+    finally:
+        sampler.close()
+        system_snapshot.cpu_times = cpu_times
+
+    return usages
+
+def test_cpu_usage_with_deadline():
+    # The first sample has nothing to compare with; every later one must see the same steady load,
+    # whichever thread of the pool reads it
+    usages = [usage for usage, _ in sample_with_deadline(breakdown=False)]
+    assert usages == [0.0] + [50.0] * (SAMPLES - 1), usages
+
+def test_cpu_breakdown_with_deadline():
+    for usage, cores in sample_with_deadline(breakdown=True)[1:]:
+        assert usage == 50.0, usage
+        assert cores == {"0": {"cpu_usage": 50.0}, "1": {"cpu_usage": 50.0}}, cores
+
+def test_exit_with_hung_source():
+    # A source that never answers must not keep the interpreter from exiting
+    script = (
+        "import sys, time; sys.path.insert(0, 'src')\n"
+        "from system_snapshot import SnapshotSampler\n"
+        "sampler = SnapshotSampler(sources=('cpu', 'disk'))\n"
+        "sampler.sample_disk = lambda snapshot: time.sleep(60)\n"
+        "sampler.set_breakdown({})\n"
+        "sampler.set_deadline(0.1)\n"
+        "assert sampler.get().stale == {'disk'}\n"
+        "sampler.close()\n"
+    )
+    start = time.monotonic()
+    subprocess.run([sys.executable, "-c", script], cwd=os.path.join(os.path.dirname(__file__), ".."), check=True, timeout=30)
+    assert time.monotonic() - start < 10, "the hung source kept the interpreter alive"
+
+# The psutil backend used to keep the CPU times per thread (psutil.cpu_percent()), so samples read
+# by different threads of the pool compared against the wrong baseline
+if __name__ == "__main__":
+    test_cpu_usage_with_deadline()
+    test_cpu_breakdown_with_deadline()
+    print("OK: the CPU usage is steady across the threads of the deadline pool.")
+    test_exit_with_hung_source()
+    print("OK: a hung source does not keep the agent from exiting.")
@@ -0,0 +1,89 @@
+import sys
+import dotenv
+import os
+import math
+import time
+import http.client
+import threading
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+dotenv.load_dotenv()
+
+from exposition import ExpositionExporter, ExpositionServer
+from opentelemetry import metrics
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+
+CYCLES = 100
+SCRAPERS = 8
+SCRAPES = 500
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[math.ceil(p / 100 * len(ordered)) - 1]
+
+def scrape(port, count, gzip_enabled, latencies):
+    """
+    This function scrapes the exposition count times over one keep-alive connection, like Prometheus does.
+    """
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    headers = {"Accept-Encoding": "gzip"} if gzip_enabled else {}
+
+    for _ in range(count):
+        start = time.perf_counter()
+        connection.request("GET", "/metrics", headers=headers)
+        connection.getresponse().read()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    connection.close()
+
+# Measures the cost of rendering the exposition once per cycle,
+# and the latency of many scrapers reading the cached bytes at the same time
+if __name__ == "__main__":
+    exposition = ExpositionExporter()
+
+    # Collections are triggered by hand with force_flush()
+    reader = PeriodicExportingMetricReader(exposition, export_interval_millis=math.inf)
+    provider = MeterProvider(metric_readers=[reader])
+    meter = provider.get_meter("exposition_benchmark")
+
+    # About as many series as a host with the disk and network breakdowns enabled
+    for i in range(40):
+        meter.create_observable_gauge(
+            f"metric_{i}",
+            callbacks=[lambda options: [metrics.Observation(42.5, {"device": f"sd{d}"}) for d in range(8)]],
+            description="A benchmark metric",
+        )
+
+    start = time.perf_counter()
+    for _ in range(CYCLES):
+        reader.force_flush()
+    render_ms = (time.perf_counter() - start) / CYCLES * 1000
+
+    body, gzipped = exposition.cache
+    print(f"Collection and rendering: {render_ms:.2f} ms per cycle, {len(body)} bytes ({len(gzipped)} gzipped)")
+
+    server = ExpositionServer(exposition, port=0, host="127.0.0.1")
+    server.start()
+
+    for gzip_enabled in (False, True):
+        latencies = []
+        threads = [
+            threading.Thread(target=scrape, args=(server.port, SCRAPES, gzip_enabled, latencies))
+            for _ in range(SCRAPERS)
+        ]
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        label = "gzip" if gzip_enabled else "plain"
+        print(
+            f"{SCRAPERS} scrapers, {label}: {len(latencies) / elapsed:.0f} scrapes/s, "
+            f"p50 {percentile(latencies, 50):.2f} ms, p99 {percentile(latencies, 99):.2f} ms"
+        )
+
+    server.stop()
+    provider.shutdown()
@@ -0,0 +1,129 @@
+"""
+A local stand-in for the OTLP/HTTP receiver of the OpenTelemetry Collector.
+It accepts POST requests on /v1/metrics, keeps every payload it receives, and can be
+taken down and brought back up to simulate a collector outage or restart.
+
+Run it on its own to watch what the agent sends:
+    python fake_receiver.py 4318
+"""
+
+import gzip
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FakeReceiver:
+    def __init__(self, port=0):
+        """
+        port 0 picks a free port; the chosen one is kept, so up() after down() reuses it.
+        """
+        self.port = port
+        self.server = None
+        self.thread = None
+        self.payloads = []
+        self.received_bytes = 0
+        self.connections = set()
+        self.lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self.port}/v1/metrics"
+
+    def up(self):
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with receiver.lock:
+                    receiver.connections.add(self.request)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with receiver.lock:
+                    receiver.received_bytes += len(body)
+                    if self.headers.get("Content-Encoding") == "gzip":
+                        body = gzip.decompress(body)
+                    receiver.payloads.append(body)
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-protobuf")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def down(self):
+        """
+        Stops listening and drops the open keep-alive connections, like a collector that went away.
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+        with self.lock:
+            for connection in self.connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            self.connections.clear()
+
+class FakeGRPCReceiver:
+    """
+    A local stand-in for the OTLP/gRPC receiver. It needs the grpcio package.
+    """
+    def __init__(self, port=0):
+        self.port = port
+        self.server = None
+        self.requests = []
+
+    @property
+    def endpoint(self):
+        return f"127.0.0.1:{self.port}"
+
+    def up(self):
+        import grpc
+        from concurrent import futures
+        from opentelemetry.proto.collector.metrics.v1 import metrics_service_pb2, metrics_service_pb2_grpc
+
+        receiver = self
+
+        class Servicer(metrics_service_pb2_grpc.MetricsServiceServicer):
+            def Export(self, request, context):
+                receiver.requests.append(request)
+                return metrics_service_pb2.ExportMetricsServiceResponse()
+
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+        metrics_service_pb2_grpc.add_MetricsServiceServicer_to_server(Servicer(), self.server)
+        self.port = self.server.add_insecure_port(f"127.0.0.1:{self.port}")
+        self.server.start()
+
+    def down(self):
+        if self.server is not None:
+            self.server.stop(None)
+            self.server = None
+
+if __name__ == "__main__":
+    import sys, time
+
+    receiver = FakeReceiver(int(sys.argv[1]) if len(sys.argv) > 1 else 4318)
+    receiver.up()
+    print(f"Listening on {receiver.endpoint}")
+
+    try:
+        while True:
+            time.sleep(5)
+            print(f"{len(receiver.payloads)} payloads, {receiver.received_bytes} bytes received")
+    except KeyboardInterrupt:
+        receiver.down()
@@ -0,0 +1,118 @@
+import sys
+import os
+import subprocess
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+import filesystem_collector
+from filesystem_collector import FilesystemCollector, FilesystemUsage
+from device_filter import DeviceFilter
+
+Partition = namedtuple("Partition", ("device", "mountpoint", "fstype", "opts"))
+
+# What disk_partitions(all=True) lists on a host with an NFS share: psutil drops the share with all=False
+PARTITIONS = [
+    Partition("/dev/sda1", "/", "ext4", "rw"),
+    Partition("proc", "/proc", "proc", "rw"),
+    Partition("sysfs", "/sys", "sysfs", "rw"),
+    Partition("cgroup2", "/sys/fs/cgroup", "cgroup2", "rw"),
+    Partition("tmpfs", "/run", "tmpfs", "rw"),
+    Partition("overlay", "/var/lib/containers/overlay/merged", "overlay", "rw"),
+    Partition("filer:/export/home", "/mnt/home", "nfs4", "rw"),
+    Partition("//filer/share", "/mnt/share", "cifs", "rw"),
+]
+
+def fake_partitions(all=False):
+    return PARTITIONS if all else [partition for partition in PARTITIONS if partition.device.startswith("/dev/")]
+
+# More hung shares than the threads kept by the collector
+SHARES = [Partition(f"filer:/export/{n}", f"/mnt/export{n}", "nfs4", "rw") for n in range(8)]
+
+# The mount points whose statvfs hangs, until released is set
+hung = set()
+released = threading.Event()
+
+def fake_usage(mountpoint):
+    if mountpoint in hung:
+        released.wait()
+    return FilesystemUsage(100, 25, 75)
+
+@contextmanager
+def faked_mounts(partitions):
+    """
+    This function fakes the mounts and their statvfs for the duration of a test, then puts psutil back.
+    """
+    disk_partitions, read_usage = filesystem_collector.disk_partitions, filesystem_collector.read_usage
+    filesystem_collector.disk_partitions = partitions
+    filesystem_collector.read_usage = fake_usage
+    try:
+        yield
+    finally:
+        filesystem_collector.disk_partitions = disk_partitions
+        filesystem_collector.read_usage = read_usage
+
+def collect():
+    """
+    This function collects the faked mounts once, and returns the reported mount points.
+    """
+    with faked_mounts(fake_partitions):
+        collector = FilesystemCollector(DeviceFilter(), timeout=1.0)
+        try:
+            return {partition.mountpoint: stale for partition, _, stale in collector.get()}
+        finally:
+            collector.close()
+
+def test_network_mounts():
+    mounts = collect()
+    assert mounts.get("/mnt/home") is False, mounts
+    assert mounts.get("/mnt/share") is False, mounts
+
+def test_pseudo_filesystems():
+    assert set(collect()) == {"/", "/mnt/home", "/mnt/share"}
+
+def test_hung_mounts():
+    with faked_mounts(lambda all=False: [PARTITIONS[0]] + SHARES):
+        collector = FilesystemCollector(DeviceFilter(), timeout=0.2, workers=4, max_age=0)
+        try:
+            collector.get()
+            hung.update(share.mountpoint for share in SHARES)
+
+            # The hung shares hold 8 threads, more than the 4 kept: the root filesystem must still be read
+            for _ in range(3):
+                start = time.monotonic()
+                mounts = {partition.mountpoint: stale for partition, _, stale in collector.get()}
+                assert time.monotonic() - start < 1.0
+                assert mounts["/"] is False, mounts
+                assert all(mounts[share.mountpoint] for share in SHARES), mounts
+        finally:
+            released.set()
+            collector.close()
+            hung.clear()
+
+def test_exit_with_hung_mount():
+    # A statvfs that never returns must not keep the interpreter from exiting
+    script = (
+        "import sys, time; sys.path.insert(0, 'src')\n"
+        "import filesystem_collector\n"
+        "from device_filter import DeviceFilter\n"
+        "filesystem_collector.read_usage = lambda mountpoint: time.sleep(60)\n"
+        "collector = filesystem_collector.FilesystemCollector(DeviceFilter(), timeout=0.1)\n"
+        "collector.get()\n"
+        "collector.close()\n"
+    )
+    start = time.monotonic()
+    subprocess.run([sys.executable, "-c", script], cwd=os.path.join(os.path.dirname(__file__), ".."), check=True, timeout=30)
+    assert time.monotonic() - start < 10, "the hung statvfs kept the interpreter alive"
+
+# The mounts are listed with disk_partitions(all=True), so that NFS and CIFS shares are reported,
+# and the pseudo filesystems are left out by their type
+if __name__ == "__main__":
+    test_network_mounts()
+    test_pseudo_filesystems()
+    print("OK: the NFS and CIFS mounts are reported, the pseudo filesystems are not.")
+    test_hung_mounts()
+    test_exit_with_hung_mount()
+    print("OK: hung mounts are flagged as stale without holding up the other mounts, nor the exit.")
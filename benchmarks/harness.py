@@ -0,0 +1,332 @@
+"""
+Benchmark harness for the collection path of SystemMonitor.
+
+Every callback runs against stubbed metric sources (or a recording of real ones),
+without an exporter, so the results only depend on the code being measured.
+For each callback it reports the p50/p99 latency, the memory allocated per call
+(measured with tracemalloc) and the RSS of the process, and the real /proc and
+psutil backends are measured on their own.
+
+The results can be written as JSON and compared against a stored baseline:
+a change that makes collection slower than the baseline (beyond the tolerance)
+makes the harness exit with status 1.
+
+Usage:
+    python harness.py --output results.json
+    python harness.py --save-baseline baseline.json
+    python harness.py --baseline baseline.json --tolerance 0.25
+    python harness.py --record recording.json      # record real snapshots
+    python harness.py --replay recording.json      # run the callbacks on them
+"""
+
+import sys
+import dotenv
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+dotenv.load_dotenv()
+
+# Alerts are not part of what is being measured
+os.environ["BENCHMARK_MODE"] = "True"
+
+import argparse
+import json
+import math
+import platform
+import time
+import tracemalloc
+import psutil
+from collections import namedtuple
+
+from app_collector_local import SystemMonitor
+from system_snapshot import SnapshotSampler
+from proc_sampler import ProcSampler
+from sensor_cache import SensorCache, SensorReadings
+from filesystem_collector import FilesystemCollector, FilesystemUsage
+from device_filter import DeviceFilter
+
+# Fields of the snapshot that are sampled (the rates are derived from them)
+SAMPLED_FIELDS = (
+    "cpu_usage", "ram_usage", "disk_busy_time", "disk_read_bytes",
+    "disk_write_bytes", "network_sent", "network_recv",
+)
+
+# =============== Metric Sources ===============
+class RecordedSampler(SnapshotSampler):
+    """
+    A sampler that replays recorded snapshots instead of reading the system.
+    """
+    def __init__(self, recording):
+        super().__init__()
+        self.recording = recording
+        self.index = 0
+
+    def sample(self, now=None):
+        values = self.recording[self.index]
+        self.index = (self.index + 1) % len(self.recording)
+
+        for field in SAMPLED_FIELDS:
+            setattr(self.snapshot, field, values[field])
+
+        self.snapshot.monotonic = time.monotonic() if now is None else now
+        self.sampled = True
+
+        return self.snapshot
+
+    def set_deadline(self, deadline):
+        # The recording never blocks, and must be replayed in order
+        pass
+
+def stub_recording(length=100):
+    """
+    This function returns deterministic snapshots shaped like real ones, with growing counters.
+    """
+    return [
+        {
+            "cpu_usage": 20.0 + (i * 7) % 60,
+            "ram_usage": 40.0 + (i * 3) % 30,
+            "disk_busy_time": 1000.0 + i * 0.5,
+            "disk_read_bytes": 10 ** 9 + i * 4096 * 100,
+            "disk_write_bytes": 10 ** 9 + i * 4096 * 50,
+            "network_sent": 10 ** 8 + i * 1500 * 40,
+            "network_recv": 10 ** 8 + i * 1500 * 90,
+        }
+        for i in range(length)
+    ]
+
+def record(path, count, interval):
+    """
+    This function records count real snapshots, interval seconds apart.
+    """
+    sampler = SnapshotSampler()
+    recording = []
+
+    for _ in range(count):
+        snapshot = sampler.sample()
+        recording.append({field: getattr(snapshot, field) for field in SAMPLED_FIELDS})
+        time.sleep(interval)
+
+    with open(path, "w") as f:
+        json.dump(recording, f)
+
+def stub_sensors():
+    """
+    This function returns fixed sensor readings, shaped like those of a laptop.
+    """
+    temperatures = [("coretemp", "Package id 0", 52.0), ("coretemp", "Core 0", 50.0), ("nvme", "Composite", 41.0)]
+    return SensorReadings(time.monotonic(), temperatures, (80.0, 7200, True))
+
+Partition = namedtuple("Partition", ("device", "mountpoint", "fstype", "opts"))
+
+class StubFilesystemCollector(FilesystemCollector):
+    """
+    A filesystem collector over fixed mounts, which never calls statvfs.
+    """
+    def __init__(self):
+        super().__init__(DeviceFilter())
+        self.partitions = [
+            Partition("/dev/sda1", "/", "ext4", "rw"),
+            Partition("/dev/sda2", "/home", "ext4", "rw"),
+            Partition("filer:/export", "/mnt/export", "nfs4", "rw"),
+        ]
+        self.mountpoints = {partition.mountpoint for partition in self.partitions}
+        self.fixed_usages = {
+            mountpoint: FilesystemUsage(500 * 10 ** 9, 200 * 10 ** 9, 300 * 10 ** 9, 32 * 10 ** 6, 30 * 10 ** 6)
+            for mountpoint in self.mountpoints
+        }
+
+    def collect(self):
+        self.usages = self.fixed_usages
+        self.collected = time.monotonic()
+
+class BenchMonitor(SystemMonitor):
+    """
+    A SystemMonitor without an exporter, whose sampler replays the given recording,
+    and whose sensors and filesystems are stubbed, so the callbacks do no I/O.
+    """
+    def __init__(self, recording):
+        self.recording = recording
+        super().__init__()
+
+    def set_exporters(self):
+        self.collector_exporter = None
+
+    def create_sampler(self):
+        return RecordedSampler(self.recording)
+
+    def set_sensor_cache(self):
+        # Refreshed once, and never stale, instead of read by a thread
+        self.sensor_cache = SensorCache(max_age=math.inf, reader=stub_sensors)
+        self.sensor_cache.refresh()
+
+    def set_filesystem_collector(self):
+        self.filesystem_collector = StubFilesystemCollector()
+
+# =============== Measurements ===============
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[math.ceil(p / 100 * len(ordered)) - 1]
+
+def measure(func, calls, alloc_calls):
+    """
+    This function returns the p50/p99 latency of func in microseconds,
+    and the memory it allocates per call, in bytes.
+    The allocations are measured in a separate run, since tracemalloc slows every call down.
+    """
+    # Warm up caches and lazy imports
+    for _ in range(min(calls, 100)):
+        func()
+
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter_ns()
+        func()
+        latencies.append((time.perf_counter_ns() - start) / 1000)
+
+    tracemalloc.start()
+    allocated = 0
+    for _ in range(alloc_calls):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        allocated += peak - before
+    tracemalloc.stop()
+
+    return {
+        "p50_us": round(percentile(latencies, 50), 3),
+        "p99_us": round(percentile(latencies, 99), 3),
+        "alloc_bytes": round(allocated / alloc_calls, 1),
+    }
+
+def callbacks(monitor):
+    """
+    This function returns the callbacks of the monitor to benchmark, by metric name.
+    """
+    return {name: (lambda callback=callback: callback(None)) for name, callback in monitor.callbacks.items()}
+
+def run(recording, calls, alloc_calls):
+    """
+    This function runs every benchmark and returns the results.
+    """
+    monitor = BenchMonitor(recording)
+    results = {}
+
+    # Each callback on its own, reading the snapshot of the current cycle
+    for name, callback in callbacks(monitor).items():
+        results[f"callback:{name}"] = measure(callback, calls, alloc_calls)
+
+    # A full collection cycle: a new sample, the rates, then every callback
+    cycle_callbacks = list(callbacks(monitor).values())
+    def cycle():
+        monitor.sampler.sampled = False
+        for callback in cycle_callbacks:
+            callback()
+    results["cycle"] = measure(cycle, calls, alloc_calls)
+
+    # The real backends, which do the actual I/O
+    backends = {"psutil": SnapshotSampler}
+    if sys.platform.startswith("linux"):
+        backends["proc"] = ProcSampler
+    for name, backend in backends.items():
+        sampler = backend()
+        results[f"sample:{name}"] = measure(sampler.sample, calls, alloc_calls)
+        sampler.close()
+
+    # The fastest backend (proc, where available) again, with every source read in the thread pool of the deadline
+    name = "proc" if "proc" in backends else "psutil"
+    sampler = backends[name]()
+    sampler.set_deadline(1.0)
+    results[f"sample:{name}+deadline"] = measure(sampler.sample_with_deadline, calls, alloc_calls)
+    sampler.close()
+
+    monitor.close_sources()
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "calls": calls,
+        "rss_bytes": psutil.Process().memory_info().rss,
+        "results": results,
+    }
+
+# =============== Baseline ===============
+def compare(report, baseline, tolerance):
+    """
+    This function compares the results against the baseline.
+    It returns the regressions: the p50 latencies and allocations above the baseline by more than tolerance.
+    p99 latencies are reported, but too noisy to gate on. So are the latencies of the real backends,
+    which depend on the load of the machine; only their allocations are gated.
+    """
+    regressions = []
+
+    for name, result in report["results"].items():
+        reference = baseline["results"].get(name)
+        if reference is None:
+            continue
+
+        keys = ("alloc_bytes",) if name.startswith("sample:") else ("p50_us", "alloc_bytes")
+        for key in keys:
+            # Small absolute differences are noise, whatever the ratio
+            limit = reference[key] * (1 + tolerance) + (1.0 if key == "p50_us" else 64)
+            if result[key] > limit:
+                regressions.append(f"{name} {key}: {result[key]} > {reference[key]} (+{tolerance:.0%})")
+
+    return regressions
+
+def print_report(report, baseline=None):
+    print(f"{'benchmark':<28}{'p50 (us)':>12}{'p99 (us)':>12}{'alloc (B)':>12}{'vs baseline':>14}")
+    for name, result in report["results"].items():
+        change = ""
+        if baseline is not None and name in baseline["results"] and baseline["results"][name]["p50_us"]:
+            change = f"{result['p50_us'] / baseline['results'][name]['p50_us'] - 1:+.0%}"
+        print(f"{name:<28}{result['p50_us']:>12.2f}{result['p99_us']:>12.2f}{result['alloc_bytes']:>12.0f}{change:>14}")
+    print(f"RSS: {report['rss_bytes'] / 1048576:.1f} MB")
+
+# Run the benchmark
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the collection path of SystemMonitor.")
+    parser.add_argument("--calls", type=int, default=20000, help="calls per benchmark")
+    parser.add_argument("--alloc-calls", type=int, default=1000, help="calls traced with tracemalloc")
+    parser.add_argument("--replay", help="run the callbacks on a recording instead of stubbed values")
+    parser.add_argument("--record", help="record real snapshots to this file, then exit")
+    parser.add_argument("--record-count", type=int, default=60)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--save-baseline", help="write the results as the new baseline")
+    parser.add_argument("--baseline", help="compare the results against this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.record, args.record_count, 1.0)
+        print(f"Recorded {args.record_count} snapshots to {args.record}")
+        sys.exit(0)
+
+    if args.replay:
+        with open(args.replay, "r") as f:
+            recording = json.load(f)
+    else:
+        recording = stub_recording()
+
+    report = run(recording, args.calls, args.alloc_calls)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+
+    print_report(report, baseline)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=4)
+
+    if baseline is not None:
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+
+        print("\nNo regression against the baseline.")
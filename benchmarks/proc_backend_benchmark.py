@@ -0,0 +1,40 @@
+import sys
+import dotenv
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+dotenv.load_dotenv()
+
+from system_snapshot import SnapshotSampler
+from proc_sampler import ProcSampler
+import timeit
+import time
+
+SAMPLES = 20000
+
+def measure(sampler):
+    """
+    Returns the wall time and the CPU time spent by this process per sample, in microseconds.
+    """
+    cpu_start = time.process_time()
+    wall = timeit.timeit(sampler.sample, number=SAMPLES)
+    cpu = time.process_time() - cpu_start
+
+    return wall / SAMPLES * 1e6, cpu / SAMPLES * 1e6
+
+# Run the benchmark
+if __name__ == "__main__":
+    if not sys.platform.startswith("linux"):
+        sys.exit("The /proc backend is only available on Linux.")
+
+    samplers = {"psutil": SnapshotSampler(), "proc": ProcSampler()}
+
+    print(f"Cost of one full snapshot over {SAMPLES} samples:")
+    for name, sampler in samplers.items():
+        wall, cpu = measure(sampler)
+        print(f"{name}: {wall:.1f} us wall, {cpu:.1f} us CPU")
+
+    # Both backends must agree on the values they read
+    print("\nValues read by each backend:")
+    snapshots = {name: sampler.sample() for name, sampler in samplers.items()}
+    for field in ("ram_usage", "disk_busy_time", "disk_read_bytes", "disk_write_bytes", "network_sent", "network_recv"):
+        print(f"{field}: " + ", ".join(f"{name}={getattr(snapshot, field)}" for name, snapshot in snapshots.items()))
@@ -0,0 +1,71 @@
+import sys
+import os
+import subprocess
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from process_collector import ProcessCollector, ATTRS
+from psutil import Process, NoSuchProcess, AccessDenied, pids, process_iter
+
+# Idle processes started on top of the ones already running, so the pass covers thousands of PIDs
+PROCESSES = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+PASSES = 10
+
+def uncached_pass():
+    """
+    The usual way: a new psutil.Process per PID at every pass, each attribute read with its own call.
+    The CPU usage cannot even be measured, since a new handle has no previous CPU times.
+    """
+    values = []
+    for pid in pids():
+        try:
+            process = Process(pid)
+            values.append((process.name(), process.cpu_percent(interval=None), process.memory_info().rss))
+        except (NoSuchProcess, AccessDenied):
+            pass
+    return values
+
+def iter_pass():
+    """
+    process_iter() without attrs: the handles are cached by psutil, but each attribute is still read on its own.
+    """
+    values = []
+    for process in process_iter():
+        try:
+            values.append((process.name(), process.cpu_percent(interval=None), process.memory_info().rss))
+        except (NoSuchProcess, AccessDenied):
+            pass
+    return values
+
+def measure(func):
+    """
+    Returns the wall time and the CPU time spent by this process per pass, in milliseconds.
+    """
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    for _ in range(PASSES):
+        func()
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    return wall / PASSES * 1000, cpu / PASSES * 1000
+
+# Compares one pass of the process collector with the usual ways of reading every process
+if __name__ == "__main__":
+    children = [subprocess.Popen(["sleep", "300"]) for _ in range(PROCESSES)]
+    try:
+        collector = ProcessCollector()
+        collector.collect()
+
+        print(f"One pass over {collector.count()} processes ({PASSES} passes, attributes: {', '.join(ATTRS)}):")
+        for name, func in (("new Process", uncached_pass), ("process_iter", iter_pass), ("collector", collector.collect)):
+            wall, cpu = measure(func)
+            print(f"{name:<14}{wall:>8.1f} ms wall{cpu:>8.1f} ms CPU")
+
+        print(f"\nSeries reported by the collector: {len(collector.get())} (top {collector.top_n} by CPU and by RSS, "
+              f"at most {collector.max_series})")
+    finally:
+        for child in children:
+            child.kill()
+        for child in children:
+            child.wait()
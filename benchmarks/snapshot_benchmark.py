@@ -0,0 +1,69 @@
+import sys
+import dotenv
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+dotenv.load_dotenv()
+
+# Alerts are not part of what is being measured
+os.environ["BENCHMARK_MODE"] = "True"
+
+from app_collector_local import SystemMonitor
+from psutil import cpu_percent, virtual_memory, net_io_counters, disk_io_counters
+import timeit
+import time
+
+CYCLES = 5000
+
+# The seven metrics of the legacy cycle
+LEGACY_METRICS = (
+    "cpu_usage", "ram_usage", "disk_busy_time_total", "disk_read_total",
+    "disk_write_total", "network_sent_total", "network_recv_total",
+)
+
+# One collection cycle as it was done before the snapshot: one psutil call per callback
+def legacy_cycle():
+    cpu_percent(interval=None)
+    os.getenv("HOST")
+    virtual_memory().percent
+    os.getenv("HOST")
+    disk_io_counters().busy_time / 1000
+    os.getenv("HOST")
+    disk_io_counters().read_time
+    os.getenv("HOST")
+    disk_io_counters().write_time
+    os.getenv("HOST")
+    net_io_counters().bytes_sent
+    os.getenv("HOST")
+    net_io_counters().bytes_recv
+    os.getenv("HOST")
+
+# One collection cycle with the snapshot: every callback reads the same sample
+def snapshot_cycle(monitor):
+    # Force a new sample, as if a new collection cycle had started
+    monitor.sampler.sampled = False
+
+    for name in LEGACY_METRICS:
+        monitor.callbacks[name](None)
+
+def measure(func):
+    """
+    Returns the wall time and the CPU time spent by this process per cycle, in microseconds.
+    """
+    cpu_start = time.process_time()
+    wall = timeit.timeit(func, number=CYCLES)
+    cpu = time.process_time() - cpu_start
+
+    return wall / CYCLES * 1e6, cpu / CYCLES * 1e6
+
+# Run the benchmark
+if __name__ == "__main__":
+    monitor = SystemMonitor()
+
+    results = {
+        "legacy (7 psutil calls)": measure(legacy_cycle),
+        "snapshot (1 sample)": measure(lambda: snapshot_cycle(monitor)),
+    }
+
+    print(f"Per-cycle cost over {CYCLES} cycles:")
+    for name, (wall, cpu) in results.items():
+        print(f"{name}: {wall:.1f} us wall, {cpu:.1f} us CPU")
@@ -0,0 +1,106 @@
+import sys
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from proc_sampler import ProcSampler
+from system_snapshot import SystemSnapshot
+from tcp_stats import TCP_STATES
+from psutil import net_connections
+
+# Socket lines written to the synthetic /proc/net/tcp and /proc/net/tcp6
+SOCKETS = 100000
+IPV6_SHARE = 0.4
+ROUNDS = 20
+
+HEADER = "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode\n"
+
+# A busy proxy: mostly established and time-wait connections, a few listening sockets
+STATES = ["01"] * 60 + ["06"] * 30 + ["08"] * 5 + ["03"] * 3 + ["0A"] + ["04"]
+
+def socket_line(rng, index, ipv6):
+    address = "".join(rng.choice("0123456789ABCDEF") for _ in range(32 if ipv6 else 8))
+    return (
+        f"{index:>4}: {address}:1F90 {address}:{rng.randrange(65536):04X} {rng.choice(STATES)} "
+        f"00000000:00000000 00:00000000 00000000  1000        0 {rng.randrange(10 ** 7)} 1 "
+        f"0000000000000000 20 4 30 10 -1\n"
+    )
+
+def write_procfs(directory, rng):
+    """
+    This function writes /proc/net files with SOCKETS synthetic sockets, and copies the counters of this host.
+    """
+    os.makedirs(os.path.join(directory, "net"))
+    ipv6 = int(SOCKETS * IPV6_SHARE)
+
+    for name, count, is_ipv6 in (("tcp", SOCKETS - ipv6, False), ("tcp6", ipv6, True)):
+        with open(os.path.join(directory, "net", name), "w") as f:
+            f.write(HEADER)
+            f.writelines(socket_line(rng, index, is_ipv6) for index in range(count))
+
+    for name in ("snmp", "netstat"):
+        shutil.copyfile(f"/proc/net/{name}", os.path.join(directory, "net", name))
+
+def split_count(directory):
+    """
+    The usual way: read the whole file and split every line into its fields, one tuple per socket.
+    """
+    sockets = []
+    for name in ("tcp", "tcp6"):
+        with open(os.path.join(directory, "net", name)) as f:
+            for line in f.readlines()[1:]:
+                fields = line.split()
+                sockets.append((fields[1], fields[2], fields[3], int(fields[9])))
+
+    counts = {}
+    for socket in sockets:
+        state = TCP_STATES.get(socket[2].encode())
+        counts[state] = counts.get(state, 0) + 1
+
+    return counts
+
+def measure(func):
+    """
+    Returns the wall time in milliseconds and the peak memory in KiB of one call.
+    """
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        func()
+    wall = (time.perf_counter() - start) / ROUNDS * 1000
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return wall, peak / 1024
+
+# Compares counting the sockets by state, chunk by chunk, with splitting every line of the socket tables
+if __name__ == "__main__":
+    if not sys.platform.startswith("linux"):
+        sys.exit("The TCP source reads /proc/net, which is only available on Linux.")
+
+    directory = tempfile.mkdtemp()
+    try:
+        write_procfs(directory, random.Random(42))
+        sampler = ProcSampler(procfs=directory, sources=("tcp",))
+        snapshot = SystemSnapshot()
+
+        print(f"Counting {SOCKETS} sockets by state, over {ROUNDS} rounds:")
+        for name, func in (("split lines", lambda: split_count(directory)), ("chunked", lambda: sampler.sample_tcp(snapshot))):
+            wall, peak = measure(func)
+            print(f"{name:<12}{wall:>9.1f} ms{peak:>12.0f} KiB peak")
+
+        # psutil cannot read the synthetic files, so it is timed on the sockets of this host
+        start = time.perf_counter()
+        connections = net_connections("tcp")
+        wall = (time.perf_counter() - start) * 1000
+        print(f"\npsutil.net_connections(): {wall:.1f} ms for the {len(connections)} sockets of this host")
+
+        sampler.close()
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,126 @@
+import sys
+import dotenv
+import os
+import math
+import tracemalloc
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+dotenv.load_dotenv()
+
+from transport import create_transport, DELTA_INSTRUMENTS
+from fake_receiver import FakeReceiver
+from opentelemetry import metrics
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+from opentelemetry.proto.collector.metrics.v1.metrics_service_pb2 import ExportMetricsServiceRequest
+
+CYCLES = 200
+
+# Short-lived series, like the veth interfaces of containers that come and go
+CHURN_PER_CYCLE = 5
+LIVE_SERIES = 20
+
+# Number of exports after which the stand-in collector forgets a series it no longer receives
+EXPIRATION = 12
+
+class StandInCollector:
+    """
+    Keeps the last point of every series received, like the prometheus exporter of the collector,
+    which turns deltas back into totals and keeps every series until it expires (metric_expiration).
+    """
+    def __init__(self):
+        self.series = {}
+        self.last_seen = {}
+
+    def consume(self, payloads):
+        for export, payload in enumerate(payloads):
+            request = ExportMetricsServiceRequest.FromString(payload)
+            for resource_metrics in request.resource_metrics:
+                for scope_metrics in resource_metrics.scope_metrics:
+                    for metric in scope_metrics.metrics:
+                        kind = metric.WhichOneof("data")
+                        for point in getattr(metric, kind).data_points:
+                            key = (metric.name, tuple((a.key, a.value.string_value) for a in point.attributes))
+                            self.series[key] = point.SerializeToString()
+                            self.last_seen[key] = export
+
+            for key, seen in list(self.last_seen.items()):
+                if export - seen > EXPIRATION:
+                    del self.series[key], self.last_seen[key]
+
+    def size(self):
+        return sum(len(key[0]) + len(value) for key, value in self.series.items())
+
+def workload(meter, point_instrument, cycle):
+    """
+    The instruments of SystemMonitor: point values, byte counters with churning series,
+    and a synchronous histogram like the callback durations of the agent's own metrics.
+    """
+    create_point = getattr(meter, point_instrument)
+    for name in ("cpu_usage", "ram_usage", "disk_busy_percent"):
+        create_point(name, callbacks=[lambda options: [metrics.Observation(42.0)]])
+
+    def interfaces(options):
+        first = cycle[0] * CHURN_PER_CYCLE
+        return [
+            metrics.Observation(cycle[0] * 1000, attributes={"interface": f"veth{i}"})
+            for i in range(first, first + LIVE_SERIES)
+        ]
+
+    meter.create_observable_counter("network_sent_interface_total", callbacks=[interfaces])
+
+    durations = meter.create_histogram("agent_callback_duration", unit="ms")
+    return durations
+
+def run(temporality, point_instrument, receiver):
+    """
+    This function exports CYCLES cycles, and returns the memory held by the SDK and by the stand-in collector.
+    """
+    exporter, _ = create_transport("127.0.0.1", port=receiver.port, compression="none", temporality=temporality)
+
+    # Collections are triggered by hand with force_flush()
+    reader = PeriodicExportingMetricReader(exporter, export_interval_millis=math.inf)
+    provider = MeterProvider(metric_readers=[reader])
+
+    cycle = [0]
+    durations = workload(provider.get_meter("temporality_test"), point_instrument, cycle)
+    receiver.payloads.clear()
+
+    # The payloads kept by the receiver run in the same process; they are left out of the SDK's memory
+    tracemalloc.start(8)
+    receiver_filter = tracemalloc.Filter(False, "*fake_receiver.py", all_frames=True)
+    before = tracemalloc.take_snapshot().filter_traces([receiver_filter])
+
+    for _ in range(CYCLES):
+        cycle[0] += 1
+        # A callback that only runs for a while, then goes away
+        durations.record(0.1, {"callback": f"callback{cycle[0]}"})
+        reader.force_flush()
+
+    after = tracemalloc.take_snapshot().filter_traces([receiver_filter])
+    tracemalloc.stop()
+    sdk = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+
+    collector = StandInCollector()
+    collector.consume(receiver.payloads)
+    payload_bytes = sum(len(payload) for payload in receiver.payloads)
+
+    provider.shutdown()
+
+    return sdk, payload_bytes, len(collector.series), collector.size()
+
+# Compares the memory held on both sides of the pipeline for each temporality,
+# and with the point values as observable counters (as before) or as gauges
+if __name__ == "__main__":
+    receiver = FakeReceiver()
+    receiver.up()
+
+    print(f"{CYCLES} export cycles, {LIVE_SERIES} live interfaces, {CHURN_PER_CYCLE} replaced per cycle")
+    print(f"{'temporality':<12}{'point values':<16}{'SDK (KB)':>10}{'sent (KB)':>11}{'series':>8}{'collector (KB)':>16}")
+
+    for temporality in DELTA_INSTRUMENTS:
+        for point_instrument in ("create_observable_counter", "create_observable_gauge"):
+            sdk, sent, series, held = run(temporality, point_instrument, receiver)
+            label = "counters" if point_instrument == "create_observable_counter" else "gauges"
+            print(f"{temporality:<12}{label:<16}{sdk / 1024:>10.1f}{sent / 1024:>11.1f}{series:>8}{held / 1024:>16.1f}")
+
+    receiver.down()
@@ -0,0 +1,83 @@
+import sys
+import dotenv
+import os
+import math
+import time
+import gzip
+import importlib.util
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+dotenv.load_dotenv()
+
+from transport import create_transport
+from fake_receiver import FakeReceiver, FakeGRPCReceiver
+from opentelemetry import metrics
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+
+EXPORTS = 500
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[math.ceil(p / 100 * len(ordered)) - 1]
+
+def run(exporter):
+    """
+    Exports EXPORTS batches shaped like the ones of SystemMonitor, and returns the latency of each, in milliseconds.
+    """
+    reader = PeriodicExportingMetricReader(exporter, export_interval_millis=math.inf)
+    provider = MeterProvider(metric_readers=[reader])
+    meter = provider.get_meter("system_monitor")
+
+    for name in ("cpu_usage", "ram_usage", "disk_usage", "disk_read", "disk_write", "network_sent", "network_recv"):
+        meter.create_observable_gauge(name, callbacks=[lambda options: [metrics.Observation(42.0)]])
+
+    latencies = []
+    for _ in range(EXPORTS):
+        start = time.perf_counter()
+        reader.force_flush()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    provider.shutdown()
+    return latencies
+
+def report(name, latencies, payload_bytes):
+    print(f"{name}: {payload_bytes / EXPORTS:.0f} bytes/export, "
+          f"p50 {percentile(latencies, 50):.2f} ms, p99 {percentile(latencies, 99):.2f} ms")
+
+# Run the benchmark
+if __name__ == "__main__":
+    receiver = FakeReceiver()
+    receiver.up()
+
+    print(f"OTLP transports over {EXPORTS} exports to a local fake receiver:")
+    for compression in ("none", "gzip"):
+        for keep_alive in (False, True):
+            exporter, sender = create_transport("127.0.0.1", "http/protobuf", compression, port=receiver.port)
+            if not keep_alive:
+                sender.session.headers["Connection"] = "close"
+
+            receiver.received_bytes = 0
+            latencies = run(exporter)
+            report(f"http/protobuf {compression}, {'keep-alive' if keep_alive else 'new connection'}",
+                   latencies, receiver.received_bytes)
+
+    receiver.down()
+
+    # grpc itself is only imported by the gRPC receiver and exporter
+    if importlib.util.find_spec("grpc") is None:
+        sys.exit("grpcio is not installed, skipping OTLP/gRPC.")
+
+    grpc_receiver = FakeGRPCReceiver()
+    grpc_receiver.up()
+    for compression in ("none", "gzip"):
+        grpc_receiver.requests = []
+        exporter, _ = create_transport("127.0.0.1", "grpc", compression, port=grpc_receiver.port)
+        latencies = run(exporter)
+
+        # The gRPC server hands over decoded requests, so the payload size is measured on the re-encoded request
+        payloads = [request.SerializeToString() for request in grpc_receiver.requests]
+        if compression == "gzip":
+            payloads = [gzip.compress(payload) for payload in payloads]
+        report(f"grpc {compression}, one channel", latencies, sum(len(payload) for payload in payloads))
+
+    grpc_receiver.down()
@@ -0,0 +1,47 @@
+import sys
+import dotenv
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+dotenv.load_dotenv()
+
+from system_snapshot import SnapshotSampler
+from proc_sampler import ProcSampler
+from window_sampler import WindowSampler
+import time
+
+# Sampling rates to compare, in milliseconds
+INTERVALS = [1000, 500, 250, 100, 50]
+
+# How long each rate runs, in seconds
+DURATION = 5.0
+
+def overhead(sampler, interval_ms):
+    """
+    Returns the CPU time used by this process, as a percentage of one core,
+    while the window sampler runs at the given rate and is summarised every 5 seconds.
+    """
+    window_sampler = WindowSampler(sampler, interval=interval_ms / 1000)
+
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+
+    window_sampler.start()
+    time.sleep(DURATION)
+    window_sampler.get()
+    window_sampler.stop()
+
+    cpu = time.process_time() - cpu_start
+    wall = time.monotonic() - wall_start
+
+    return cpu / wall * 100
+
+# Run the benchmark
+if __name__ == "__main__":
+    backends = {"psutil": SnapshotSampler}
+    if sys.platform.startswith("linux"):
+        backends["proc"] = ProcSampler
+
+    print(f"Agent CPU overhead of the window sampler ({DURATION:.0f} s per rate):")
+    for name, backend in backends.items():
+        for interval_ms in INTERVALS:
+            print(f"{name} @ {interval_ms} ms: {overhead(backend(), interval_ms):.3f}% of one core")
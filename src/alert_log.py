@@ -0,0 +1,208 @@
+"""
+This module is used to store the alerts in an append-only JSON Lines log.
+Each alert event is written as one line at the end of the current segment file,
+so firing an alert costs the same no matter how many alerts were stored before.
+
+Segments are rotated when they reach a maximum size, and the oldest segments are
+deleted to keep the storage bounded. Writes are synced to disk in batches.
+The alerts can be read back, one at a time, with iter_alerts(), or filtered with AlertLog.query().
+Unlike the SQLite store, a query reads every segment, which is bounded by max_segments.
+"""
+
+import os, json, time
+from collections import deque
+
+SEGMENT_PREFIX = "alerts-"
+SEGMENT_SUFFIX = ".jsonl"
+
+def list_segments(directory):
+    """
+    This function returns the segment files of a log, from the oldest to the newest.
+    """
+    if not os.path.isdir(directory):
+        return []
+
+    segments = [
+        name for name in os.listdir(directory)
+        if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+    ]
+
+    return [os.path.join(directory, name) for name in sorted(segments)]
+
+def iter_alerts(directory):
+    """
+    This function streams the alerts of a log, from the oldest to the newest.
+    Only one line is held in memory at a time.
+    Lines that cannot be decoded (e.g. a line cut short by a crash) are skipped.
+    """
+    for segment in list_segments(directory):
+        try:
+            with open(segment, "r") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            # The segment was deleted by a rotation while we were reading
+            continue
+
+class AlertLog:
+    def __init__(self, directory, segment_size=1048576, max_segments=10, fsync_batch=32, fsync_interval=5.0):
+        """
+        segment_size is the size in bytes after which a new segment is started.
+        max_segments is the number of segments kept on disk.
+        The log is synced to disk every fsync_batch events or every fsync_interval seconds, whichever comes first.
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+
+        self.file = None
+        self.segment_index = 0
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    # =============== Segments ===============
+    def open_segment(self):
+        """
+        This method opens the newest segment for appending, or creates the first one.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        segments = list_segments(self.directory)
+
+        if segments:
+            name = os.path.basename(segments[-1])
+            self.segment_index = int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+        else:
+            self.segment_index = 1
+
+        self.file = open(self.segment_path(self.segment_index), "a")
+
+    def segment_path(self, index):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{index:06d}{SEGMENT_SUFFIX}")
+
+    def rotate(self):
+        """
+        This method closes the current segment, starts a new one
+        and deletes the oldest segments beyond max_segments.
+        """
+        self.sync()
+        self.file.close()
+
+        self.segment_index += 1
+        self.file = open(self.segment_path(self.segment_index), "a")
+
+        for segment in list_segments(self.directory)[:-self.max_segments]:
+            os.remove(segment)
+
+    # =============== Writing ===============
+    def append(self, alert_event):
+        """
+        This method appends one alert event to the log.
+        """
+        self.append_many([alert_event])
+
+    def append_many(self, alert_events):
+        """
+        This method appends several alert events to the log with a single write.
+        """
+        if not alert_events:
+            return
+
+        if self.file is None:
+            self.open_segment()
+
+        self.file.write("".join(json.dumps(event, separators=(",", ":")) + "\n" for event in alert_events))
+        self.file.flush()
+        self.unsynced += len(alert_events)
+
+        if self.unsynced >= self.fsync_batch or time.monotonic() - self.last_sync >= self.fsync_interval:
+            self.sync()
+
+        if self.file.tell() >= self.segment_size:
+            self.rotate()
+
+    def sync(self):
+        """
+        This method makes sure every event written so far is on disk.
+        """
+        if self.file is not None and self.unsynced:
+            os.fsync(self.file.fileno())
+
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        """
+        This method syncs and closes the current segment.
+        """
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+    # =============== Reading ===============
+    def query(self, host=None, alert=None, state=None, since=None, until=None, limit=None):
+        """
+        This method returns the alert events matching every given filter, from the oldest to the newest,
+        like AlertStore.query(). since and until are epoch timestamps. limit keeps only the newest events.
+        Events without an epoch timestamp ("ts") only match when neither since nor until is given.
+        """
+        # Only the newest limit events are held in memory while the segments are streamed
+        events = deque(maxlen=limit)
+        filters = [(key, value) for key, value in (("host", host), ("alert", alert), ("state", state)) if value is not None]
+
+        for alert_event in iter_alerts(self.directory):
+            if any(alert_event.get(key) != value for key, value in filters):
+                continue
+
+            if since is not None or until is not None:
+                ts = alert_event.get("ts")
+                if ts is None or (since is not None and ts < since) or (until is not None and ts >= until):
+                    continue
+
+            events.append(alert_event)
+
+        return list(events)
+
+    # =============== Migration ===============
+    def migrate_legacy(self, path):
+        """
+        This method imports the alerts of a legacy alerts.json file (a single JSON array) into the log.
+        The legacy file is then emptied in place instead of deleted,
+        so it keeps working when it is mounted as a Docker volume.
+        It returns the number of migrated alerts.
+        """
+        # Docker creates a directory when the mounted file does not exist on the host
+        if not os.path.isfile(path):
+            return 0
+
+        with open(path, "r") as f:
+            try:
+                alerts_list = json.load(f)
+            except ValueError:
+                alerts_list = []
+
+        if not isinstance(alerts_list, list) or not alerts_list:
+            return 0
+
+        self.append_many(alerts_list)
+        self.sync()
+
+        with open(path, "w") as f:
+            f.write("[]")
+
+        return len(alerts_list)
+
+# =================================================================================
+
+if __name__ == "__main__":
+    import sys
+
+    # Print every stored alert, one per line
+    default = os.getenv("ALERTS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "alerts"))
+    for alert_event in iter_alerts(sys.argv[1] if len(sys.argv) > 1 else default):
+        print(json.dumps(alert_event))
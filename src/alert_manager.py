@@ -1,12 +1,21 @@
 """
 This module is used to manage alerts.
 It allows you to set, delete, and check alerts based on system metrics.
-It also allows you to dump the alerts to a JSON file.
+It also allows you to dump the alerts to an indexed SQLite history (or an append-only JSON Lines log),
+which can be queried by host, alert and time range.
+The alerts are evaluated and dumped in a background thread, off the metric export thread.
 The alerts are used to notify the user when a certain condition is met.
+An alert is only dumped when it starts firing and when it is resolved, not on every check.
+Each alert either compares its values to a fixed threshold, or learns the normal values of its metric
+and fires on anomalies; the learned baselines are saved, so a restart does not relearn them.
 """
 
 import os, json, datetime
 from dotenv import load_dotenv
+from alert_log import AlertLog
+from alert_store import AlertStore, DATA_DIR
+from alert_worker import AlertWorker
+from alert_rules import RuleEngine, AnomalyRule
 load_dotenv()
 
 class AlertManager:
@@ -14,10 +23,127 @@ class AlertManager:
         self.benchmark_mode = os.getenv("BENCHMARK_MODE")
         self.device_type = device_type
         self.set_alerts(device_type)
+        self.set_rules()
+        self.set_baselines()
+        self.set_alert_log()
+        self.set_alert_worker()
 
-    def add_alert(self, alert_name, threshold, message):
+    def set_rules(self):
+        """
+        This method compiles the alerts into rules.
+        An alert fires once its value stays above the threshold for ALERTS_FOR_SECONDS (0 by default),
+        and is resolved once its value drops below ALERTS_CLEAR_RATIO times the threshold (0.9 by default).
+        Each alert can override these with its own "for_seconds" and "clear_threshold".
+        An alert with an anomaly detector fires once its value is ALERTS_ANOMALY_Z deviations (4 by default)
+        above its baseline instead. The baseline follows the values with the weight ALERTS_ANOMALY_ALPHA
+        (0.05 by default), after ALERTS_ANOMALY_WARMUP values (30 by default); deviations smaller than
+        ALERTS_ANOMALY_MIN_SCALE times the threshold (0.05 by default) are rounded up to it.
+        """
+        self.rule_engine = RuleEngine(
+            self.alerts,
+            clear_ratio=float(os.getenv("ALERTS_CLEAR_RATIO", 0.9)),
+            for_seconds=float(os.getenv("ALERTS_FOR_SECONDS", 0)),
+            z_threshold=float(os.getenv("ALERTS_ANOMALY_Z", 4.0)),
+            alpha=float(os.getenv("ALERTS_ANOMALY_ALPHA", 0.05)),
+            warmup=int(os.getenv("ALERTS_ANOMALY_WARMUP", 30)),
+            min_scale_ratio=float(os.getenv("ALERTS_ANOMALY_MIN_SCALE", 0.05)),
+        )
+
+    def set_baselines(self):
+        """
+        This method restores the baselines learned by the anomaly detectors before the last restart.
+        The baselines are saved to ALERTS_BASELINES (src/data/baselines.json by default)
+        every ALERTS_BASELINES_INTERVAL seconds (300 by default), and when the manager is closed.
+        """
+        self.baselines_path = os.getenv("ALERTS_BASELINES", os.path.join(DATA_DIR, "baselines.json"))
+        self.baselines_interval = float(os.getenv("ALERTS_BASELINES_INTERVAL", 300))
+        self.baselines_saved = None
+
+        if not self.rule_engine.baselines() or not os.path.isfile(self.baselines_path):
+            return
+
+        try:
+            with open(self.baselines_path, "r") as f:
+                restored = self.rule_engine.restore(json.load(f))
+            print(f"Restored {restored} alert baselines from {self.baselines_path}")
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"Error restoring alert baselines: {e}")
+
+    def save_baselines(self):
+        """
+        This method saves the baselines of the anomaly detectors.
+        The file is replaced in a single step, so a crash never leaves half of it behind.
+        """
+        baselines = self.rule_engine.baselines()
+
+        if not baselines:
+            return
+
+        try:
+            directory = os.path.dirname(self.baselines_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            temporary = self.baselines_path + ".tmp"
+            with open(temporary, "w") as f:
+                json.dump(baselines, f)
+            os.replace(temporary, self.baselines_path)
+        except OSError as e:
+            print(f"Error saving alert baselines: {e}")
+
+    def set_alert_log(self):
+        """
+        This method sets up the alert history.
+        With ALERTS_BACKEND=sqlite (the default), the alerts are stored in ALERTS_DB (src/data/alerts.db by default),
+        and kept for ALERTS_RETENTION_DAYS days (30 by default), up to ALERTS_MAX_ROWS alerts (100000 by default).
+        With ALERTS_BACKEND=jsonl, the alerts are stored in a JSON Lines log in ALERTS_DIR (src/data/alerts by default).
+        Alerts left in a legacy alerts.json file, or in a JSON Lines log when using SQLite, are migrated.
+        """
+        backend = os.getenv("ALERTS_BACKEND", "sqlite").lower()
+        alerts_dir = os.getenv("ALERTS_DIR", os.path.join(DATA_DIR, "alerts"))
+
+        if backend == "jsonl":
+            self.alert_log = AlertLog(
+                alerts_dir,
+                segment_size=int(os.getenv("ALERTS_SEGMENT_SIZE", 1048576)),
+                max_segments=int(os.getenv("ALERTS_MAX_SEGMENTS", 10)),
+            )
+        elif backend == "sqlite":
+            self.alert_log = AlertStore(
+                os.getenv("ALERTS_DB", os.path.join(DATA_DIR, "alerts.db")),
+                retention_days=float(os.getenv("ALERTS_RETENTION_DAYS", 30)),
+                max_rows=int(os.getenv("ALERTS_MAX_ROWS", 100000)),
+            )
+        else:
+            raise ValueError(f"Unknown ALERTS_BACKEND {backend!r}, expected sqlite or jsonl")
+
+        try:
+            migrated = self.alert_log.migrate_legacy("alerts.json")
+            if migrated:
+                print(f"Migrated {migrated} alerts from alerts.json")
+
+            if backend == "sqlite":
+                migrated = self.alert_log.migrate_log(alerts_dir)
+                if migrated:
+                    print(f"Migrated {migrated} alerts from {alerts_dir}")
+        except OSError as e:
+            print(f"Error migrating alerts: {e}")
+
+    def set_alert_worker(self):
+        """
+        This method sets up the alert worker.
+        The worker evaluates the queued values and dumps the alerts in a background thread.
+        """
+        self.alert_worker = AlertWorker(
+            self.evaluate_alert,
+            self.alert_log,
+            max_queue=int(os.getenv("ALERTS_QUEUE_SIZE", 1024)),
+        )
+
+    def add_alert(self, alert_name, threshold, message, detector="threshold"):
         """
         This method adds a new alert.
+        detector is "threshold", or the anomaly detector of the alert ("ewma" or "robust").
         """
         if self.device_type == "Mobile":
             self.alerts[alert_name] = {
@@ -35,11 +161,22 @@ class AlertManager:
                 "message": message,
             }
 
+        self.alerts[alert_name]["detector"] = detector
+
+        self.rule_engine.compile(self.alerts)
+
     def set_alerts(self, device_type):
         """
         This method sets up the alerts.
         The thresholds are set based on the device type.
-        The default thresholds are set for Android, Linux, Windows, and MacOS.
+        The default thresholds are set for Android, Linux, Windows, MacOS and containers.
+        In a container, the CPU and memory usage are percentages of its limits, which it is throttled
+        or killed at, so their thresholds are higher than the host ones.
+        The disk read/write and network thresholds are in bytes per second,
+        and the disk usage threshold is the percentage of time the disks are busy.
+        The TCP listen overflows threshold is in connections dropped per second, on every device type.
+        Every alert uses the ALERTS_DETECTOR detector ("threshold" by default, or "ewma" or "robust"),
+        unless ALERTS_DETECTORS sets its own (e.g. "cpu_usage=ewma,disk_read=robust").
         """
         default_thresholds = {
             "cpu_usage": 50,
@@ -49,6 +186,7 @@ class AlertManager:
             "disk_write": 100000000,
             "network_sent": 50000000,
             "network_recv": 50000000,
+            "tcp_listen_overflows": 1,
         }
 
         device_specific_thresholds = {
@@ -79,6 +217,15 @@ class AlertManager:
                 "network_sent": 10000000,
                 "network_recv": 10000000,
             },
+            "Container": {
+                "cpu_usage": 80,
+                "memory_usage": 90,
+                "disk_usage": 80,
+                "disk_read": 500000000,
+                "disk_write": 500000000,
+                "network_sent": 20000000,
+                "network_recv": 20000000,
+            },
             "MacOS": {
                 "cpu_usage": 50,
                 "memory_usage": 60,
@@ -100,6 +247,20 @@ class AlertManager:
             for metric in default_thresholds
         }
 
+        default_detector = os.getenv("ALERTS_DETECTOR", "threshold").strip().lower()
+        detectors = dict(
+            (alert.strip(), detector.strip().lower())
+            for alert, _, detector in (item.partition("=") for item in os.getenv("ALERTS_DETECTORS", "").split(","))
+            if alert.strip()
+        )
+
+        for alert in detectors:
+            if alert not in self.alerts:
+                print(f"Alert {alert} not found.")
+
+        for alert, config in self.alerts.items():
+            config["detector"] = detectors.get(alert, default_detector)
+
     def delete_alerts(self, alerts):
         """
         This method deletes the alerts.
@@ -110,45 +271,87 @@ class AlertManager:
             else:
                 print(f"Alert {alert} not found.")
 
+        self.rule_engine.compile(self.alerts)
+
     def dump_alerts(self, alert_event):
         """
-        This method dumps the alerts to a JSON file.
+        This method appends the alert event to the alert history.
+        """
+        try:
+            self.alert_log.append(alert_event)
+        except OSError as e:
+            print(f"Error dumping alert: {e}")
+
+    def query_alerts(self, host=None, alert=None, state=None, since=None, until=None, limit=None):
+        """
+        This method returns the stored alert events matching every given filter, from the oldest to the newest.
+        since and until are epoch timestamps, e.g. time.time() - 3600 for the last hour.
+        With ALERTS_BACKEND=jsonl, every stored segment is read, instead of using the indexes of the SQLite history.
         """
-        # Load existing alerts from the JSON file
-        alerts_list = []
-        if os.path.exists("alerts.json"):
-            with open("alerts.json", "r") as f:
-                try:
-                    alerts_list = json.load(f)
-                except Exception as e:
-                    print(f"Error loading alerts: {e}")
-                    alerts_list = []
-            
-        # Append the new alert event to the list
-        alerts_list.append(alert_event)
+        return self.alert_log.query(host=host, alert=alert, state=state, since=since, until=until, limit=limit)
 
-        # Write the updated alerts list back to the JSON file
-        with open("alerts.json", "w") as f:
-            json.dump(alerts_list, f, indent=4)
+    def close(self):
+        """
+        This method flushes the pending alerts, then syncs and closes the alert history,
+        and saves the baselines of the anomaly detectors.
+        The history is left open when the worker did not stop in time, since it may still be writing to it.
+        """
+        if self.alert_worker.close():
+            try:
+                self.alert_log.close()
+            except OSError as e:
+                print(f"Error closing the alert history: {e}")
+        else:
+            print("The alert worker did not stop in time, the alert history was left open.")
 
+        self.save_baselines()
 
     def check_alerts(self, alert, value, host):
         """
         This method checks the alerts.
+        The value is only queued here; it is evaluated and dumped by the alert worker,
+        so the metric callbacks never wait on the alert log.
         """
         if self.benchmark_mode in ["True", "true"]:
             return
-        
-        if alert in self.alerts and value >= self.alerts[alert]["threshold"]:
-            # Add a time stamp for the alert
-            alert_event = {
-                "alert": alert,
-                "host": host,
-                "value": value,
-                "threshold": self.alerts[alert]["threshold"],
-                "message": self.alerts[alert]["message"],
-                "timestamp": datetime.datetime.now().strftime('%H:%M:%S')
-            }
 
-            # Dump the alert event to a JSON file
-            self.dump_alerts(alert_event)
+        self.alert_worker.submit(alert, value, host)
+
+    def proximity(self, alert, value):
+        """
+        This method returns how close a value is to firing its alert: 1 is the threshold,
+        and a firing alert is at least 1. For an anomaly rule, it is the last anomaly score
+        over the threshold score, since the value alone says nothing about the anomaly.
+        """
+        rule = self.rule_engine.rules.get(alert)
+
+        if rule is None or not rule.fire_threshold:
+            return 0.0
+
+        if isinstance(rule, AnomalyRule):
+            proximity = rule.score / rule.fire_threshold
+        else:
+            proximity = value / rule.fire_threshold
+
+        return max(proximity, 1.0) if rule.firing else proximity
+
+    def evaluate_alert(self, alert, value, host, timestamp):
+        """
+        This method evaluates a queued value against the rule of its alert.
+        It returns an alert event when the alert starts firing or is resolved, and None otherwise.
+        It is called by the alert worker.
+        """
+        alert_event = self.rule_engine.evaluate(alert, value, host, timestamp)
+
+        if self.baselines_saved is None:
+            self.baselines_saved = timestamp
+        elif timestamp - self.baselines_saved >= self.baselines_interval:
+            self.baselines_saved = timestamp
+            self.save_baselines()
+
+        if alert_event is not None:
+            # Add an epoch time stamp, used to query the alerts, and a readable one
+            alert_event["ts"] = timestamp
+            alert_event["timestamp"] = datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+        return alert_event
@@ -0,0 +1,232 @@
+"""
+This module is used to compile the alert thresholds into rules with state.
+A rule only emits an event when its state changes:
++ "firing" once the value has stayed at or above the fire threshold for for_seconds
++ "resolved" once the value drops below the clear threshold
+
+The clear threshold is lower than the fire threshold (hysteresis), so a value that
+hovers around the threshold does not flap between firing and resolved.
+Evaluating a value is O(1): one dict lookup and a few attribute updates.
+
+An alert can use an anomaly detector (see anomaly_detector.py) instead of a fixed threshold.
+Its rule then compares the anomaly score of each value (a z-score) to the thresholds,
+so it fires on values that are unusually high for this host rather than high in general.
+"""
+
+from anomaly_detector import DETECTORS
+
+class AlertRule:
+    """
+    The thresholds and the state of one alert.
+    """
+    __slots__ = (
+        "alert",
+        "fire_threshold",
+        "clear_threshold",
+        "for_seconds",
+        "message",
+        "firing",
+        "pending_since",
+        "fired_at",
+    )
+
+    def __init__(self, alert, fire_threshold, clear_threshold, for_seconds, message):
+        self.alert = alert
+        self.fire_threshold = fire_threshold
+        self.clear_threshold = clear_threshold
+        self.for_seconds = for_seconds
+        self.message = message
+
+        # State
+        self.firing = False
+        self.pending_since = None
+        self.fired_at = None
+
+    def evaluate(self, value, timestamp):
+        """
+        This method updates the state of the rule with a new value.
+        It returns "firing" or "resolved" when the state changes, and None otherwise.
+        """
+        if self.firing:
+            if value < self.clear_threshold:
+                self.firing = False
+                self.pending_since = None
+                return "resolved"
+
+            return None
+
+        if value < self.fire_threshold:
+            self.pending_since = None
+            return None
+
+        if self.pending_since is None:
+            self.pending_since = timestamp
+
+        if timestamp - self.pending_since >= self.for_seconds:
+            self.firing = True
+            self.fired_at = timestamp
+            return "firing"
+
+        return None
+
+class AnomalyRule(AlertRule):
+    """
+    A rule whose thresholds apply to the anomaly score of the values, rather than to the values.
+    """
+    __slots__ = ("detector", "score")
+
+    def __init__(self, alert, fire_threshold, clear_threshold, for_seconds, message, detector):
+        super().__init__(alert, fire_threshold, clear_threshold, for_seconds, message)
+        self.detector = detector
+        self.score = 0.0
+
+    def evaluate(self, value, timestamp):
+        self.score = self.detector.update(value)
+        return super().evaluate(self.score, timestamp)
+
+class RuleEngine:
+    def __init__(self, alerts, clear_ratio=0.9, for_seconds=0.0, z_threshold=4.0, alpha=0.05, warmup=30, min_scale_ratio=0.05):
+        """
+        clear_ratio and for_seconds are the defaults of the rules whose alert
+        does not set its own "clear_threshold" or "for_seconds".
+        z_threshold, alpha and warmup are the defaults of the rules whose alert sets a "detector".
+        The smallest deviation of a detector is min_scale_ratio times the threshold of its alert,
+        unless the alert sets its own "min_scale".
+        """
+        self.clear_ratio = clear_ratio
+        self.for_seconds = for_seconds
+        self.z_threshold = z_threshold
+        self.alpha = alpha
+        self.warmup = warmup
+        self.min_scale_ratio = min_scale_ratio
+        self.rules = {}
+        self.compile(alerts)
+
+    def compile(self, alerts):
+        """
+        This method compiles the alerts into rules.
+        Rules that already existed keep their state, so the alerts can be changed at runtime.
+        The rules are swapped in a single assignment, so evaluate() can run in another thread.
+        """
+        rules = {}
+
+        for alert, config in alerts.items():
+            rule = self.compile_rule(alert, config)
+
+            previous = self.rules.get(alert)
+            if previous is not None:
+                rule.firing = previous.firing
+                rule.pending_since = previous.pending_since
+                rule.fired_at = previous.fired_at
+
+            # The detector keeps what it learned, as long as it is the same kind of detector
+            if isinstance(rule, AnomalyRule) and isinstance(previous, AnomalyRule):
+                if type(rule.detector) is type(previous.detector):
+                    rule.detector.restore(previous.detector.state())
+
+            rules[alert] = rule
+
+        self.rules = rules
+
+    def compile_rule(self, alert, config):
+        """
+        This method compiles one alert into a rule.
+        An alert with a "detector" other than "threshold" gets an anomaly rule, whose thresholds are z-scores.
+        """
+        detector = config.get("detector", "threshold")
+        for_seconds = config.get("for_seconds", self.for_seconds)
+
+        if detector == "threshold":
+            threshold = config["threshold"]
+            return AlertRule(
+                alert,
+                threshold,
+                config.get("clear_threshold", threshold * self.clear_ratio),
+                for_seconds,
+                config["message"],
+            )
+
+        if detector not in DETECTORS:
+            raise ValueError(f"Unknown detector {detector!r} for {alert}, expected one of: threshold, {', '.join(DETECTORS)}")
+
+        z_threshold = config.get("z_threshold", self.z_threshold)
+        return AnomalyRule(
+            alert,
+            z_threshold,
+            config.get("clear_z_threshold", z_threshold * self.clear_ratio),
+            for_seconds,
+            config["message"],
+            DETECTORS[detector](
+                alpha=config.get("alpha", self.alpha),
+                warmup=config.get("warmup", self.warmup),
+                min_scale=config.get("min_scale", config["threshold"] * self.min_scale_ratio),
+            ),
+        )
+
+    def baselines(self):
+        """
+        This method returns what the detectors of the anomaly rules have learned, to be saved.
+        """
+        return {
+            alert: {"detector": type(rule.detector).__name__, **rule.detector.state()}
+            for alert, rule in self.rules.items()
+            if isinstance(rule, AnomalyRule)
+        }
+
+    def restore(self, baselines):
+        """
+        This method restores the baselines saved by baselines(), into the detectors of the same kind.
+        It returns the number of restored baselines.
+        """
+        restored = 0
+
+        for alert, state in baselines.items():
+            rule = self.rules.get(alert)
+
+            if isinstance(rule, AnomalyRule) and state.get("detector") == type(rule.detector).__name__:
+                try:
+                    rule.detector.restore(state)
+                    restored += 1
+                except (KeyError, TypeError, ValueError):
+                    continue
+
+        return restored
+
+    def evaluate(self, alert, value, host, timestamp):
+        """
+        This method evaluates a value against the rule of its alert.
+        It returns an alert event when the rule starts firing or is resolved, and None otherwise.
+        """
+        rule = self.rules.get(alert)
+
+        if rule is None:
+            return None
+
+        state = rule.evaluate(value, timestamp)
+
+        if state is None:
+            return None
+
+        alert_event = {
+            "alert": alert,
+            "host": host,
+            "state": state,
+            "value": value,
+            "threshold": rule.fire_threshold,
+            "message": rule.message,
+        }
+
+        if isinstance(rule, AnomalyRule):
+            alert_event["score"] = round(rule.score, 2)
+            alert_event["baseline"] = rule.detector.baseline()
+            if state == "firing":
+                alert_event["message"] = f"{alert.replace('_', ' ').capitalize()} is unusually high ({rule.score:.1f} deviations above its baseline)"
+
+        if state == "resolved":
+            alert_event["message"] = f"{alert.replace('_', ' ').capitalize()} is back below {rule.clear_threshold}"
+            if isinstance(rule, AnomalyRule):
+                alert_event["message"] = f"{alert.replace('_', ' ').capitalize()} is back to normal"
+            alert_event["clear_threshold"] = rule.clear_threshold
+            alert_event["duration"] = round(timestamp - rule.fired_at, 3)
+
+        return alert_event
@@ -0,0 +1,331 @@
+"""
+This module is used to store the alerts in a SQLite database, so they can be queried
+by host, alert and time range without reading every stored alert.
+
+The database is in WAL mode, so the alert worker can write while the alerts are being
+queried (e.g. from the command line below). Every alert event is stored with its epoch
+timestamp, and indexed on (host, alert, ts). Events are inserted in batches, with one
+transaction per batch.
+
+The storage stays bounded on long-running devices: events older than the retention
+period, and the oldest events beyond max_rows, are deleted periodically, and the freed
+pages are given back to the file system.
+
+Usage:
+    python alert_store.py --host my-host --last 1h
+    python alert_store.py --alert cpu_usage --state firing --last 2d
+"""
+
+import os, json, re, sqlite3, threading, time, datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    host TEXT,
+    alert TEXT,
+    state TEXT,
+    value REAL,
+    event TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS alerts_host_alert_ts ON alerts (host, alert, ts);
+CREATE INDEX IF NOT EXISTS alerts_ts ON alerts (ts);
+"""
+
+# Default directory of the alert history, src/data, whatever the working directory
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+DURATION = re.compile(r"^(\d+(?:\.\d+)?)([smhd])$")
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+def parse_duration(text):
+    """
+    This function parses a duration such as "90s", "30m", "1h" or "7d" into seconds.
+    """
+    match = DURATION.match(text.strip())
+
+    if match is None:
+        raise ValueError(f"Invalid duration {text!r}, expected e.g. 30m, 1h or 7d")
+
+    return float(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+class AlertStore:
+    def __init__(self, path, retention_days=30, max_rows=100000, compact_interval=3600.0):
+        """
+        path is the SQLite database file.
+        Events older than retention_days, and the oldest events beyond max_rows, are deleted
+        every compact_interval seconds.
+        """
+        self.path = path
+        self.retention = retention_days * 86400
+        self.max_rows = max_rows
+        self.compact_interval = compact_interval
+
+        self.connection = None
+        self.lock = threading.Lock()
+        self.last_compaction = None
+
+    # =============== Database ===============
+    def connect(self):
+        """
+        This method opens the database, and creates it if needed.
+        The connection is shared by the alert worker and the main thread, behind a lock.
+        """
+        if self.connection is not None:
+            return self.connection
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+
+        # Must be set before the tables are created, so deleted rows can be given back to the file system
+        connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        connection.execute("PRAGMA journal_mode=WAL")
+
+        # In WAL mode, a commit survives a crash of the process; the WAL is synced at checkpoints
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA journal_size_limit=4194304")
+        connection.executescript(SCHEMA)
+
+        self.connection = connection
+        return connection
+
+    # =============== Writing ===============
+    def append(self, alert_event):
+        """
+        This method stores one alert event.
+        """
+        self.append_many([alert_event])
+
+    def append_many(self, alert_events):
+        """
+        This method stores several alert events in a single transaction.
+        Events without an epoch timestamp ("ts") are stored with the current time.
+        """
+        if not alert_events:
+            return
+
+        now = time.time()
+        rows = [
+            (
+                event.get("ts", now),
+                event.get("host"),
+                event.get("alert"),
+                event.get("state"),
+                event.get("value"),
+                json.dumps(event, separators=(",", ":")),
+            )
+            for event in alert_events
+        ]
+
+        with self.lock:
+            connection = self.connect()
+            try:
+                connection.execute("BEGIN")
+                connection.executemany(
+                    "INSERT INTO alerts (ts, host, alert, state, value, event) VALUES (?, ?, ?, ?, ?, ?)", rows
+                )
+                connection.execute("COMMIT")
+            except sqlite3.Error as e:
+                if connection.in_transaction:
+                    connection.execute("ROLLBACK")
+                raise OSError(f"Could not store the alerts in {self.path}: {e}") from e
+
+        # The events are stored even when the compaction fails; it is tried again with the next append
+        if self.last_compaction is None or time.monotonic() - self.last_compaction >= self.compact_interval:
+            try:
+                self.compact()
+            except OSError as e:
+                print(f"Error compacting alerts: {e}")
+
+    def compact(self, now=None):
+        """
+        This method deletes the events older than the retention period, and the oldest events beyond max_rows.
+        It returns the number of deleted events. A compaction that fails is tried again with the next append.
+        """
+        now = time.time() if now is None else now
+
+        with self.lock:
+            connection = self.connect()
+            try:
+                deleted = connection.execute("DELETE FROM alerts WHERE ts < ?", (now - self.retention,)).rowcount
+                deleted += connection.execute(
+                    "DELETE FROM alerts WHERE ts <= (SELECT ts FROM alerts ORDER BY ts DESC LIMIT 1 OFFSET ?)",
+                    (self.max_rows,),
+                ).rowcount
+
+                if deleted:
+                    connection.execute("PRAGMA incremental_vacuum")
+                    connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.Error as e:
+                raise OSError(f"Could not compact the alerts in {self.path}: {e}") from e
+
+        self.last_compaction = time.monotonic()
+        return deleted
+
+    def sync(self):
+        """
+        This method writes the WAL back to the database file, which syncs it to disk.
+        """
+        with self.lock:
+            if self.connection is not None:
+                try:
+                    self.connection.execute("PRAGMA wal_checkpoint(PASSIVE)")
+                except sqlite3.Error as e:
+                    raise OSError(f"Could not sync the alerts in {self.path}: {e}") from e
+
+    def close(self):
+        """
+        This method checkpoints the WAL and closes the database. The database is closed even when the checkpoint fails.
+        """
+        with self.lock:
+            if self.connection is None:
+                return
+
+            try:
+                self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.Error as e:
+                raise OSError(f"Could not checkpoint the alerts in {self.path}: {e}") from e
+            finally:
+                self.connection.close()
+                self.connection = None
+
+    # =============== Reading ===============
+    def query(self, host=None, alert=None, state=None, since=None, until=None, limit=None):
+        """
+        This method returns the alert events matching every given filter, from the oldest to the newest.
+        since and until are epoch timestamps. limit keeps only the newest events.
+        """
+        conditions, parameters = [], []
+
+        for column, value in (("host", host), ("alert", alert), ("state", state)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                parameters.append(value)
+
+        if since is not None:
+            conditions.append("ts >= ?")
+            parameters.append(since)
+
+        if until is not None:
+            conditions.append("ts < ?")
+            parameters.append(until)
+
+        sql = "SELECT event FROM alerts"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY ts DESC, id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+
+        with self.lock:
+            rows = self.connect().execute(sql, parameters).fetchall()
+
+        return [json.loads(event) for (event,) in reversed(rows)]
+
+    def count(self):
+        with self.lock:
+            return self.connect().execute("SELECT COUNT(*) FROM alerts").fetchone()[0]
+
+    # =============== Migration ===============
+    def migrate_legacy(self, path):
+        """
+        This method imports the alerts of a legacy alerts.json file (a single JSON array) into the store.
+        Legacy alerts only have a '%H:%M:%S' time, so they are dated with the day the file was last written.
+        The legacy file is then emptied in place instead of deleted,
+        so it keeps working when it is mounted as a Docker volume.
+        It returns the number of migrated alerts.
+        """
+        # Docker creates a directory when the mounted file does not exist on the host
+        if not os.path.isfile(path):
+            return 0
+
+        with open(path, "r") as f:
+            try:
+                alerts_list = json.load(f)
+            except ValueError:
+                alerts_list = []
+
+        if not isinstance(alerts_list, list) or not alerts_list:
+            return 0
+
+        day = datetime.date.fromtimestamp(os.path.getmtime(path))
+        for alert_event in alerts_list:
+            if "ts" not in alert_event:
+                alert_event["ts"] = legacy_timestamp(day, alert_event.get("timestamp"))
+
+        self.append_many(alerts_list)
+
+        with open(path, "w") as f:
+            f.write("[]")
+
+        return len(alerts_list)
+
+    def migrate_log(self, directory):
+        """
+        This method imports the alerts of a JSON Lines alert log (see alert_log.py) into the store,
+        then deletes the log. It returns the number of migrated alerts.
+        """
+        from alert_log import iter_alerts, list_segments
+
+        segments = list_segments(directory)
+        if not segments:
+            return 0
+
+        day = datetime.date.fromtimestamp(os.path.getmtime(segments[-1]))
+        batch, migrated = [], 0
+
+        for alert_event in iter_alerts(directory):
+            if "ts" not in alert_event:
+                alert_event["ts"] = legacy_timestamp(day, alert_event.get("timestamp"))
+            batch.append(alert_event)
+
+            if len(batch) >= 1000:
+                self.append_many(batch)
+                migrated += len(batch)
+                batch = []
+
+        self.append_many(batch)
+        migrated += len(batch)
+
+        for segment in segments:
+            os.remove(segment)
+
+        return migrated
+
+def legacy_timestamp(day, text):
+    """
+    This function turns a legacy '%H:%M:%S' time into an epoch timestamp on the given day.
+    """
+    try:
+        clock = datetime.datetime.strptime(text, "%H:%M:%S").time()
+    except (TypeError, ValueError):
+        clock = datetime.time()
+
+    return datetime.datetime.combine(day, clock).timestamp()
+
+# =================================================================================
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Query the stored alerts.")
+    parser.add_argument("--db", default=os.getenv("ALERTS_DB", os.path.join(DATA_DIR, "alerts.db")))
+    parser.add_argument("--host")
+    parser.add_argument("--alert")
+    parser.add_argument("--state", choices=("firing", "resolved"))
+    parser.add_argument("--last", help="only the alerts of the last duration, e.g. 30m, 1h or 7d")
+    parser.add_argument("--limit", type=int)
+    args = parser.parse_args()
+
+    store = AlertStore(args.db)
+    since = time.time() - parse_duration(args.last) if args.last else None
+
+    # Print the matching alerts, one per line
+    for alert_event in store.query(host=args.host, alert=args.alert, state=args.state, since=since, limit=args.limit):
+        print(json.dumps(alert_event))
+
+    store.close()
@@ -0,0 +1,145 @@
+"""
+This module is used to evaluate and store alerts in a background thread.
+The metric callbacks only push the values to a bounded queue, so they never wait
+on the alert evaluation or on the alert log I/O.
+The worker consumes the queue and writes the resulting alert events in batches.
+A value that fails to evaluate, or a batch that fails to be written, is logged and counted,
+and the worker goes on with the next ones.
+"""
+
+import queue, threading, time
+
+class AlertWorker:
+    def __init__(self, evaluate, alert_log, max_queue=1024, batch_size=64):
+        """
+        evaluate is called with (alert, value, host, timestamp) and returns an alert event or None.
+        alert_log is where the alert events are appended, in batches of up to batch_size.
+        When the queue already holds max_queue values, new values are dropped and counted.
+        """
+        self.evaluate = evaluate
+        self.alert_log = alert_log
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=max_queue)
+
+        # Counters
+        self.submitted = 0
+        self.dropped = 0
+        self.written = 0
+        self.errors = 0
+        self.evaluation_errors = 0
+        self.max_depth = 0
+
+        self.thread = threading.Thread(target=self.run, name="alert_worker", daemon=True)
+        self.thread.start()
+
+    def submit(self, alert, value, host):
+        """
+        This method pushes a value to the queue without blocking.
+        It returns False when the queue is full and the value was dropped.
+        """
+        try:
+            self.queue.put_nowait((alert, value, host, time.time()))
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+        self.submitted += 1
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+        return True
+
+    def depth(self):
+        """
+        This method returns the number of values waiting in the queue.
+        """
+        return self.queue.qsize()
+
+    def stats(self):
+        """
+        This method returns the counters of the worker.
+        """
+        return {
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "written": self.written,
+            "errors": self.errors,
+            "evaluation_errors": self.evaluation_errors,
+            "depth": self.depth(),
+            "max_depth": self.max_depth,
+        }
+
+    # =============== Worker Thread ===============
+    def run(self):
+        """
+        This method consumes the queue until close() is called.
+        Each iteration waits for one value, then drains whatever else is already queued,
+        so bursts of alerts are written with a single append.
+        """
+        running = True
+
+        while running:
+            items = [self.queue.get()]
+
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            alert_events = []
+            for item in items:
+                # None is the signal sent by close()
+                if item is None:
+                    running = False
+                    continue
+
+                # e.g. a bad rule value or a failing anomaly detector, which must not stop the other alerts
+                try:
+                    alert_event = self.evaluate(*item)
+                except Exception as e:
+                    self.evaluation_errors += 1
+                    print(f"Error evaluating alert {item[0]}: {e}")
+                    continue
+
+                if alert_event is not None:
+                    alert_events.append(alert_event)
+
+            self.write(alert_events)
+
+        try:
+            self.alert_log.sync()
+        except Exception as e:
+            self.errors += 1
+            print(f"Error syncing alerts: {e}")
+
+    def write(self, alert_events):
+        if not alert_events:
+            return
+
+        try:
+            self.alert_log.append_many(alert_events)
+            self.written += len(alert_events)
+        except Exception as e:
+            self.errors += 1
+            print(f"Error dumping alerts: {e}")
+
+    def close(self, timeout=5.0):
+        """
+        This method flushes the queue and stops the worker.
+        It waits at most timeout seconds for the queued values to be written,
+        and returns False when the worker is still running after that.
+        """
+        if not self.thread.is_alive():
+            return True
+
+        # Blocks only if the queue is full, which the worker is draining
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            print("Alert queue did not drain in time, some alerts were lost.")
+            return False
+
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
@@ -0,0 +1,133 @@
+"""
+This module is used to learn the normal values of a metric online, and to score how far
+a new value is from them, as an alternative to a fixed threshold.
+
+Each detector keeps a handful of numbers, and updates them in O(1) per value:
++ EwmaDetector: exponentially weighted mean and variance; the score is the z-score
++ RobustDetector: exponentially weighted median and mean absolute deviation, with each
+  update clipped so that spikes barely move the baseline; the score is a robust z-score
+
+The score is negative for values below the baseline; the alert rules only fire on high scores.
+The score is 0 until the detector has seen warmup values.
+The state of a detector can be saved and restored, so a restart does not relearn from scratch.
+"""
+
+import math
+
+def z_score(diff, scale):
+    if scale > 0:
+        return diff / scale
+
+    return math.copysign(math.inf, diff) if diff else 0.0
+
+class EwmaDetector:
+    __slots__ = ("alpha", "warmup", "min_scale", "count", "mean", "variance")
+
+    def __init__(self, alpha=0.05, warmup=30, min_scale=0.0):
+        """
+        alpha is the weight of a new value (the baseline forgets half of its history in about 0.7 / alpha values).
+        min_scale is the smallest deviation used in the score, so that a metric that is usually flat
+        (e.g. an idle disk) does not score infinity on its first small change.
+        """
+        self.alpha = alpha
+        self.warmup = warmup
+        self.min_scale = min_scale
+
+        self.count = 0
+        self.mean = 0.0
+        self.variance = 0.0
+
+    def scale(self):
+        return max(math.sqrt(self.variance), self.min_scale)
+
+    def update(self, value):
+        """
+        This method scores a value against the baseline, then adds it to the baseline.
+        """
+        if self.count == 0:
+            self.count = 1
+            self.mean = float(value)
+            return 0.0
+
+        score = z_score(value - self.mean, self.scale()) if self.count >= self.warmup else 0.0
+
+        # Incremental mean and variance (West, 1979)
+        diff = value - self.mean
+        increment = self.alpha * diff
+        self.mean += increment
+        self.variance = (1 - self.alpha) * (self.variance + diff * increment)
+        self.count += 1
+
+        return score
+
+    def baseline(self):
+        return self.mean
+
+    def state(self):
+        return {"count": self.count, "mean": self.mean, "variance": self.variance}
+
+    def restore(self, state):
+        self.count = int(state["count"])
+        self.mean = float(state["mean"])
+        self.variance = float(state["variance"])
+
+class RobustDetector:
+    __slots__ = ("alpha", "warmup", "min_scale", "clip", "count", "median", "deviation")
+
+    # Ratio between the standard deviation and the mean absolute deviation of a normal distribution
+    NORMAL_RATIO = math.sqrt(math.pi / 2)
+
+    def __init__(self, alpha=0.05, warmup=30, min_scale=0.0, clip=3.0):
+        """
+        alpha, warmup and min_scale are the same as for EwmaDetector.
+        A value further than clip deviations from the median only moves the baseline as much as
+        a value clip deviations away, so a burst of spikes does not drag the baseline up.
+        """
+        self.alpha = alpha
+        self.warmup = warmup
+        self.min_scale = min_scale
+        self.clip = clip
+
+        self.count = 0
+        self.median = 0.0
+        self.deviation = 0.0
+
+    def scale(self):
+        return max(self.deviation * self.NORMAL_RATIO, self.min_scale)
+
+    def update(self, value):
+        """
+        This method scores a value against the baseline, then adds it to the baseline.
+        """
+        if self.count == 0:
+            self.count = 1
+            self.median = float(value)
+            return 0.0
+
+        scale = self.scale()
+        diff = value - self.median
+        score = z_score(diff, scale) if self.count >= self.warmup else 0.0
+
+        # Nothing is clipped until some deviation has been seen
+        limit = self.clip * scale if scale > 0 else math.inf
+        self.median += self.alpha * max(-limit, min(diff, limit))
+        self.deviation += self.alpha * (min(abs(diff), limit) - self.deviation)
+        self.count += 1
+
+        return score
+
+    def baseline(self):
+        return self.median
+
+    def state(self):
+        return {"count": self.count, "median": self.median, "deviation": self.deviation}
+
+    def restore(self, state):
+        self.count = int(state["count"])
+        self.median = float(state["median"])
+        self.deviation = float(state["deviation"])
+
+DETECTORS = {
+    "ewma": EwmaDetector,
+    "robust": RobustDetector,
+}
@@ -3,36 +3,68 @@ This script collects metrics such as CPU/RAM usage, disk usage, etc. every 5 sec
 which then exposes them to Prometheus.
 
 The script uses the psutil library to collect the metrics.
+Every source is sampled once per collection cycle into a snapshot shared by all callbacks.
+The metrics, and the sources they are collected from, are declared in a registry (see metric_registry.py).
 It also uses OpenTelemetry to create and manage the metrics.
 The script also uses an AlertManager class to manage alerts.
+It runs in an asyncio event loop, which also runs the async collection tasks, and it flushes
+the last metrics before exiting on SIGINT or SIGTERM.
 The program uses an OOP approach to organize the code and make it more modular.
 """
 
 # =================================================================================
 
 # Importing libraries
+import asyncio
+import math
+import signal
+import threading
 import time
 import os
 import sys
 from alert_manager import AlertManager
+from system_snapshot import SnapshotSampler, BREAKDOWN_ATTRIBUTES, DEFAULT_SOURCES
+from proc_sampler import ProcSampler
+from cgroup_sampler import CgroupSampler, find_cgroup, in_container
+from window_sampler import WindowSampler, STATS
+from export_spool import ExportSpool, SpoolingExporter
+from transport import create_transport
+from exposition import ExpositionExporter, ExpositionServer
+from power_scheduler import PowerScheduler, CoalescingExporter
+from sensor_cache import SensorCache, sensors_available
+from filesystem_collector import FilesystemCollector
+from process_collector import ProcessCollector
+from self_metrics import SelfMetrics
+from metric_registry import INSTRUMENTS, load_registry, split
+from device_filter import DeviceFilter
 
-from psutil import cpu_percent, virtual_memory, net_io_counters, disk_io_counters
 from opentelemetry import metrics
 from opentelemetry.sdk.resources import Resource, SERVICE_NAME
 from opentelemetry.sdk.metrics import MeterProvider
 from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
-from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
 
 # =================================================================================
 
 class SystemMonitor:
+    export_interval_millis = 5000
+
     def __init__(self):
+        self.set_tasks()
+        self.detect_device_type()
+        self.set_sensor_cache()
+        self.set_power_scheduler()
         self.set_exporters()
         self.set_meter()
+        self.set_self_metrics()
+        self.set_registry()
+        self.set_sampler()
+        self.set_filesystem_collector()
+        self.set_process_collector()
         self.set_metrics()
         self.set_resource()
-        self.detect_device_type()
-        self.alert_manager = AlertManager(self.device_type)
+
+        # In a container, cpu_usage and ram_usage are percentages of its limits, and have thresholds of their own
+        self.alert_manager = AlertManager("Container" if isinstance(self.sampler, CgroupSampler) else self.device_type)
 
     # =============== OpenTelemetry Setup ===============
     def set_resource(self):
@@ -46,15 +78,83 @@ class SystemMonitor:
         """
         This method sets up the exporters.
         The OTLP Collector is used to collect the data, then expose and send them to Prometheus.
+        The protocol (OTLP_PROTOCOL), the compression (OTLP_COMPRESSION) and the temporality (OTLP_TEMPORALITY) are set in transport.py.
+        While the collector is unreachable, the metrics are kept in a spool of up to EXPORT_SPOOL_MAX_MB (64 by default).
+        Set OTLP_EXPORT to "false" to skip the collector, when Prometheus scrapes the monitor directly (see set_exposition).
+        """
+        self.collector_exporter = None
+
+        if os.getenv("OTLP_EXPORT", "true").lower() != "false":
+            temporality = os.getenv("OTLP_TEMPORALITY", "cumulative").lower()
+
+            # The exposition is rendered from the same exports, and Prometheus expects cumulative values
+            if int(os.getenv("PROMETHEUS_PORT", 0)) > 0 and temporality != "cumulative":
+                print("The Prometheus exposition needs cumulative temporality, ignoring OTLP_TEMPORALITY")
+                temporality = "cumulative"
+
+            self.collector_exporter, sender = create_transport(
+                os.getenv("IP_ADDR"),
+                protocol=os.getenv("OTLP_PROTOCOL", "http/protobuf"),
+                compression=os.getenv("OTLP_COMPRESSION", "gzip"),
+                temporality=temporality,
+            )
+
+            # Batches that fail to export are spooled to disk and replayed once the collector is back
+            spool_size = int(os.getenv("EXPORT_SPOOL_MAX_MB", 64))
+            spool_dir = os.getenv("EXPORT_SPOOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "spool"))
+            if spool_size > 0:
+                self.collector_exporter = SpoolingExporter(
+                    self.collector_exporter,
+                    ExportSpool(spool_dir, max_bytes=spool_size * 1048576),
+                    sender,
+                )
+
+            # On battery, the collections are sent together to save radio wakeups
+            if self.power_scheduler is not None:
+                self.collector_exporter = CoalescingExporter(
+                    self.collector_exporter,
+                    export_delay=float(os.getenv("POWER_EXPORT_DELAY", 60)),
+                )
+                self.power_scheduler.exporter = self.collector_exporter
+
+        self.set_exposition()
+
+    def set_exposition(self):
+        """
+        This method sets up the Prometheus exposition, if PROMETHEUS_PORT is set.
+        The metrics are rendered once per collection cycle (see exposition.py) and served on /metrics,
+        gzipped for the scrapers that accept it unless PROMETHEUS_GZIP is set to "false".
+        The metrics are still sent to the collector, unless OTLP_EXPORT is set to "false".
         """
-        self.collector_exporter = OTLPMetricExporter(endpoint=f"http://{os.getenv('IP_ADDR')}:4318/v1/metrics")
+        self.exposition = None
+        self.exposition_server = None
+
+        port = int(os.getenv("PROMETHEUS_PORT", 0))
+        if port > 0:
+            self.exposition = ExpositionExporter(
+                self.collector_exporter,
+                gzip_enabled=os.getenv("PROMETHEUS_GZIP", "true").lower() != "false",
+            )
+            self.exposition_server = ExpositionServer(self.exposition, port)
 
     def set_readers(self):
         """
         This method sets up the readers.
         PeriodicExportingMetricReader is used to collect the metrics every 5 seconds.
+        With the power scheduler, the reader does not collect on its own; collect_adaptively() triggers the collections.
+        The exposition, when enabled, renders every export before passing it on to the collector's exporter.
         """
-        self.collector_reader = PeriodicExportingMetricReader(self.collector_exporter, export_interval_millis=5000)
+        exporter = self.exposition if self.exposition is not None else self.collector_exporter
+
+        if exporter is None:
+            raise ValueError("Nothing to export the metrics to: set PROMETHEUS_PORT, or do not set OTLP_EXPORT to false")
+
+        # Time the exports, to report their latency and failures
+        if self.self_metrics is not None:
+            exporter = self.self_metrics.timed_exporter(exporter)
+
+        interval = math.inf if self.power_scheduler is not None else self.export_interval_millis
+        self.collector_reader = PeriodicExportingMetricReader(exporter, export_interval_millis=interval)
 
     def set_meter(self):
         """
@@ -71,176 +171,721 @@ class SystemMonitor:
         self.provider = MeterProvider(metric_readers=[self.collector_reader], resource=self.resource)
         metrics.set_meter_provider(self.provider)
 
+    def set_power_scheduler(self):
+        """
+        This method sets up the power scheduler (see power_scheduler.py), which collects and exports
+        the metrics less often on battery and while idle, and at the usual interval near an alert.
+        It is enabled on Android by default; set POWER_AWARE to "true" or "false" to choose.
+        The interval is multiplied by POWER_BATTERY_FACTOR on battery (4 by default, twice that below
+        POWER_LOW_BATTERY percent, 20 by default), and by POWER_IDLE_FACTOR (2 by default) while idle,
+        up to POWER_MAX_INTERVAL seconds (60 by default), the longest an alert can be late.
+        """
+        self.power_scheduler = None
+
+        power_aware = os.getenv("POWER_AWARE", "auto").lower()
+        if power_aware == "true" or (power_aware == "auto" and self.device_type == "Android"):
+            self.power_scheduler = PowerScheduler(
+                base_interval=self.export_interval_millis / 1000,
+                max_interval=float(os.getenv("POWER_MAX_INTERVAL", 60)),
+                battery_factor=float(os.getenv("POWER_BATTERY_FACTOR", 4)),
+                low_battery=float(os.getenv("POWER_LOW_BATTERY", 20)),
+                idle_factor=float(os.getenv("POWER_IDLE_FACTOR", 2)),
+            )
+
+            # The battery is read from the sensor cache, off the collection path
+            if self.sensor_cache is not None:
+                self.power_scheduler.battery_reader = self.sensor_cache.battery
+
+    def set_sensor_cache(self):
+        """
+        This method sets up the sensor cache (see sensor_cache.py), unless SENSORS is set to "false".
+        The temperature sensors and the battery are read by a background thread every SENSORS_INTERVAL seconds
+        (30 by default); readings older than SENSORS_MAX_AGE seconds (three intervals by default) are flagged as stale.
+        """
+        self.sensor_cache = None
+
+        if os.getenv("SENSORS", "true").lower() != "false" and sensors_available():
+            interval = float(os.getenv("SENSORS_INTERVAL", 30))
+            max_age = os.getenv("SENSORS_MAX_AGE")
+            self.sensor_cache = SensorCache(interval, max_age=float(max_age) if max_age else None)
+
+    def set_self_metrics(self):
+        """
+        This method sets up the agent's own metrics (see self_metrics.py), unless SELF_METRICS is set to "false".
+        """
+        self.self_metrics = None
+
+        if os.getenv("SELF_METRICS", "true").lower() != "false":
+            self.self_metrics = SelfMetrics(self)
+
+    def timed(self, name, callback):
+        """
+        This method wraps a callback so that its duration is reported in the agent's own metrics.
+        """
+        if self.self_metrics is None:
+            return callback
+
+        return self.self_metrics.timed(name, callback)
+
+    def set_registry(self):
+        """
+        This method loads the metrics to collect, and the sources they come from, from the registry.
+        In a container with cgroup v2, the metrics are read from its cgroup (see cgroup_sampler.py),
+        and the container source is collected by default.
+        """
+        backend = os.getenv("METRICS_BACKEND", "auto").lower()
+        self.cgroup = None
+
+        if backend == "cgroup" or (backend == "auto" and self.device_type == "Linux" and in_container()):
+            self.cgroup = find_cgroup()
+
+            if self.cgroup is None and backend == "cgroup":
+                print("No cgroup v2 found, falling back to the /proc backend")
+
+        default_sources = DEFAULT_SOURCES + ("container",) if self.cgroup is not None else DEFAULT_SOURCES
+        self.metric_config = load_registry(default_sources)
+
+    def create_sampler(self):
+        """
+        This method creates a snapshot sampler of the enabled sources.
+        In a container with cgroup v2, the cgroup backend is used; elsewhere on Linux, the /proc backend is used,
+        unless METRICS_BACKEND is set to "psutil".
+        """
+        backend = os.getenv("METRICS_BACKEND", "auto").lower()
+        sources = self.metric_config["sources"]
+
+        if self.cgroup is not None:
+            try:
+                return CgroupSampler(self.cgroup, sources=sources)
+            except OSError as e:
+                print(f"Could not use the cgroup backend, falling back to /proc: {e}")
+                self.cgroup = None
+
+        # Only the cgroup backend reads the container source
+        if "container" in sources:
+            print("The container source needs cgroup v2, it is not collected")
+            sources = tuple(source for source in sources if source != "container")
+
+        if backend in ("proc", "cgroup") or (backend == "auto" and self.device_type == "Linux"):
+            try:
+                return ProcSampler(sources=sources)
+            except OSError as e:
+                print(f"Could not use the /proc backend, falling back to psutil: {e}")
+
+        return SnapshotSampler(sources=sources)
+
+    def set_sampler(self):
+        """
+        This method sets up the snapshot sampler.
+        The sampler reads every source once per collection cycle, and all callbacks read from its snapshot.
+        If SAMPLE_INTERVAL_MS is set, a window sampler also samples the system at that rate between exports.
+        The sources set in the breakdown settings of the registry are broken down per core, disk or interface.
+        When COLLECT_DEADLINE_MS is set (0, waiting for every source, by default), each source must answer within
+        that many milliseconds, or its last values are exported as stale (see SnapshotSampler.set_deadline()).
+        """
+        self.sampler = self.create_sampler()
+
+        breakdown = self.metric_config["breakdown"]
+        self.sampler.set_breakdown({
+            source: DeviceFilter(breakdown["include"], breakdown["exclude"], breakdown["max_series"])
+            for source in breakdown["sources"]
+        })
+
+        # A source that blocks must not hold up the whole collection; opt-in, since the thread pool triples the sampling cost
+        deadline = int(os.getenv("COLLECT_DEADLINE_MS", 0))
+        if deadline > 0:
+            self.sampler.set_deadline(deadline / 1000)
+
+        self.window_sampler = None
+
+        sample_interval = int(os.getenv("SAMPLE_INTERVAL_MS", 0))
+        if sample_interval > 0:
+            # The window sampler runs in its own thread, so it gets its own sampler
+            self.window_sampler = WindowSampler(
+                self.create_sampler(),
+                interval=sample_interval / 1000,
+                export_interval=self.export_interval_millis / 1000,
+            )
+
+    def set_filesystem_collector(self):
+        """
+        This method sets up the filesystem collector (see filesystem_collector.py), unless FILESYSTEMS is set to "false".
+        Each collection waits at most FILESYSTEM_TIMEOUT seconds (0.5 by default) for the mounts to answer.
+        The mount points can be filtered with FILESYSTEM_INCLUDE and FILESYSTEM_EXCLUDE (snap and Docker mounts
+        are left out by default), and at most FILESYSTEM_MAX_SERIES mounts are reported (64 by default).
+        """
+        self.filesystem_collector = None
+
+        if os.getenv("FILESYSTEMS", "true").lower() != "false":
+            self.filesystem_collector = FilesystemCollector(
+                DeviceFilter(
+                    split(os.getenv("FILESYSTEM_INCLUDE", "")),
+                    split(os.getenv("FILESYSTEM_EXCLUDE", "/snap/*,/var/lib/docker/*")),
+                    int(os.getenv("FILESYSTEM_MAX_SERIES", 64)),
+                ),
+                timeout=float(os.getenv("FILESYSTEM_TIMEOUT", 0.5)),
+            )
+
+    def set_process_collector(self):
+        """
+        This method sets up the process collector (see process_collector.py) when PROCESSES is set to "true".
+        The PROCESS_TOP_N processes using the most CPU (10 by default), and the PROCESS_TOP_N using the most memory,
+        are reported, up to PROCESS_MAX_SERIES processes in total (20 by default).
+        The processes are read again every PROCESS_INTERVAL seconds (15 by default), in a background thread.
+        """
+        self.process_collector = None
+
+        if os.getenv("PROCESSES", "false").lower() == "true":
+            self.process_collector = ProcessCollector(
+                top_n=int(os.getenv("PROCESS_TOP_N", 10)),
+                max_series=int(os.getenv("PROCESS_MAX_SERIES", 20)),
+                interval=float(os.getenv("PROCESS_INTERVAL", 15)),
+            )
+
     def set_metrics(self):
         """
-        This method sets up the metrics.
-        The CPU and RAM usage metrics are created as observable counters.
+        This method sets up the metrics declared in the registry (see metric_registry.py).
+        Each metric gets an instrument of its declared type, with a callback reading its field from the snapshot.
+        A metric declared more than once (e.g. tcp_connections, once per state) gets one callback reporting every declaration.
         """
-        self.cpu_gauge = self.meter.create_observable_counter(
-            "cpu_usage_total",
-            callbacks=[self.cpu_callback],
-            description="CPU usage percentage",
-        )
+        self.instruments = {}
+        self.callbacks = {}
+        declarations = {}
+
+        for metric in self.metric_config["metrics"]:
+            if metric.get("breakdown"):
+                callback = self.breakdown_callback(
+                    metric["source"],
+                    metric["field"],
+                    scale=metric.get("scale", 1),
+                    attributes=metric.get("attributes", {}),
+                )
+            else:
+                callback = self.snapshot_callback(
+                    metric["field"],
+                    source=metric["source"],
+                    alert=metric.get("alert"),
+                    scale=metric.get("scale", 1),
+                    attributes=metric.get("attributes", {}),
+                )
+            declarations.setdefault(metric["name"], []).append((metric, callback))
+
+        for name, declared in declarations.items():
+            metric = declared[0][0]
+            callbacks = [callback for _, callback in declared]
+            create = getattr(self.meter, INSTRUMENTS[metric["instrument"]])
+
+            self.callbacks[name] = callbacks[0] if len(callbacks) == 1 else self.merged_callback(callbacks)
+            self.instruments[name] = create(
+                name,
+                callbacks=[self.timed(name, self.callbacks[name])],
+                description=metric.get("description", ""),
+                unit=metric.get("unit", ""),
+            )
+
+        if self.window_sampler is not None:
+            self.set_window_metrics()
+
+        if self.sensor_cache is not None:
+            self.set_sensor_metrics()
+
+        if self.filesystem_collector is not None:
+            self.set_filesystem_metrics()
+
+        if self.process_collector is not None:
+            self.set_process_metrics()
+
+    def set_window_metrics(self):
+        """
+        This method sets up the window metrics.
+        Each sampled field is exported as a gauge with one observation per statistic (min, max, mean and p95).
+        Counter fields are summarised as per-second rates.
+        """
+        self.window_gauges = {}
+
+        for field in self.window_sampler.gauges:
+            self.window_gauges[field] = self.meter.create_observable_gauge(
+                f"{field}_window",
+                callbacks=[self.timed(f"{field}_window", self.window_callback(field))],
+                description=f"{field.replace('_', ' ').capitalize()} over the last export interval",
+            )
+
+        for field in self.window_sampler.counters:
+            self.window_gauges[field] = self.meter.create_observable_gauge(
+                f"{field}_rate_window",
+                callbacks=[self.timed(f"{field}_rate_window", self.window_callback(field))],
+                description=f"{field.replace('_', ' ').capitalize()} per second over the last export interval",
+            )
+
+    # Callback function for the registry metrics
+    def snapshot_callback(self, field, source=None, alert=None, scale=1, attributes={}):
+        """
+        This method returns the callback of one metric of the registry.
+        The callback reads the field from the snapshot, multiplied by scale,
+        and checks for alerts on it using the AlertManager class if the metric has an alert.
+        Nothing is reported while the field has no value, e.g. a rate before two snapshots have been taken.
+        With a collection deadline, the value has a "stale" attribute, "true" when its source missed the deadline;
+        stale values are not checked for alerts again.
+        """
+        fresh_attributes, stale_attributes = self.stale_attributes(attributes)
 
-        self.ram_gauge = self.meter.create_observable_counter(
-            "ram_usage_total",
-            callbacks=[self.ram_callback],
-            description="RAM usage percentage",
-        )
+        def callback(options: metrics.CallbackOptions) -> list[metrics.Observation]:
+            snapshot = self.sampler.get()
+            value = getattr(snapshot, field)
 
-        self.disk_usage = self.meter.create_observable_counter(
-            "disk_usage_total",
-            callbacks=[self.disk_callback],
-            description="Disk usage percentage",
-        )
+            if value is None:
+                return []
 
-        self.disk_read = self.meter.create_observable_counter(
-            "disk_read_total",
-            callbacks=[self.disk_read_callback],
-            description="Disk read in bytes",
-        )
+            value *= scale
 
-        self.disk_write = self.meter.create_observable_counter(
-            "disk_write_total",
-            callbacks=[self.disk_write_callback],
-            description="Disk write in bytes",
-        )
+            if source in snapshot.stale:
+                return [metrics.Observation(value=value, attributes=stale_attributes)]
+
+            if alert is not None:
+                self.alert_manager.check_alerts(alert, value, snapshot.host)
+
+                if self.power_scheduler is not None:
+                    self.power_scheduler.observe(self.alert_manager.proximity(alert, value))
+
+            return [metrics.Observation(value=value, attributes=fresh_attributes)]
+
+        return callback
 
-        self.network_sent = self.meter.create_observable_counter(
-            "network_sent_total",
-            callbacks=[self.network_sent_callback],
-            description="Network sent in bytes",
+    @staticmethod
+    def merged_callback(callbacks):
+        """
+        This method returns a callback reporting the observations of several callbacks.
+        """
+        def callback(options: metrics.CallbackOptions) -> list[metrics.Observation]:
+            return [observation for part in callbacks for observation in part(options)]
+
+        return callback
+
+    def stale_attributes(self, attributes):
+        """
+        This method returns the attributes of a fresh and of a stale value.
+        The "stale" attribute is only added when the sources have a deadline.
+        """
+        if self.sampler.deadline is None:
+            return attributes, attributes
+
+        return dict(attributes, stale="false"), dict(attributes, stale="true")
+
+    def set_sensor_metrics(self):
+        """
+        This method sets up the sensor metrics, read from the sensor cache.
+        Every reading has a "stale" attribute, "true" when the cache was not refreshed in time.
+        At most SENSORS_MAX_SERIES temperature sensors are reported (64 by default).
+        """
+        self.temperature_filter = DeviceFilter(max_series=int(os.getenv("SENSORS_MAX_SERIES", 64)))
+        sensor_metrics = {
+            "sensor_temperature": (self.temperature_callback, "Temperature of each sensor", "Cel"),
+            "battery_charge": (self.battery_callback(0), "Battery charge percentage", "%"),
+            "battery_time_left": (self.battery_callback(1), "Estimated battery time left in seconds", "s"),
+            "battery_plugged": (self.battery_callback(2), "Whether the device is plugged in (1) or on battery (0)", ""),
+            "sensor_reading_age": (self.sensor_age_callback, "Age of the sensor readings in seconds", "s"),
+        }
+
+        for name, (callback, description, unit) in sensor_metrics.items():
+            self.callbacks[name] = callback
+            self.instruments[name] = self.meter.create_observable_gauge(
+                name,
+                callbacks=[self.timed(name, callback)],
+                description=description,
+                unit=unit,
+            )
+
+    def set_filesystem_metrics(self):
+        """
+        This method sets up the filesystem metrics, with one series per mount point.
+        Every value has a "stale" attribute, "true" when the mount did not answer in time and its last known value is reported.
+        """
+        filesystem_metrics = {
+            "filesystem_size": ("size", "Size of each filesystem in bytes", "By"),
+            "filesystem_used": ("used", "Space used on each filesystem in bytes", "By"),
+            "filesystem_free": ("free", "Space available to users on each filesystem in bytes", "By"),
+            "filesystem_usage": ("percent", "Percentage of the space of each filesystem that is used", "%"),
+            "filesystem_inodes_usage": ("inodes_percent", "Percentage of the inodes of each filesystem that are used", "%"),
+        }
+
+        for name, (field, description, unit) in filesystem_metrics.items():
+            callback = self.filesystem_callback(field)
+            self.callbacks[name] = callback
+            self.instruments[name] = self.meter.create_observable_gauge(
+                name,
+                callbacks=[self.timed(name, callback)],
+                description=description,
+                unit=unit,
+            )
+
+        self.instruments["filesystem_timeouts_total"] = self.meter.create_observable_counter(
+            "filesystem_timeouts_total",
+            callbacks=[lambda options: [metrics.Observation(self.filesystem_collector.timeouts)]],
+            description="Number of times a filesystem did not answer in time",
         )
 
-        self.network_recv = self.meter.create_observable_counter(
-            "network_recv_total",
-            callbacks=[self.network_recv_callback],
-            description="Network received in bytes",
+    def set_process_metrics(self):
+        """
+        This method sets up the metrics of the top processes, with "pid" and "name" attributes.
+        """
+        process_metrics = {
+            "process_cpu_usage": ("cpu_usage", "Share of the CPU of the host used by each top process", "%"),
+            "process_memory_rss": ("rss", "Resident memory of each top process in bytes", "By"),
+        }
+
+        for name, (field, description, unit) in process_metrics.items():
+            callback = self.process_callback(field)
+            self.callbacks[name] = callback
+            self.instruments[name] = self.meter.create_observable_gauge(
+                name,
+                callbacks=[self.timed(name, callback)],
+                description=description,
+                unit=unit,
+            )
+
+        self.instruments["process_count"] = self.meter.create_observable_gauge(
+            "process_count",
+            callbacks=[lambda options: [metrics.Observation(self.process_collector.count())]],
+            description="Number of processes running on the host",
         )
 
-    # Callback function for Total CPU usage metric
-    def cpu_callback(self, options: metrics.CallbackOptions) -> list[metrics.Observation]:
-        """
-        This method is called every 5 seconds to collect the CPU usage metrics.
-        It uses the psutil library to get the CPU usage percentage.
-        The CPU usage percentage is returned as an observation.
-        The observation is a list of metrics.Observation objects.
-        It also checks for alerts using the AlertManager class.
-        """
-        cpu_usage = cpu_percent(interval=None)
-        self.alert_manager.check_alerts("cpu_usage", cpu_usage, os.getenv("HOST"))
-
-        return [metrics.Observation(value=cpu_usage, attributes={})]
-    
-    # Callback function for Total RAM Usage metric
-    def ram_callback(self, options: metrics.CallbackOptions) -> list[metrics.Observation]:
-        """
-        This method is called every 5 seconds to collect the RAM usage metrics.
-        It uses the psutil library to get the RAM usage percentage.
-        The RAM usage percentage is returned as an observation.
-        The observation is a list of metrics.Observation objects.
-        It also checks for alerts using the AlertManager class.
-        """
-        ram_usage = virtual_memory().percent
-        self.alert_manager.check_alerts("memory_usage", ram_usage, os.getenv("HOST"))
-
-        return [metrics.Observation(value=ram_usage, attributes={})]
-    
-    # Callback function for Total Disk Usage metric
-    def disk_callback(self, options: metrics.CallbackOptions) -> list[metrics.Observation]:
-        """
-        This method is called every 5 seconds to collect the Disk usage metrics.
-        It uses the psutil library to get the Disk busy time in milliseconds
-        during 4 seconds, then divides it by 4000 to get the percentage.
-        The Disk busy time percentage is returned as an observation.
-        The observation is a list of metrics.Observation objects.
-        It also checks for alerts using the AlertManager class.
-        """
-        disk_total = disk_io_counters().busy_time / 1000
-
-        self.alert_manager.check_alerts("disk_usage", disk_total, os.getenv("HOST"))
-
-        return [metrics.Observation(value=disk_total, attributes={})]
-    
-    # Callback function for Disk Read metric
-    def disk_read_callback(self, options: metrics.CallbackOptions) -> list[metrics.Observation]:
-        """
-        This method is called every 5 seconds to collect the Disk read metrics.
-        It uses the psutil library to get the Disk read in bytes.
-        The Disk read in bytes is returned as an observation.
-        The observation is a list of metrics.Observation objects.
-        It also checks for alerts using the AlertManager class.
-        """
-        disk_read = disk_io_counters().read_time
-        self.alert_manager.check_alerts("disk_read", disk_read, os.getenv("HOST"))
-
-        return [metrics.Observation(value=disk_read, attributes={})]
-    
-    # Callback function for Disk Write metric
-    def disk_write_callback(self, options: metrics.CallbackOptions) -> list[metrics.Observation]:
-        """
-        This method is called every 5 seconds to collect the Disk write metrics.
-        It uses the psutil library to get the Disk write in bytes.
-        The Disk write in bytes is returned as an observation.
-        The observation is a list of metrics.Observation objects.
-        It also checks for alerts using the AlertManager class.
-        """
-        disk_write = disk_io_counters().write_time
-        self.alert_manager.check_alerts("disk_write", disk_write, os.getenv("HOST"))
-
-        return [metrics.Observation(value=disk_write, attributes={})]
-    
-    # Callback functions for Network Sent metric
-    def network_sent_callback(self, options: metrics.CallbackOptions) -> list[metrics.Observation]:
-        """
-        This method is called every 5 seconds to collect Network metrics (sent).
-        It uses the psutil library to get the Network sent in bytes.
-        The Network sent in bytes is returned as an observation.
-        The observation is a list of metrics.Observation objects.
-        It also checks for alerts using the AlertManager class.
-        """
-        net_sent = net_io_counters().bytes_sent
-        self.alert_manager.check_alerts("network_sent", net_sent, os.getenv("HOST"))
-
-        return [metrics.Observation(value=net_sent, attributes={})]
-    
-    # Callback function for Network Received metric
-    def network_recv_callback(self, options: metrics.CallbackOptions) -> list[metrics.Observation]:
-        """
-        This method is called every 5 seconds to collect Network metrics (received).
-        It uses the psutil library to get the Network sent in bytes.
-        The Network sent in bytes is returned as an observation.
-        The observation is a list of metrics.Observation objects.
-        It also checks for alerts using the AlertManager class.
-        """
-        net_recv = net_io_counters().bytes_recv
-        self.alert_manager.check_alerts("network_recv", net_recv, os.getenv("HOST"))
-
-        return [metrics.Observation(value=net_recv, attributes={})]
+    # Callback function for the process metrics
+    def process_callback(self, field):
+        """
+        This method returns the callback of one process metric.
+        The processes are collected in a background thread every PROCESS_INTERVAL, and the callbacks only read the last ranking.
+        """
+        def callback(options: metrics.CallbackOptions) -> list[metrics.Observation]:
+            return [
+                metrics.Observation(value=getattr(entry, field), attributes=entry.attributes)
+                for entry in self.process_collector.get()
+            ]
+
+        return callback
+
+    # Callback function for the filesystem metrics
+    def filesystem_callback(self, field):
+        """
+        This method returns the callback of one filesystem metric.
+        The mounts are collected once per cycle, and the callbacks of the same cycle share the values.
+        """
+        # The attributes of each series, built once per mount point and staleness
+        series = {}
+
+        def callback(options: metrics.CallbackOptions) -> list[metrics.Observation]:
+            observations = []
+
+            for partition, usage, stale in self.filesystem_collector.get():
+                value = getattr(usage, field)
+                if value is None:
+                    continue
+
+                key = (partition.mountpoint, stale)
+                attributes = series.get(key)
+                if attributes is None:
+                    attributes = series[key] = {
+                        "mountpoint": partition.mountpoint,
+                        "device": partition.device,
+                        "fstype": partition.fstype,
+                        "stale": "true" if stale else "false",
+                    }
+
+                observations.append(metrics.Observation(value=value, attributes=attributes))
+
+            return observations
+
+        return callback
+
+    # Callback functions for the sensor metrics
+    def temperature_callback(self, options: metrics.CallbackOptions) -> list[metrics.Observation]:
+        readings, _, stale = self.sensor_cache.get()
+
+        if readings is None:
+            return []
+
+        stale = "true" if stale else "false"
+        return [
+            metrics.Observation(value=current, attributes={"chip": chip, "sensor": sensor, "stale": stale})
+            for chip, sensor, current in readings.temperatures
+            if self.temperature_filter.allowed(f"{chip}/{sensor}")
+        ]
+
+    def battery_callback(self, index):
+        """
+        This method returns the callback of one value of the battery: the charge (0), the time left (1)
+        or whether the device is plugged in (2). Nothing is reported without a battery, or when the value is unknown.
+        """
+        def callback(options: metrics.CallbackOptions) -> list[metrics.Observation]:
+            readings, _, stale = self.sensor_cache.get()
+
+            if readings is None or readings.battery is None or readings.battery[index] is None:
+                return []
+
+            return [metrics.Observation(value=int(readings.battery[index]) if index == 2 else readings.battery[index],
+                                        attributes={"stale": "true" if stale else "false"})]
+
+        return callback
+
+    def sensor_age_callback(self, options: metrics.CallbackOptions) -> list[metrics.Observation]:
+        _, age, _ = self.sensor_cache.get()
+        return [] if age is None else [metrics.Observation(value=age)]
+
+    # Callback function for the breakdown metrics
+    def breakdown_callback(self, source, field, scale=1, attributes={}):
+        """
+        This method returns the callback of one breakdown metric of the registry.
+        The callback reports the field of every core, disk or interface of the source in one batch,
+        each with a "cpu", "device" or "interface" attribute naming it.
+        """
+        key = BREAKDOWN_ATTRIBUTES[source]
+        fresh_attributes, stale_attributes = self.stale_attributes(attributes)
+
+        # The attributes of each series, built once per name and staleness (the names are capped by the device filter)
+        series = {}
+
+        def callback(options: metrics.CallbackOptions) -> list[metrics.Observation]:
+            snapshot = self.sampler.get()
+            stale = source in snapshot.stale
+            observations = []
+
+            for name, values in snapshot.breakdown.get(source, {}).items():
+                series_attributes = series.get((name, stale))
+                if series_attributes is None:
+                    base = stale_attributes if stale else fresh_attributes
+                    series_attributes = series[(name, stale)] = dict(base, **{key: name})
+
+                observations.append(metrics.Observation(value=values[field] * scale, attributes=series_attributes))
+
+            return observations
+
+        return callback
+
+    # Callback function for the window metrics
+    def window_callback(self, field):
+        """
+        This method returns the callback of one window metric.
+        The callback reports the min, max, mean and p95 of the field over the last export interval.
+        Nothing is reported when no sample was taken in the window.
+        """
+        def callback(options: metrics.CallbackOptions) -> list[metrics.Observation]:
+            summary = self.window_sampler.get().get(field)
+
+            if summary is None:
+                return []
+
+            return [metrics.Observation(value=summary[stat], attributes={"stat": stat}) for stat in STATS]
+
+        return callback
 
     # =============== Run Function ===============
     def run(self):
         """
-        This method will stall for 5 seconds to let PeriodicExportingMetricReader() collect the metrics.
-        It will also print the metrics to the console.
+        This method runs the event loop until SIGINT or SIGTERM (e.g. from docker stop) is received,
+        or until stop() is called. PeriodicExportingMetricReader() collects the metrics in its own thread.
+        The metrics of the last cycle are then flushed before exiting (see shutdown()).
         """
         print("Starting system monitoring...")
 
         try:
-            self.set_readers()
-            self.set_provider()
-
-            self.running = True
-
-            while self.running:
-                # Keep the program alive, waiting for metrics to be collected
-                time.sleep(5)
+            asyncio.run(self.run_async())
         except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            print(f"An error occurred: {e}")
+        finally:
             self.running = False
+            self.shutdown()
+
+        print("Monitoring stopped.")
+
+    async def run_async(self):
+        """
+        This method starts the exports, the samplers and the async tasks, then waits for a stop signal.
+        Nothing wakes up in between: the loop only runs the async tasks, whenever they are due.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+
+        # Signal handlers can only be set from the main thread; run() from another thread is stopped with stop()
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    self.loop.add_signal_handler(signum, self.stopping.set)
+                except NotImplementedError:
+                    # Windows has no signal handlers in the event loop
+                    signal.signal(signum, lambda *_: self.loop.call_soon_threadsafe(self.stopping.set))
+
+        self.set_readers()
+        self.set_provider()
+
+        if self.window_sampler is not None:
+            self.window_sampler.start()
+
+        if self.sensor_cache is not None:
+            self.sensor_cache.start()
+
+        if self.process_collector is not None:
+            self.process_collector.start()
+
+        if self.exposition_server is not None:
+            self.exposition_server.start()
+            print(f"Serving the metrics on port {self.exposition_server.port}")
+
+        if self.power_scheduler is not None:
+            self.add_task(self.collect_adaptively)
+
+        self.running = True
+
+        for task in self.tasks:
+            self.start_task(task)
+
+        await self.stopping.wait()
+        self.running = False
+
+        for task in self.running_tasks:
+            task.cancel()
+        await asyncio.gather(*self.running_tasks, return_exceptions=True)
+
+    def stop(self):
+        """
+        This method stops run(), from any thread.
+        """
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
 
-            print("Monitoring stopped.")
+    def shutdown(self):
+        """
+        This method flushes the metrics of the last cycle, then stops the exports.
+        The flush is given SHUTDOWN_TIMEOUT seconds (8 by default, within the 10 seconds docker stop waits);
+        past that, the remaining metrics are dropped rather than delaying the exit.
+        The sources are closed once the flush is done, by the flush thread itself when it outlives the timeout,
+        since it still collects through them.
+        """
+        timeout = float(os.getenv("SHUTDOWN_TIMEOUT", 8))
+        deadline = time.monotonic() + timeout
+
+        # Whoever of shutdown() and the flush thread comes last closes the sources
+        self.flush_lock = threading.Lock()
+        self.flush_done = False
+        self.flush_late = False
+
+        if self.window_sampler is not None:
+            self.window_sampler.stop()
+
+        if self.sensor_cache is not None:
+            self.sensor_cache.stop()
+
+        if self.process_collector is not None:
+            self.process_collector.stop()
+
+        flush = threading.Thread(target=self.final_flush, args=(deadline,), name="final_flush", daemon=True)
+        flush.start()
+        flush.join(timeout)
+
+        with self.flush_lock:
+            self.flush_late = not self.flush_done
+
+        if self.exposition_server is not None:
+            self.exposition_server.stop()
+
+        if self.flush_late:
+            print(f"The last metrics were not flushed within {timeout} s, and were dropped.")
+        else:
+            self.close_sources()
+
+    def final_flush(self, deadline):
+        """
+        This method flushes the metrics, then closes the sources if shutdown() stopped waiting for it.
+        """
+        self.flush(deadline)
+
+        with self.flush_lock:
+            self.flush_done = True
+            late = self.flush_late
+
+        if late:
+            self.close_sources()
+
+    def close_sources(self):
+        """
+        This method closes the sampler, the filesystem collector and the alert manager.
+        """
+        if self.filesystem_collector is not None:
+            self.filesystem_collector.close()
+
+        self.sampler.close()
+        self.alert_manager.close()
+
+    def flush(self, deadline):
+        """
+        This method collects and exports the metrics one last time, then shuts the provider down.
+        """
+        if self.provider is None:
+            return
+
+        try:
+            self.provider.force_flush(timeout_millis=max(deadline - time.monotonic(), 0) * 1000)
+            self.provider.shutdown(timeout_millis=max(deadline - time.monotonic(), 0) * 1000)
         except Exception as e:
-            print(f"An error occurred: {e}")
+            print(f"Error flushing the metrics: {e}")
+
+    async def collect_adaptively(self):
+        """
+        This method collects the metrics at the interval chosen by the power scheduler, instead of every 5 seconds.
+        The collection runs in a thread, so the event loop is never blocked by the callbacks.
+        So does the choice of the next interval, which reads the battery from sysfs when there is no sensor cache.
+        """
+        while True:
+            await asyncio.to_thread(self.collector_reader.collect)
+            interval = await asyncio.to_thread(self.power_scheduler.next_interval)
+            await asyncio.sleep(interval)
+
+    # =============== Async Tasks ===============
+    def set_tasks(self):
+        """
+        This method sets up the async tasks, which run in the event loop of run(), next to each other.
+        Collections that mostly wait (slow sensors, probes of other hosts) can run there
+        without a thread each (see add_task()).
+        """
+        self.loop = None
+        self.provider = None
+        self.running = False
+        self.tasks = []
+        self.running_tasks = set()
+
+    def add_task(self, coroutine_function, interval=None, name=None):
+        """
+        This method adds an async task.
+        coroutine_function is awaited every interval seconds, or once if interval is None.
+        An exception is printed, and does not stop the task. Tasks are cancelled on shutdown.
+        """
+        task = (coroutine_function, interval, name or coroutine_function.__name__)
+        self.tasks.append(task)
+
+        if self.running and self.loop is not None:
+            self.loop.call_soon_threadsafe(self.start_task, task)
+
+    def start_task(self, task):
+        running_task = self.loop.create_task(self.run_task(*task), name=task[2])
+        self.running_tasks.add(running_task)
+        running_task.add_done_callback(self.running_tasks.discard)
+
+    async def run_task(self, coroutine_function, interval, name):
+        while True:
+            started = self.loop.time()
+
+            try:
+                await coroutine_function()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Task {name} failed: {e}")
+
+            if interval is None:
+                return
+
+            # Keep to the interval, whatever the task took
+            await asyncio.sleep(max(interval - (self.loop.time() - started), 0))
 
     # =============== Detect Device Function ===============
     def detect_device_type(self):
@@ -0,0 +1,237 @@
+"""
+This module is used to sample the metrics of a container from its cgroup (v2) on Linux.
+In a container, psutil and /proc report the numbers of the whole host: the CPU and memory used by
+every other container, measured against the CPUs and memory of the host instead of the limits of the container.
+
+CgroupSampler is a ProcSampler that reads the CPU, memory and disk sources from the container's cgroup instead:
++ cpu: the CPU time of cpu.stat, as a percentage of the CPU limit (cpu.max, or the CPUs the container may run on)
++ memory: the working set (memory.current minus the inactive file cache of memory.stat, like the kubelet),
+  as a percentage of the memory limit (memory.max, or the memory of the host)
++ disk: the bytes read and written by the container, from io.stat; the busy time is only known per disk, for the host
+The network and TCP sources already read the network namespace of the container.
+
+The container source reports the limits themselves, the time the container was throttled, and the share of the time
+its tasks waited for a CPU (cpu.pressure). Like the /proc files, the cgroup files are opened once and kept open.
+The cpu, memory and container sources share some of them, and may be read in parallel threads (see set_deadline()),
+so each file is read under a lock and its content copied out of the shared buffer.
+"""
+
+import os, threading, time
+from psutil import virtual_memory
+from proc_sampler import ProcSampler, ProcFile
+from system_snapshot import DEFAULT_SOURCES
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# Files read from the cgroup; all but cpu.stat may be missing (a controller that is not enabled, a kernel without PSI)
+CGROUP_FILES = ("cpu.stat", "cpu.max", "cpu.pressure", "memory.current", "memory.max", "memory.stat", "io.stat")
+
+def in_container():
+    """
+    This function tells whether the process runs in a container (Docker, Podman or Kubernetes).
+    """
+    return (
+        os.path.exists("/.dockerenv")
+        or os.path.exists("/run/.containerenv")
+        or "KUBERNETES_SERVICE_HOST" in os.environ
+    )
+
+def find_cgroup(procfs="/proc", root=CGROUP_ROOT):
+    """
+    This function returns the directory of the cgroup v2 of the process,
+    or None when it is not in a cgroup v2 (e.g. a host that still uses cgroup v1).
+    """
+    try:
+        with open(f"{procfs}/self/cgroup", "r") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+
+    for line in lines:
+        # The cgroup v2 line is "0::<path>"; in a private cgroup namespace (the default in Docker), the path is "/"
+        if line.startswith("0::"):
+            path = os.path.normpath(os.path.join(root, line[3:].lstrip("/")))
+
+            if path.startswith(root) and os.path.exists(os.path.join(path, "cgroup.controllers")):
+                return path
+
+    return None
+
+class CgroupSampler(ProcSampler):
+    def __init__(self, path, max_age=1.0, procfs="/proc", sources=DEFAULT_SOURCES):
+        """
+        path is the directory of the cgroup (see find_cgroup()).
+        """
+        super().__init__(max_age, procfs, sources)
+        self.path = path
+        self.lock = threading.Lock()
+
+        self.cgroup_files = {"cpu.stat": ProcFile(f"{path}/cpu.stat", size=1024)}
+        for name in CGROUP_FILES[1:]:
+            if os.path.exists(f"{path}/{name}"):
+                self.cgroup_files[name] = ProcFile(f"{path}/{name}", size=4096 if name.endswith(".stat") else 256)
+
+        # Used when the container has no CPU or memory limit
+        self.cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+        self.host_memory = virtual_memory().total
+
+        # CPU time of the cgroup at the previous sample, used to compute the CPU usage percentage
+        self.last_cpu_usage = (0, None)
+        self.read_cpu_usage()
+
+    # =============== Cgroup Files ===============
+    def read(self, name):
+        """
+        This method re-reads a file of the cgroup, and returns its content, or None when the cgroup does not have it.
+        The content is a copy, so it stays valid while other sources read the same file.
+        """
+        cgroup_file = self.cgroup_files.get(name)
+
+        if cgroup_file is None:
+            return None
+
+        with self.lock:
+            size = cgroup_file.read()
+            return bytes(memoryview(cgroup_file.buffer)[:size])
+
+    @staticmethod
+    def keyed(content):
+        """
+        This method parses a file of "key value" lines, such as cpu.stat or memory.stat.
+        """
+        return {key: int(value) for key, value in (line.split() for line in content.splitlines())}
+
+    def cpu_limit(self):
+        """
+        This method returns the number of CPUs the container may use, from its quota and period in cpu.max.
+        """
+        content = self.read("cpu.max")
+
+        if content is not None:
+            quota, period = content.split()
+            if quota != b"max":
+                return min(int(quota) / int(period), self.cpus)
+
+        return self.cpus
+
+    def memory_limit(self):
+        """
+        This method returns the memory the container may use in bytes, from memory.max.
+        """
+        content = self.read("memory.max")
+
+        if content is not None and content.strip() != b"max":
+            return min(int(content), self.host_memory)
+
+        return self.host_memory
+
+    def memory_usage(self):
+        """
+        This method returns the working set of the container in bytes: the memory it uses, minus the file cache
+        the kernel would reclaim before running out of memory. It returns None without the memory controller.
+        """
+        content = self.read("memory.current")
+
+        if content is None:
+            return None
+
+        stat = self.read("memory.stat")
+        inactive_file = self.keyed(stat).get(b"inactive_file", 0) if stat is not None else 0
+
+        return max(int(content) - inactive_file, 0)
+
+    def cpu_pressure(self):
+        """
+        This method returns the percentage of the last 10 seconds during which some tasks of the container
+        waited for a CPU, or None when the kernel does not report the pressure.
+        """
+        content = self.read("cpu.pressure")
+
+        if content is None:
+            return None
+
+        # some avg10=0.57 avg60=1.41 avg300=1.57 total=62632552
+        for item in content.split(b"\n", 1)[0].split()[1:]:
+            key, _, value = item.partition(b"=")
+            if key == b"avg10":
+                return float(value)
+
+        return None
+
+    def read_cpu_usage(self):
+        """
+        This method returns the CPU usage of the container since the previous call, as a percentage of its CPU limit.
+        """
+        usage = self.keyed(self.read("cpu.stat"))[b"usage_usec"]
+        now = time.monotonic()
+
+        last_usage, last_time = self.last_cpu_usage
+        self.last_cpu_usage = (usage, now)
+
+        if last_time is None or now <= last_time:
+            return 0.0
+
+        available = (now - last_time) * 1e6 * self.cpu_limit()
+        return round(max(usage - last_usage, 0) / available * 100, 1)
+
+    # =============== Sources ===============
+    def sample_cpu(self, snapshot):
+        snapshot.cpu_usage = self.read_cpu_usage()
+
+    def sample_memory(self, snapshot):
+        usage = self.memory_usage()
+
+        if usage is None:
+            super().sample_memory(snapshot)
+            return
+
+        snapshot.ram_usage = round(usage / self.memory_limit() * 100, 1)
+
+    def sample_disk(self, snapshot, devices=None):
+        """
+        This method reads the busy time (and the breakdown) from /proc/diskstats, then the bytes
+        read and written by the container from io.stat, when the cgroup has the io controller.
+        """
+        super().sample_disk(snapshot, devices)
+        content = self.read("io.stat")
+
+        if content is None:
+            return
+
+        read = write = 0
+
+        # 8:0 rbytes=1459200 wbytes=314773504 rios=192 wios=353 dbytes=0 dios=0
+        for line in content.splitlines():
+            for item in line.split()[1:]:
+                key, _, value = item.partition(b"=")
+                if key == b"rbytes":
+                    read += int(value)
+                elif key == b"wbytes":
+                    write += int(value)
+
+        snapshot.disk_read_bytes = read
+        snapshot.disk_write_bytes = write
+
+    def sample_container(self, snapshot):
+        stat = self.keyed(self.read("cpu.stat"))
+
+        snapshot.container_cpu_limit = self.cpu_limit()
+        snapshot.container_cpu_throttled = stat.get(b"throttled_usec", 0) / 1e6
+        snapshot.container_cpu_pressure = self.cpu_pressure()
+        snapshot.container_memory_usage = self.memory_usage()
+        snapshot.container_memory_limit = self.memory_limit()
+
+    # =============== Breakdowns ===============
+    def sample_cpu_breakdown(self, snapshot):
+        # The cores are those of the host, the total is the container's
+        super().sample_cpu_breakdown(snapshot)
+        self.sample_cpu(snapshot)
+
+    def close(self):
+        """
+        This method closes the /proc and cgroup files.
+        """
+        super().close()
+
+        for cgroup_file in self.cgroup_files.values():
+            cgroup_file.close()
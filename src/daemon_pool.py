@@ -0,0 +1,79 @@
+"""
+This module is used to run calls that may hang (statvfs on a dead NFS share, a /proc read under
+memory pressure) without ever holding up the monitor.
+
+DaemonPool is a small thread pool, like concurrent.futures.ThreadPoolExecutor, with two differences:
++ its threads are daemons, so a call that never returns does not keep the interpreter from exiting
+  (ThreadPoolExecutor joins its threads at exit, even after shutdown(wait=False))
++ a hung call only holds its own thread: when no thread is idle, a new one is started, so hung calls
+  never starve the others. Once their call returns, at most max_idle threads are kept for the next calls.
+The callers bound how many calls can hang at once (one per mount or per source, see the callers).
+"""
+
+import queue, threading
+from concurrent.futures import Future
+
+class DaemonPool:
+    def __init__(self, name, max_idle=4):
+        """
+        name prefixes the names of the threads.
+        max_idle is the number of threads kept waiting for new calls.
+        """
+        self.name = name
+        self.max_idle = max_idle
+
+        self.queue = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.idle = 0
+        self.started = 0
+        self.closed = False
+
+    def submit(self, function, *args):
+        """
+        This method runs function(*args) in a thread of the pool, and returns its Future.
+        """
+        future = Future()
+
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("Cannot submit to a closed pool")
+
+            # Each call is taken by an idle thread, or by a new one
+            if self.idle > 0:
+                self.idle -= 1
+            else:
+                self.started += 1
+                threading.Thread(target=self.work, name=f"{self.name}_{self.started}", daemon=True).start()
+
+            self.queue.put((future, function, args))
+
+        return future
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+
+            future, function, args = item
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(function(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+
+            with self.lock:
+                if self.closed or self.idle >= self.max_idle:
+                    return
+                self.idle += 1
+
+    def shutdown(self):
+        """
+        This method stops the idle threads. The threads still running a call stop once it returns, and are never waited for.
+        """
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, 0
+
+        for _ in range(idle):
+            self.queue.put(None)
@@ -0,0 +1,61 @@
+"""
+This module is used to choose the devices, interfaces and cores reported by the breakdown metrics.
+Names are matched against include/exclude patterns (e.g. "loop*", "veth*"), and at most
+max_series names are reported per source, so hosts with hundreds of disks or network
+interfaces do not overwhelm the collector.
+
+The names are admitted in the order they are first seen, and stay admitted, so the
+reported series do not change from one cycle to the next once the cap is reached.
+"""
+
+from fnmatch import fnmatchcase
+
+class DeviceFilter:
+    def __init__(self, include=(), exclude=(), max_series=64):
+        """
+        include are the patterns a name must match (any name if empty).
+        exclude are the patterns a name must not match.
+        """
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        self.max_series = max_series
+
+        # Decision taken for each name seen so far
+        self.decisions = {}
+        self.admitted = 0
+
+        # Names left out because of the cap
+        self.dropped = 0
+
+    def allowed(self, name):
+        """
+        This method tells whether the series of a device, interface or core is reported.
+        """
+        decision = self.decisions.get(name)
+
+        if decision is None:
+            decision = self.matches(name)
+
+            if decision and self.admitted >= self.max_series:
+                decision = False
+                self.dropped += 1
+
+                if self.dropped == 1:
+                    print(f"More than {self.max_series} series in a breakdown, the others are left out")
+
+            if decision:
+                self.admitted += 1
+
+            # Short-lived names (e.g. veth interfaces of containers) would make the rejections grow forever
+            if len(self.decisions) >= self.max_series * 4:
+                self.decisions = {key: value for key, value in self.decisions.items() if value}
+
+            self.decisions[name] = decision
+
+        return decision
+
+    def matches(self, name):
+        if self.include and not any(fnmatchcase(name, pattern) for pattern in self.include):
+            return False
+
+        return not any(fnmatchcase(name, pattern) for pattern in self.exclude)
@@ -0,0 +1,298 @@
+"""
+This module is used to keep the metrics that could not be exported.
+When the OTLP collector is unreachable, the failed export batches are encoded and
+appended to segment files on disk (the spool), instead of being lost.
+Once the collector is back, the spooled batches are replayed in order, with an
+exponential backoff between attempts while it is still down.
+
+The spool is bounded in size: when it is full, the oldest segments are dropped and counted.
+"""
+
+import os, json, struct, time, zlib
+
+from opentelemetry.sdk.metrics.export import MetricExporter, MetricExportResult
+from opentelemetry.exporter.otlp.proto.common.metrics_encoder import encode_metrics
+
+SEGMENT_PREFIX = "spool-"
+SEGMENT_SUFFIX = ".bin"
+
+# Every record is prefixed with its length and its CRC32
+HEADER = struct.Struct("<II")
+
+class ExportSpool:
+    def __init__(self, directory, max_bytes=67108864, segment_size=4194304):
+        """
+        max_bytes is the maximum size of the spool on disk.
+        segment_size is the size in bytes after which a new segment is started.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_size = segment_size
+        os.makedirs(directory, exist_ok=True)
+
+        # Counters
+        self.pending_records = 0
+        self.pending_bytes = 0
+        self.dropped_records = 0
+
+        self.write_file = None
+        self.read_file = None
+        self.load()
+
+    # =============== Segments ===============
+    def segment_path(self, index):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{index:06d}{SEGMENT_SUFFIX}")
+
+    def list_segments(self):
+        """
+        This method returns the indexes of the segments on disk, from the oldest to the newest.
+        """
+        return sorted(
+            int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def load(self):
+        """
+        This method restores the spool left on disk by a previous run.
+        The read position is restored from the cursor file, and the pending records are counted.
+        """
+        self.segments = self.list_segments() or [1]
+        self.read_index, self.read_offset = self.segments[0], 0
+
+        try:
+            with open(os.path.join(self.directory, "cursor"), "r") as f:
+                cursor = json.load(f)
+            if cursor["segment"] in self.segments:
+                self.read_index, self.read_offset = cursor["segment"], cursor["offset"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        self.segments = [index for index in self.segments if index >= self.read_index]
+
+        for index in self.segments:
+            offset = self.read_offset if index == self.read_index else 0
+            for size in self.record_sizes(index, offset):
+                self.pending_records += 1
+                self.pending_bytes += size
+
+        # Never append behind the data of a previous run, which may end with a torn record
+        newest = self.segment_path(self.segments[-1])
+        if os.path.exists(newest) and os.path.getsize(newest):
+            self.segments.append(self.segments[-1] + 1)
+
+        self.write_file = open(self.segment_path(self.segments[-1]), "ab")
+
+    def record_sizes(self, index, offset):
+        """
+        This method yields the size of every complete record of a segment, starting at offset.
+        """
+        try:
+            with open(self.segment_path(index), "rb") as f:
+                f.seek(offset)
+                while True:
+                    header = f.read(HEADER.size)
+                    if len(header) < HEADER.size:
+                        return
+                    length, _ = HEADER.unpack(header)
+                    f.seek(length, os.SEEK_CUR)
+                    yield HEADER.size + length
+        except FileNotFoundError:
+            return
+
+    def remove_segment(self, index):
+        """
+        This method deletes the oldest segment, and moves the read position to the next one.
+        """
+        if self.read_file is not None:
+            self.read_file.close()
+            self.read_file = None
+
+        try:
+            os.remove(self.segment_path(index))
+        except FileNotFoundError:
+            pass
+
+        self.segments.pop(0)
+        self.read_index, self.read_offset = self.segments[0], 0
+        self.save_cursor()
+
+    def save_cursor(self):
+        """
+        This method saves the read position, so a restart does not replay the batches that were already sent.
+        """
+        path = os.path.join(self.directory, "cursor")
+        with open(path + ".tmp", "w") as f:
+            json.dump({"segment": self.read_index, "offset": self.read_offset}, f)
+        os.replace(path + ".tmp", path)
+
+    # =============== Writing ===============
+    def append(self, payload):
+        """
+        This method appends one encoded export batch to the spool and syncs it to disk.
+        When the spool is over max_bytes, its oldest segments are dropped.
+        """
+        self.write_file.write(HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        self.write_file.flush()
+        os.fsync(self.write_file.fileno())
+
+        self.pending_records += 1
+        self.pending_bytes += HEADER.size + len(payload)
+
+        if self.write_file.tell() >= self.segment_size:
+            self.write_file.close()
+            self.segments.append(self.segments[-1] + 1)
+            self.write_file = open(self.segment_path(self.segments[-1]), "ab")
+
+        while self.pending_bytes > self.max_bytes and len(self.segments) > 1:
+            self.drop_oldest_segment()
+
+    def drop_oldest_segment(self):
+        index = self.segments[0]
+        offset = self.read_offset
+
+        for size in self.record_sizes(index, offset):
+            self.pending_records -= 1
+            self.pending_bytes -= size
+            self.dropped_records += 1
+
+        self.remove_segment(index)
+
+    # =============== Reading ===============
+    def peek(self):
+        """
+        This method returns the oldest pending batch, or None if the spool is empty.
+        A record that was cut short or corrupted (e.g. by a crash) is dropped along with the rest of its segment.
+        """
+        while True:
+            if self.read_file is None:
+                self.read_file = open(self.segment_path(self.read_index), "rb")
+
+            self.read_file.seek(self.read_offset)
+            header = self.read_file.read(HEADER.size)
+
+            if len(header) == HEADER.size:
+                length, crc = HEADER.unpack(header)
+                payload = self.read_file.read(length)
+                if len(payload) == length and zlib.crc32(payload) == crc:
+                    return payload
+
+            # The end of the segment that is being written: nothing more to read for now
+            if self.read_index == self.segments[-1]:
+                if header:
+                    # A torn record at the end of the newest segment; start a new one after it
+                    self.write_file.close()
+                    self.segments.append(self.read_index + 1)
+                    self.write_file = open(self.segment_path(self.segments[-1]), "ab")
+                else:
+                    return None
+
+            self.drop_oldest_segment()
+
+    def pop(self, payload):
+        """
+        This method marks the batch returned by peek() as sent.
+        """
+        size = HEADER.size + len(payload)
+        self.read_offset += size
+        self.pending_records -= 1
+        self.pending_bytes -= size
+        self.save_cursor()
+
+    def close(self):
+        for f in (self.read_file, self.write_file):
+            if f is not None:
+                f.close()
+
+class SpoolingExporter(MetricExporter):
+    def __init__(self, exporter, spool, sender, max_backoff=60.0, replay_batch=20):
+        """
+        exporter is the exporter used for live batches.
+        sender is used to replay the spooled batches (see transport.py).
+        At most replay_batch spooled batches are replayed per export, so a long outage
+        does not stall the export cycle that follows it.
+        """
+        super().__init__(
+            preferred_temporality=exporter._preferred_temporality,
+            preferred_aggregation=exporter._preferred_aggregation,
+        )
+        self.exporter = exporter
+        self.spool = spool
+        self.sender = sender
+        self.max_backoff = max_backoff
+        self.replay_batch = replay_batch
+
+        self.backoff = 0.0
+        self.next_attempt = 0.0
+
+        # Counters
+        self.failed_exports = 0
+        self.replayed_batches = 0
+
+    def stats(self):
+        """
+        This method returns how much is spooled, how much was replayed and how much was dropped.
+        """
+        return {
+            "spooled_batches": self.spool.pending_records,
+            "spooled_bytes": self.spool.pending_bytes,
+            "replayed_batches": self.replayed_batches,
+            "dropped_batches": self.spool.dropped_records,
+            "failed_exports": self.failed_exports,
+        }
+
+    def export(self, metrics_data, timeout_millis=10_000, **kwargs):
+        """
+        This method exports a batch, or spools it if the collector is unreachable.
+        While batches are spooled, new batches are spooled behind them, so they are replayed in order.
+        """
+        if not self.spool.pending_records:
+            result = self.exporter.export(metrics_data, timeout_millis=timeout_millis, **kwargs)
+            if result == MetricExportResult.SUCCESS:
+                return result
+
+            self.spool.append(encode_metrics(metrics_data).SerializeToString())
+            self.failed_export()
+            return result
+
+        self.spool.append(encode_metrics(metrics_data).SerializeToString())
+        return self.replay()
+
+    def replay(self):
+        """
+        This method sends the oldest spooled batches, unless the backoff has not expired yet.
+        It returns SUCCESS once the spool is empty.
+        """
+        if time.monotonic() < self.next_attempt:
+            return MetricExportResult.FAILURE
+
+        for _ in range(self.replay_batch):
+            payload = self.spool.peek()
+            if payload is None:
+                break
+
+            if not self.sender.send(payload):
+                self.failed_export()
+                return MetricExportResult.FAILURE
+
+            self.spool.pop(payload)
+            self.replayed_batches += 1
+
+        self.backoff = 0.0
+        return MetricExportResult.SUCCESS if not self.spool.pending_records else MetricExportResult.FAILURE
+
+    def failed_export(self):
+        """
+        This method doubles the backoff before the next replay attempt, up to max_backoff.
+        """
+        self.failed_exports += 1
+        self.backoff = min(self.max_backoff, self.backoff * 2 or 1.0)
+        self.next_attempt = time.monotonic() + self.backoff
+
+    def force_flush(self, timeout_millis=10_000):
+        return self.exporter.force_flush(timeout_millis)
+
+    def shutdown(self, timeout_millis=30_000, **kwargs):
+        self.spool.close()
+        self.exporter.shutdown(timeout_millis=timeout_millis, **kwargs)
@@ -0,0 +1,256 @@
+"""
+This module is used to expose the metrics directly to Prometheus, without the OpenTelemetry Collector.
+The metrics are rendered in the Prometheus text format once per collection cycle, when
+they are exported, and the rendered bytes (along with a gzipped copy) are cached.
+A small asyncio server answers every scrape with the cached bytes, so many scrapers or
+federation hops cost almost nothing, and a scrape never waits for a collection.
+
+The names of the metrics are the names of the instruments; sums that only grow are
+exported as counters, and get the "_total" suffix when they do not have it already.
+"""
+
+import asyncio
+import gzip
+import math
+import re
+import threading
+
+from opentelemetry.sdk.metrics.export import Gauge, Histogram, MetricExporter, MetricExportResult, Sum
+
+CONTENT_TYPE = b"text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds a keep-alive connection is kept open without a request
+IDLE_TIMEOUT = 30
+
+INVALID_NAME = re.compile(r"[^a-zA-Z0-9_:]")
+
+def metric_name(name):
+    name = INVALID_NAME.sub("_", name)
+    return f"_{name}" if name[:1].isdigit() else name
+
+def format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(attributes, extra=None):
+    """
+    This function renders the attributes of a data point as Prometheus labels.
+    """
+    labels = [(metric_name(str(key)), str(value)) for key, value in attributes.items()]
+
+    if extra is not None:
+        labels.append(extra)
+
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
+
+def render(metrics_data):
+    """
+    This function renders the metrics in the Prometheus text format.
+    """
+    lines = []
+    seen = set()
+
+    for resource_metrics in metrics_data.resource_metrics:
+        for scope_metrics in resource_metrics.scope_metrics:
+            for metric in scope_metrics.metrics:
+                data = metric.data
+                name = metric_name(metric.name)
+
+                if isinstance(data, Sum):
+                    kind = "counter" if data.is_monotonic else "gauge"
+                    if data.is_monotonic and not name.endswith("_total"):
+                        name += "_total"
+                elif isinstance(data, Gauge):
+                    kind = "gauge"
+                elif isinstance(data, Histogram):
+                    kind = "histogram"
+                else:
+                    continue
+
+                # A name may only be described once per exposition
+                if name in seen:
+                    continue
+                seen.add(name)
+
+                if metric.description:
+                    description = metric.description.replace("\\", "\\\\").replace("\n", "\\n")
+                    lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {kind}")
+
+                for point in data.data_points:
+                    if kind == "histogram":
+                        count = 0
+                        for bound, bucket in zip(list(point.explicit_bounds) + [math.inf], point.bucket_counts):
+                            count += bucket
+                            lines.append(f"{name}_bucket{format_labels(point.attributes, ('le', format_value(float(bound))))} {count}")
+                        labels = format_labels(point.attributes)
+                        lines.append(f"{name}_sum{labels} {format_value(point.sum)}")
+                        lines.append(f"{name}_count{labels} {point.count}")
+                    else:
+                        lines.append(f"{name}{format_labels(point.attributes)} {format_value(point.value)}")
+
+    lines.append("")
+    return "\n".join(lines).encode()
+
+class ExpositionExporter(MetricExporter):
+    def __init__(self, exporter=None, gzip_enabled=True):
+        """
+        exporter is an optional exporter the metrics are passed on to (e.g. the OTLP exporter),
+        so the metrics are collected once per cycle for both.
+        Prometheus expects cumulative values, so the temporality of that exporter must be cumulative.
+        gzip_enabled also caches a gzipped copy of every exposition.
+        """
+        super().__init__(
+            preferred_temporality=exporter._preferred_temporality if exporter is not None else None,
+            preferred_aggregation=exporter._preferred_aggregation if exporter is not None else None,
+        )
+        self.exporter = exporter
+        self.gzip_enabled = gzip_enabled
+
+        # The body and the gzipped body of the last exposition, replaced together
+        self.cache = (b"", gzip.compress(b"") if gzip_enabled else None)
+
+    def export(self, metrics_data, timeout_millis=10_000, **kwargs):
+        """
+        This method renders the metrics of the cycle, then passes them on to the exporter, if any.
+        """
+        body = render(metrics_data)
+        self.cache = (body, gzip.compress(body, compresslevel=6) if self.gzip_enabled else None)
+
+        if self.exporter is None:
+            return MetricExportResult.SUCCESS
+
+        return self.exporter.export(metrics_data, timeout_millis=timeout_millis, **kwargs)
+
+    def force_flush(self, timeout_millis=10_000):
+        if self.exporter is None:
+            return True
+
+        return self.exporter.force_flush(timeout_millis)
+
+    def shutdown(self, timeout_millis=30_000, **kwargs):
+        if self.exporter is not None:
+            self.exporter.shutdown(timeout_millis=timeout_millis, **kwargs)
+
+class ExpositionServer:
+    def __init__(self, exposition, port=8001, host="0.0.0.0"):
+        """
+        exposition is the ExpositionExporter whose cached bytes are served on /metrics.
+        """
+        self.exposition = exposition
+        self.port = port
+        self.host = host
+
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.ready = threading.Event()
+
+        # Why the server could not start, e.g. a port already in use
+        self.error = None
+
+    # =============== Thread ===============
+    def start(self):
+        """
+        This method starts the server in its own thread, with its own event loop.
+        It returns once the server listens, or raises the error that kept it from listening.
+        """
+        self.thread = threading.Thread(target=asyncio.run, args=(self.serve(),), name="exposition_server", daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        if self.loop is not None and self.server is not None:
+            self.loop.call_soon_threadsafe(self.server.close)
+
+        if self.thread is not None:
+            self.thread.join()
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+
+        try:
+            self.server = await asyncio.start_server(self.handle, self.host, self.port)
+            self.port = self.server.sockets[0].getsockname()[1]
+        except Exception as e:
+            self.error = e
+            return
+        finally:
+            self.ready.set()
+
+        try:
+            await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+
+    # =============== HTTP ===============
+    async def handle(self, reader, writer):
+        """
+        This method answers the requests of one connection, which is kept open between scrapes.
+        """
+        try:
+            while True:
+                request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), IDLE_TIMEOUT)
+                head, *header_lines = request.decode("latin-1").split("\r\n")
+                headers = {
+                    key.strip().lower(): value.strip()
+                    for key, _, value in (line.partition(":") for line in header_lines if line)
+                }
+
+                method, path, version = (head.split(" ") + ["", "", ""])[:3]
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+
+                writer.write(self.response(method, path.split("?")[0], headers, keep_alive))
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def response(self, method, path, headers, keep_alive):
+        """
+        This method builds the response to one request from the cached exposition.
+        """
+        if path != "/metrics":
+            return self.head(b"404 Not Found", b"text/plain", 0, keep_alive)
+
+        if method not in ("GET", "HEAD"):
+            return self.head(b"405 Method Not Allowed", b"text/plain", 0, keep_alive)
+
+        body, gzipped = self.exposition.cache
+        encoding = None
+
+        if gzipped is not None and "gzip" in headers.get("accept-encoding", ""):
+            body, encoding = gzipped, b"gzip"
+
+        head = self.head(b"200 OK", CONTENT_TYPE, len(body), keep_alive, encoding)
+        return head if method == "HEAD" else head + body
+
+    @staticmethod
+    def head(status, content_type, length, keep_alive, encoding=None):
+        lines = [
+            b"HTTP/1.1 " + status,
+            b"Content-Type: " + content_type,
+            b"Content-Length: " + str(length).encode(),
+            b"Connection: " + (b"keep-alive" if keep_alive else b"close"),
+        ]
+
+        if encoding is not None:
+            lines.append(b"Content-Encoding: " + encoding)
+
+        return b"\r\n".join(lines) + b"\r\n\r\n"
@@ -0,0 +1,210 @@
+"""
+This module is used to collect the capacity of every mounted filesystem without ever
+blocking the export for long, even when a network mount (NFS, CIFS) hangs.
+
++ Every mount is listed, network filesystems (NFS, CIFS) included, except the pseudo filesystems
+  (proc, sysfs, tmpfs, overlay, ...) that have no capacity worth reporting.
++ The list of mounts is cached, and only read again when the mounts change. On Linux, the
+  kernel flags /proc/self/mountinfo when a filesystem is mounted or unmounted, which is
+  checked with a poll() that does not block; elsewhere, the list is read again every
+  refresh_interval seconds.
++ statvfs is called in a pool of daemon threads (see daemon_pool.py). The collection waits at most
+  timeout seconds for all mounts; a mount that does not answer in time keeps its last known values,
+  flagged as stale, and is neither asked again nor waited for until its pending call returns,
+  so a hung mount only delays one collection.
++ A hung statvfs only holds its own thread: the other mounts are still read by the idle threads,
+  or by new ones, and the hung threads never keep the agent from exiting.
+"""
+
+import os, select, time
+from concurrent.futures import wait
+from psutil import disk_partitions, disk_usage
+from daemon_pool import DaemonPool
+
+MOUNTINFO = "/proc/self/mountinfo"
+
+# Filesystem types that are not reported; psutil only skips the "nodev" ones, which also include NFS and CIFS
+PSEUDO_FILESYSTEMS = (
+    "autofs", "binfmt_misc", "bpf", "cgroup", "cgroup2", "configfs", "debugfs", "devfs", "devpts", "devtmpfs",
+    "efivarfs", "fusectl", "hugetlbfs", "mqueue", "nsfs", "overlay", "proc", "pstore", "ramfs", "rpc_pipefs",
+    "securityfs", "selinuxfs", "squashfs", "sysfs", "tmpfs", "tracefs",
+)
+
+class FilesystemUsage:
+    """
+    The capacity of one filesystem, in bytes and inodes.
+    """
+    __slots__ = ("size", "used", "free", "percent", "inodes", "inodes_free", "inodes_percent")
+
+    def __init__(self, size, used, free, inodes=None, inodes_free=None):
+        self.size = size
+        self.used = used
+        self.free = free
+
+        # Same as psutil: the share of the space available to users that is used
+        self.percent = used / (used + free) * 100 if used + free else 0.0
+
+        self.inodes = inodes
+        self.inodes_free = inodes_free
+        self.inodes_percent = (inodes - inodes_free) / inodes * 100 if inodes else None
+
+def read_usage(mountpoint):
+    """
+    This function reads the capacity of a filesystem with statvfs, or with psutil where statvfs is not available.
+    """
+    if not hasattr(os, "statvfs"):
+        usage = disk_usage(mountpoint)
+        return FilesystemUsage(usage.total, usage.used, usage.free)
+
+    stat = os.statvfs(mountpoint)
+    return FilesystemUsage(
+        stat.f_blocks * stat.f_frsize,
+        (stat.f_blocks - stat.f_bfree) * stat.f_frsize,
+        stat.f_bavail * stat.f_frsize,
+        stat.f_files,
+        stat.f_favail,
+    )
+
+class MountWatcher:
+    """
+    Tells when the mounts have changed, from the flag the kernel sets on /proc/self/mountinfo.
+    """
+    def __init__(self, path=MOUNTINFO, refresh_interval=60.0):
+        self.refresh_interval = refresh_interval
+        self.file = None
+        self.poller = None
+        self.last_refresh = None
+
+        if hasattr(select, "poll") and os.path.exists(path):
+            self.file = open(path, "rb")
+            self.poller = select.poll()
+            self.poller.register(self.file, select.POLLPRI | select.POLLERR)
+
+    def changed(self):
+        """
+        This method returns True the first time it is called, and then when the mounts have changed.
+        """
+        if self.last_refresh is None:
+            changed = True
+        elif self.poller is not None:
+            changed = bool(self.poller.poll(0))
+        else:
+            changed = time.monotonic() - self.last_refresh >= self.refresh_interval
+
+        if changed:
+            self.last_refresh = time.monotonic()
+
+            # Reading the file to the end clears the flag
+            if self.file is not None:
+                self.file.seek(0)
+                self.file.read()
+
+        return changed
+
+    def close(self):
+        if self.file is not None:
+            self.poller.unregister(self.file)
+            self.file.close()
+            self.file = None
+
+class FilesystemCollector:
+    def __init__(self, device_filter, timeout=0.5, workers=4, max_age=1.0, refresh_interval=60.0, exclude_types=PSEUDO_FILESYSTEMS):
+        """
+        device_filter chooses the mount points that are reported (see device_filter.py).
+        The filesystems of the exclude_types types are not reported.
+        timeout is the time a collection waits for statvfs, for all mounts at once.
+        workers is the number of threads kept for statvfs; hung calls do not count against it.
+        The values of a collection are reused by the callbacks of the same cycle for max_age seconds.
+        """
+        self.device_filter = device_filter
+        self.timeout = timeout
+        self.max_age = max_age
+        self.exclude_types = frozenset(exclude_types)
+
+        self.watcher = MountWatcher(refresh_interval=refresh_interval)
+        self.executor = DaemonPool("statvfs", max_idle=workers)
+        self.partitions = []
+        self.mountpoints = set()
+
+        # Last known usage, and pending statvfs call, of each mount point
+        self.usages = {}
+        self.pending = {}
+
+        self.stale = set()
+        self.timeouts = 0
+        self.collected = None
+        self.closed = False
+
+    def refresh_partitions(self):
+        """
+        This method reads the list of mounts again if it has changed.
+        """
+        if not self.watcher.changed():
+            return
+
+        self.partitions = [
+            partition for partition in disk_partitions(all=True)
+            if partition.fstype not in self.exclude_types and self.device_filter.allowed(partition.mountpoint)
+        ]
+
+        # Forget the mounts that are gone
+        self.mountpoints = {partition.mountpoint for partition in self.partitions}
+        for mountpoint in list(self.usages):
+            if mountpoint not in self.mountpoints:
+                del self.usages[mountpoint]
+
+    def collect(self):
+        """
+        This method reads the capacity of every mount, waiting at most timeout seconds.
+        The mounts that did not answer in time are flagged as stale.
+        """
+        self.refresh_partitions()
+        submitted = []
+
+        for partition in self.partitions:
+            # A mount whose last call has not returned yet is not asked again, nor waited for
+            if partition.mountpoint not in self.pending:
+                future = self.executor.submit(read_usage, partition.mountpoint)
+                self.pending[partition.mountpoint] = future
+                submitted.append(future)
+
+        wait(submitted, timeout=self.timeout)
+
+        stale = set()
+        for mountpoint, future in list(self.pending.items()):
+            if not future.done():
+                if mountpoint in self.mountpoints:
+                    stale.add(mountpoint)
+                continue
+
+            del self.pending[mountpoint]
+            try:
+                usage = future.result()
+                if mountpoint in self.mountpoints:
+                    self.usages[mountpoint] = usage
+            except OSError:
+                # e.g. a mount that went away, or that we may not read
+                self.usages.pop(mountpoint, None)
+
+        self.timeouts += len(stale)
+        self.stale = stale
+        self.collected = time.monotonic()
+
+    def get(self):
+        """
+        This method returns (partition, usage, stale) for every mount with a known usage,
+        collecting them first unless they were collected less than max_age seconds ago, or the collector is closed.
+        """
+        if not self.closed and (self.collected is None or time.monotonic() - self.collected > self.max_age):
+            self.collect()
+
+        return [
+            (partition, self.usages[partition.mountpoint], partition.mountpoint in self.stale)
+            for partition in self.partitions
+            if partition.mountpoint in self.usages
+        ]
+
+    def close(self):
+        self.closed = True
+        self.executor.shutdown()
+        self.watcher.close()
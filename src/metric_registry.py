@@ -0,0 +1,237 @@
+"""
+This module is the registry of the metrics collected by SystemMonitor.
+Every metric is declared by the source it comes from, its instrument, its unit and
+attributes, and the field of the snapshot it reads. SystemMonitor builds the callbacks
+from these declarations, so adding a metric does not need a new hand-written callback.
+
+The sources to collect are set in a YAML file (METRICS_CONFIG) or, more simply, in
+METRICS_SOURCES (e.g. "cpu,memory"). Only the enabled sources are sampled, so a site
+that only collects CPU and RAM does not read its disks and network interfaces.
+The TCP source (connections by state, listen queue overflows) is not enabled by default.
+In a container, the container source (limits, throttling and CPU pressure, read from the
+cgroup) is enabled by default, and the CPU, memory and disk sources read the cgroup as well.
+
+Declarations sharing a name are reported as one metric, and must differ by their attributes
+(e.g. tcp_connections, with one declaration per connection state).
+
+The CPU, disk and network sources can also be broken down per core, disk or interface
+(METRICS_BREAKDOWN, e.g. "disk,network"). The breakdown metrics report one series per
+core, disk or interface, with a "cpu", "device" or "interface" attribute. Names can be
+filtered with patterns (METRICS_BREAKDOWN_INCLUDE and METRICS_BREAKDOWN_EXCLUDE), and at
+most METRICS_BREAKDOWN_MAX_SERIES series are reported per source (see device_filter.py).
+
+Example of a YAML file:
+    sources: [cpu, memory, network]
+    metrics:                        # optional, replaces the default declarations
+      - name: cpu_usage
+        source: cpu
+        field: cpu_usage
+        instrument: gauge
+        alert: cpu_usage
+        attributes: {site: lab}
+    breakdown:
+      sources: [network]
+      exclude: ["lo", "veth*"]
+      max_series: 16
+"""
+
+import os
+from system_snapshot import SOURCES, DEFAULT_SOURCES, SOURCE_FIELDS, RATE_FIELDS, BREAKDOWN_ATTRIBUTES
+
+# Instruments that can be declared, and the method of the meter that creates them
+INSTRUMENTS = {
+    "counter": "create_observable_counter",
+    "gauge": "create_observable_gauge",
+    "up_down_counter": "create_observable_up_down_counter",
+}
+
+# Breakdown settings used when they are not set
+BREAKDOWN = {
+    "sources": (),
+    "include": (),
+    "exclude": ("loop*", "veth*"),
+    "max_series": 64,
+}
+
+# Default declarations
+# alert is the alert checked on the value, scale multiplies the value before it is reported
+# breakdown metrics are only collected when their source is broken down
+METRICS = [
+    # Point values are gauges; only the values that never decrease are counters
+    {"name": "cpu_usage", "source": "cpu", "field": "cpu_usage", "instrument": "gauge",
+     "description": "CPU usage percentage", "unit": "%", "alert": "cpu_usage"},
+    {"name": "ram_usage", "source": "memory", "field": "ram_usage", "instrument": "gauge",
+     "description": "RAM usage percentage", "unit": "%", "alert": "memory_usage"},
+    {"name": "disk_busy_time_total", "source": "disk", "field": "disk_busy_time", "instrument": "counter",
+     "description": "Time the disks were busy in seconds", "unit": "s"},
+    {"name": "disk_read_total", "source": "disk", "field": "disk_read_bytes", "instrument": "counter",
+     "description": "Disk read in bytes", "unit": "By"},
+    {"name": "disk_write_total", "source": "disk", "field": "disk_write_bytes", "instrument": "counter",
+     "description": "Disk write in bytes", "unit": "By"},
+    {"name": "network_sent_total", "source": "network", "field": "network_sent", "instrument": "counter",
+     "description": "Network sent in bytes", "unit": "By"},
+    {"name": "network_recv_total", "source": "network", "field": "network_recv", "instrument": "counter",
+     "description": "Network received in bytes", "unit": "By"},
+
+    # Per-second rates of the counters above; the disk and network alerts are checked on them
+    {"name": "disk_busy_percent", "source": "disk", "field": "disk_busy_rate", "instrument": "gauge",
+     "description": "Percentage of time the disks were busy since the last collection", "unit": "%",
+     "alert": "disk_usage", "scale": 100},
+    {"name": "disk_read_rate", "source": "disk", "field": "disk_read_rate", "instrument": "gauge",
+     "description": "Disk read in bytes per second", "unit": "By/s", "alert": "disk_read"},
+    {"name": "disk_write_rate", "source": "disk", "field": "disk_write_rate", "instrument": "gauge",
+     "description": "Disk write in bytes per second", "unit": "By/s", "alert": "disk_write"},
+    {"name": "network_sent_rate", "source": "network", "field": "network_sent_rate", "instrument": "gauge",
+     "description": "Network sent in bytes per second", "unit": "By/s", "alert": "network_sent"},
+    {"name": "network_recv_rate", "source": "network", "field": "network_recv_rate", "instrument": "gauge",
+     "description": "Network received in bytes per second", "unit": "By/s", "alert": "network_recv"},
+
+    # TCP connections by state; the overflows of the listen queues are alerted on per second
+    *(
+        {"name": "tcp_connections", "source": "tcp", "field": f"tcp_{state}", "instrument": "gauge",
+         "description": "Number of TCP connections in each state", "unit": "{connection}", "attributes": {"state": state}}
+        for state in ("established", "syn_sent", "syn_recv", "fin_wait", "time_wait", "closing", "close_wait", "last_ack", "listen")
+    ),
+    {"name": "tcp_listen_overflows_total", "source": "tcp", "field": "tcp_listen_overflows", "instrument": "counter",
+     "description": "Connections dropped because a listen queue was full", "unit": "{connection}"},
+    {"name": "tcp_listen_drops_total", "source": "tcp", "field": "tcp_listen_drops", "instrument": "counter",
+     "description": "Connections dropped by a listening socket, for any reason", "unit": "{connection}"},
+    {"name": "tcp_retransmits_total", "source": "tcp", "field": "tcp_retransmits", "instrument": "counter",
+     "description": "TCP segments retransmitted", "unit": "{segment}"},
+    {"name": "tcp_listen_overflow_rate", "source": "tcp", "field": "tcp_listen_overflow_rate", "instrument": "gauge",
+     "description": "Connections dropped because a listen queue was full, per second", "unit": "{connection}/s",
+     "alert": "tcp_listen_overflows"},
+    {"name": "tcp_retransmit_rate", "source": "tcp", "field": "tcp_retransmit_rate", "instrument": "gauge",
+     "description": "TCP segments retransmitted per second", "unit": "{segment}/s"},
+
+    # Container limits; in a container, cpu_usage and ram_usage are percentages of these limits
+    {"name": "container_cpu_limit", "source": "container", "field": "container_cpu_limit", "instrument": "gauge",
+     "description": "Number of CPUs the container may use", "unit": "{cpu}"},
+    {"name": "container_cpu_throttled_total", "source": "container", "field": "container_cpu_throttled", "instrument": "counter",
+     "description": "Time the container was throttled by its CPU limit in seconds", "unit": "s"},
+    {"name": "container_cpu_pressure", "source": "container", "field": "container_cpu_pressure", "instrument": "gauge",
+     "description": "Percentage of the last 10 seconds some tasks of the container waited for a CPU", "unit": "%"},
+    {"name": "container_memory_usage", "source": "container", "field": "container_memory_usage", "instrument": "gauge",
+     "description": "Working set of the container in bytes", "unit": "By"},
+    {"name": "container_memory_limit", "source": "container", "field": "container_memory_limit", "instrument": "gauge",
+     "description": "Memory the container may use in bytes", "unit": "By"},
+
+    # Breakdowns
+    {"name": "cpu_usage_core", "source": "cpu", "field": "cpu_usage", "instrument": "gauge",
+     "description": "CPU usage percentage of each core", "unit": "%", "breakdown": True},
+    {"name": "disk_busy_device_total", "source": "disk", "field": "disk_busy_time", "instrument": "counter",
+     "description": "Time each disk was busy in seconds", "unit": "s", "breakdown": True},
+    {"name": "disk_read_device_total", "source": "disk", "field": "disk_read_bytes", "instrument": "counter",
+     "description": "Disk read in bytes of each disk", "unit": "By", "breakdown": True},
+    {"name": "disk_write_device_total", "source": "disk", "field": "disk_write_bytes", "instrument": "counter",
+     "description": "Disk write in bytes of each disk", "unit": "By", "breakdown": True},
+    {"name": "network_sent_interface_total", "source": "network", "field": "network_sent", "instrument": "counter",
+     "description": "Network sent in bytes of each interface", "unit": "By", "breakdown": True},
+    {"name": "network_recv_interface_total", "source": "network", "field": "network_recv", "instrument": "counter",
+     "description": "Network received in bytes of each interface", "unit": "By", "breakdown": True},
+]
+
+def split(value):
+    """
+    This function splits a comma-separated list.
+    """
+    return tuple(item.strip() for item in value.split(",") if item.strip())
+
+def load_config(path=None, sources=None, breakdown=None, include=None, exclude=None, max_series=None, default_sources=DEFAULT_SOURCES):
+    """
+    This function returns the enabled sources, the breakdown settings and the metrics to collect.
+    path is an optional YAML file declaring the sources, the breakdown and/or the metrics.
+    default_sources are the sources enabled when neither the file nor sources set them.
+    The other arguments are optional comma-separated lists (or a number for max_series), which take precedence over the file.
+    Metrics of disabled sources, and breakdown metrics of sources that are not broken down, are left out.
+    """
+    config = {}
+
+    if path:
+        # PyYAML is only needed when a file is used
+        import yaml
+
+        with open(path, "r") as f:
+            config = yaml.safe_load(f) or {}
+
+    enabled = config.get("sources", default_sources)
+    if sources:
+        enabled = split(sources)
+
+    for source in enabled:
+        if source not in SOURCE_FIELDS:
+            raise ValueError(f"Unknown metric source {source!r}, expected one of {', '.join(SOURCES)}")
+
+    settings = dict(BREAKDOWN, **config.get("breakdown", {}))
+    for key, value in (("sources", breakdown), ("include", include), ("exclude", exclude)):
+        if value is not None:
+            settings[key] = split(value)
+    if max_series:
+        settings["max_series"] = int(max_series)
+
+    for source in settings["sources"]:
+        if source not in BREAKDOWN_ATTRIBUTES:
+            raise ValueError(f"The {source!r} source cannot be broken down, expected one of {', '.join(BREAKDOWN_ATTRIBUTES)}")
+
+    # Sources that are not collected are not broken down either
+    settings["sources"] = tuple(source for source in settings["sources"] if source in enabled)
+    settings["include"] = tuple(settings["include"])
+    settings["exclude"] = tuple(settings["exclude"])
+
+    declared = config.get("metrics", METRICS)
+    instruments = {}
+    for metric in declared:
+        check_metric(metric)
+
+        # A metric declared more than once is a single instrument
+        if instruments.setdefault(metric["name"], metric["instrument"]) != metric["instrument"]:
+            raise ValueError(f"Metric {metric['name']!r} is declared with different instruments")
+
+    return {
+        "sources": tuple(source for source in SOURCES if source in enabled),
+        "breakdown": settings,
+        "metrics": [
+            metric for metric in declared
+            if metric["source"] in enabled and (not metric.get("breakdown") or metric["source"] in settings["sources"])
+        ],
+    }
+
+def check_metric(metric):
+    """
+    This function raises a ValueError when a metric declaration is incomplete or refers to something unknown.
+    """
+    for key in ("name", "source", "field", "instrument"):
+        if key not in metric:
+            raise ValueError(f"Metric {metric.get('name', metric)!r} has no {key!r}")
+
+    if metric["instrument"] not in INSTRUMENTS:
+        raise ValueError(f"Metric {metric['name']!r} has an unknown instrument {metric['instrument']!r}")
+
+    if metric["source"] not in SOURCE_FIELDS:
+        raise ValueError(f"Metric {metric['name']!r} has an unknown source {metric['source']!r}")
+
+    fields = set(SOURCE_FIELDS[metric["source"]])
+
+    # The rates are only computed for the totals
+    if metric.get("breakdown"):
+        if metric["source"] not in BREAKDOWN_ATTRIBUTES:
+            raise ValueError(f"Metric {metric['name']!r} breaks down the {metric['source']} source, which cannot be broken down")
+    else:
+        fields.update(RATE_FIELDS[field] for field in SOURCE_FIELDS[metric["source"]] if field in RATE_FIELDS)
+
+    if metric["field"] not in fields:
+        raise ValueError(f"Metric {metric['name']!r} reads {metric['field']!r}, which the {metric['source']} source does not fill")
+
+def load_registry(default_sources=DEFAULT_SOURCES):
+    """
+    This function loads the registry from METRICS_CONFIG and the other METRICS_* variables.
+    """
+    return load_config(
+        os.getenv("METRICS_CONFIG"),
+        sources=os.getenv("METRICS_SOURCES"),
+        breakdown=os.getenv("METRICS_BREAKDOWN"),
+        include=os.getenv("METRICS_BREAKDOWN_INCLUDE"),
+        exclude=os.getenv("METRICS_BREAKDOWN_EXCLUDE"),
+        max_series=os.getenv("METRICS_BREAKDOWN_MAX_SERIES"),
+        default_sources=default_sources,
+    )
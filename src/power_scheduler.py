@@ -0,0 +1,159 @@
+"""
+This module is used to collect and export the metrics less often on battery-powered devices
+(e.g. Android phones), to save wakeups and radio use, without missing alerts.
+
+The collection interval is chosen again after every collection:
++ near an alert (a value above near_ratio times its threshold, or an alert firing),
+  the metrics are collected at the base interval, so the alerts fire as quickly as usual
++ otherwise, the interval is stretched while on battery (more when the battery is low)
+  and while every value is far from its threshold (idle), up to max_interval,
+  which bounds how late an alert can fire
+
+While on battery, the exports are also coalesced: the collections are held back and sent
+together in a single request every export_delay seconds, so the radio wakes up once
+instead of once per collection. Near an alert, the held collections are sent right away.
+"""
+
+import time
+
+from opentelemetry.sdk.metrics.export import MetricExporter, MetricExportResult, MetricsData
+
+try:
+    from psutil import sensors_battery
+except ImportError:
+    sensors_battery = None
+
+def read_battery():
+    """
+    This function returns the battery charge (in percent) and whether the device is plugged in.
+    A device without a battery is reported as plugged in.
+    """
+    battery = sensors_battery() if sensors_battery is not None else None
+
+    if battery is None:
+        return None, True
+
+    return battery.percent, bool(battery.power_plugged)
+
+class PowerScheduler:
+    def __init__(
+        self,
+        base_interval=5.0,
+        max_interval=60.0,
+        battery_factor=4.0,
+        low_battery=20,
+        idle_factor=2.0,
+        idle_ratio=0.3,
+        near_ratio=0.8,
+        exporter=None,
+        battery_reader=read_battery,
+    ):
+        """
+        base_interval is the interval used on mains power and near an alert, in seconds.
+        The interval is multiplied by battery_factor on battery (twice that below low_battery percent),
+        and by idle_factor while every value is below idle_ratio times its threshold.
+        exporter is the CoalescingExporter whose exports are held back while on battery, if any.
+        """
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.battery_factor = battery_factor
+        self.low_battery = low_battery
+        self.idle_factor = idle_factor
+        self.idle_ratio = idle_ratio
+        self.near_ratio = near_ratio
+        self.exporter = exporter
+        self.battery_reader = battery_reader
+
+        # Highest proximity to an alert seen during the current collection
+        self.proximity = 0.0
+        self.interval = base_interval
+
+    def observe(self, proximity):
+        """
+        This method records how close a value is to its alert (1 is the threshold).
+        It is called by the callbacks, for every value checked for alerts.
+        """
+        if proximity > self.proximity:
+            self.proximity = proximity
+
+    def next_interval(self):
+        """
+        This method returns the number of seconds to wait before the next collection,
+        based on the power source and on the values of the last collection.
+        """
+        proximity, self.proximity = self.proximity, 0.0
+        percent, plugged = self.battery_reader()
+        near = proximity >= self.near_ratio
+
+        interval = self.base_interval
+        if not near:
+            if not plugged:
+                interval *= self.battery_factor
+                if percent is not None and percent < self.low_battery:
+                    interval *= 2
+            if proximity < self.idle_ratio:
+                interval *= self.idle_factor
+
+        self.interval = min(interval, self.max_interval)
+
+        if self.exporter is not None:
+            self.exporter.hold = not plugged and not near
+
+        return self.interval
+
+class CoalescingExporter(MetricExporter):
+    def __init__(self, exporter, export_delay=60.0):
+        """
+        exporter is the exporter the held collections are sent to.
+        While hold is set, the collections are held for up to export_delay seconds, then sent in a single request.
+        """
+        super().__init__(
+            preferred_temporality=exporter._preferred_temporality,
+            preferred_aggregation=exporter._preferred_aggregation,
+        )
+        self.exporter = exporter
+        self.export_delay = export_delay
+
+        self.hold = False
+        self.held = []
+        self.held_since = None
+
+    def export(self, metrics_data, timeout_millis=10_000, **kwargs):
+        """
+        This method holds the collection back, or sends it along with the collections held so far.
+        """
+        self.held.append(metrics_data)
+
+        if self.held_since is None:
+            self.held_since = time.monotonic()
+
+        if self.hold and time.monotonic() - self.held_since < self.export_delay:
+            return MetricExportResult.SUCCESS
+
+        return self.send(timeout_millis, **kwargs)
+
+    def send(self, timeout_millis=10_000, **kwargs):
+        """
+        This method sends the held collections in a single request.
+        Each collection keeps its own points, so the series keep their full resolution.
+        """
+        if not self.held:
+            return MetricExportResult.SUCCESS
+
+        held, self.held, self.held_since = self.held, [], None
+
+        if len(held) == 1:
+            return self.exporter.export(held[0], timeout_millis=timeout_millis, **kwargs)
+
+        metrics_data = MetricsData(
+            resource_metrics=[resource_metrics for data in held for resource_metrics in data.resource_metrics]
+        )
+        return self.exporter.export(metrics_data, timeout_millis=timeout_millis, **kwargs)
+
+    def force_flush(self, timeout_millis=10_000):
+        self.send(timeout_millis)
+        return self.exporter.force_flush(timeout_millis)
+
+    def shutdown(self, timeout_millis=30_000, **kwargs):
+        self.send(timeout_millis)
+        self.exporter.shutdown(timeout_millis=timeout_millis, **kwargs)
@@ -0,0 +1,287 @@
+"""
+This module is used to sample the system metrics directly from /proc on Linux.
+It is a faster alternative to the psutil backend of SnapshotSampler.
+
+The /proc files are opened once and kept open. Every cycle they are re-read with
+os.preadv into reusable buffers, so there are no per-call file opens and
+no namedtuple allocations.
+The TCP source counts the sockets of /proc/net/tcp and /proc/net/tcp6 chunk by chunk (see tcp_stats.py).
+"""
+
+import os
+from system_snapshot import SnapshotSampler, DEFAULT_SOURCES
+from tcp_stats import TcpTable, TCP_COUNTERS, count_states, read_counter
+
+# /proc file read by each source
+SOURCE_FILES = {
+    "cpu": "stat",
+    "memory": "meminfo",
+    "disk": "diskstats",
+    "network": "net/dev",
+    "tcp": "net/snmp",
+}
+
+# Socket tables read by the TCP source; /proc/net/tcp6 is missing when IPv6 is disabled
+TCP_TABLES = ("net/tcp", "net/tcp6")
+
+# /proc/diskstats always counts in 512 bytes sectors, regardless of the device
+SECTOR_SIZE = 512
+
+class ProcFile:
+    """
+    A /proc file that is kept open and re-read into a reusable buffer.
+    """
+    __slots__ = ("path", "fd", "buffer")
+
+    def __init__(self, path, size=8192):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        self.buffer = bytearray(size)
+
+    def read(self):
+        """
+        This method re-reads the file from the beginning into the buffer.
+        The buffer grows when the file does not fit in it (e.g. /proc/stat on hosts with many CPUs).
+        It returns the number of bytes read; the content is only valid until the next read.
+        """
+        while True:
+            size = os.preadv(self.fd, [self.buffer], 0)
+
+            if size < len(self.buffer):
+                return size
+
+            self.buffer = bytearray(len(self.buffer) * 2)
+
+    def close(self):
+        os.close(self.fd)
+
+class ProcSampler(SnapshotSampler):
+    def __init__(self, max_age=1.0, procfs="/proc", sources=DEFAULT_SOURCES):
+        """
+        Only the files of the enabled sources are opened.
+        The sources that are not read from /proc (e.g. the container source, see cgroup_sampler.py) are left to subclasses.
+        """
+        super().__init__(max_age, sources)
+        self.files = {
+            source: ProcFile(f"{procfs}/{SOURCE_FILES[source]}") for source in self.sources if source in SOURCE_FILES
+        }
+        self.stat = self.files.get("cpu")
+        self.meminfo = self.files.get("memory")
+        self.diskstats = self.files.get("disk")
+        self.net_dev = self.files.get("network")
+        self.snmp = self.files.get("tcp")
+
+        self.tcp_tables = []
+        self.netstat = None
+        if self.snmp is not None:
+            self.tcp_tables = [
+                TcpTable(f"{procfs}/{table}") for table in TCP_TABLES
+                if table == "net/tcp" or os.path.exists(f"{procfs}/{table}")
+            ]
+            self.netstat = ProcFile(f"{procfs}/net/netstat")
+
+        # CPU times of the previous sample of each /proc/stat line, used to compute the CPU usage percentages
+        self.last_cpu_times = {}
+        if self.stat is not None:
+            self.read_cpu()
+
+    def set_breakdown(self, filters):
+        super().set_breakdown(filters)
+
+        # Like the total, the usage of each core is measured from the first call on
+        if "cpu" in filters and self.stat is not None:
+            self.read_cpu({})
+
+    # =============== Sources ===============
+    def read_cpu(self, cores=None):
+        """
+        This method reads the aggregated "cpu" line of /proc/stat.
+        It returns the CPU usage percentage since the previous call, like psutil.cpu_percent(interval=None).
+        When cores is a dict, the usage of every core (the "cpuN" lines) is stored in it as well.
+        """
+        size = self.stat.read()
+        buffer = self.stat.buffer
+
+        if cores is None:
+            return self.cpu_usage(buffer[:buffer.find(b"\n", 0, size)].split())
+
+        lines = bytes(memoryview(buffer)[:size]).splitlines()
+        allowed = self.filters["cpu"].allowed
+
+        for line in lines[1:]:
+            # The cores come right after the aggregated line
+            if not line.startswith(b"cpu"):
+                break
+
+            fields = line.split()
+            name = fields[0][3:].decode()
+
+            if allowed(name):
+                cores[name] = {"cpu_usage": self.cpu_usage(fields)}
+
+        return self.cpu_usage(lines[0].split())
+
+    def cpu_usage(self, fields):
+        """
+        This method returns the CPU usage percentage of one /proc/stat line since the previous call for the same line.
+        """
+        # user nice system idle iowait irq softirq steal guest guest_nice
+        times = [int(field) for field in fields[1:]]
+
+        # guest and guest_nice are already accounted for in user and nice
+        total = sum(times[:8])
+        busy = total - times[3] - times[4]
+
+        name = bytes(fields[0])
+        last_busy, last_total = self.last_cpu_times.get(name, (0, 0))
+        self.last_cpu_times[name] = (busy, total)
+
+        delta_total = total - last_total
+        delta_busy = busy - last_busy
+
+        if delta_total <= 0:
+            return 0.0
+
+        return round(max(delta_busy, 0) / delta_total * 100, 1)
+
+    def read_memory(self):
+        """
+        This method reads MemTotal and MemAvailable from /proc/meminfo.
+        It returns the RAM usage percentage, like psutil.virtual_memory().percent.
+        """
+        size = self.meminfo.read()
+        buffer = self.meminfo.buffer
+
+        total = self.meminfo_field(buffer, size, b"MemTotal:")
+        available = self.meminfo_field(buffer, size, b"MemAvailable:")
+
+        if not total:
+            return 0.0
+
+        return round((total - available) / total * 100, 1)
+
+    @staticmethod
+    def lines(proc_file):
+        """
+        This method re-reads a /proc file and returns its lines.
+        """
+        size = proc_file.read()
+        return bytes(memoryview(proc_file.buffer)[:size]).splitlines()
+
+    @staticmethod
+    def meminfo_field(buffer, size, key):
+        """
+        This method parses the value of one /proc/meminfo field, in kB, without copying the whole buffer.
+        """
+        start = buffer.find(key, 0, size)
+
+        if start == -1:
+            return 0
+
+        start += len(key)
+        return int(buffer[start:buffer.find(b"kB", start, size)])
+
+    def sample_cpu(self, snapshot):
+        snapshot.cpu_usage = self.read_cpu()
+
+    def sample_memory(self, snapshot):
+        snapshot.ram_usage = self.read_memory()
+
+    def sample_disk(self, snapshot, devices=None):
+        """
+        This method sums the counters of every whole disk in /proc/diskstats.
+        When devices is a dict, the counters of every disk are stored in it as well.
+        """
+        read_sectors = write_sectors = busy_time = 0
+
+        for line in self.lines(self.diskstats):
+            fields = line.split()
+
+            # Partitions on old kernels only have 7 fields
+            if len(fields) < 14 or not self.is_storage_device(fields[2]):
+                continue
+
+            read, write, busy = int(fields[5]), int(fields[9]), int(fields[12])
+            read_sectors += read
+            write_sectors += write
+            busy_time += busy
+
+            if devices is not None:
+                name = fields[2].decode()
+                if self.filters["disk"].allowed(name):
+                    devices[name] = {
+                        "disk_busy_time": busy / 1000,
+                        "disk_read_bytes": read * SECTOR_SIZE,
+                        "disk_write_bytes": write * SECTOR_SIZE,
+                    }
+
+        snapshot.disk_busy_time = busy_time / 1000
+        snapshot.disk_read_bytes = read_sectors * SECTOR_SIZE
+        snapshot.disk_write_bytes = write_sectors * SECTOR_SIZE
+
+    def sample_network(self, snapshot, interfaces=None):
+        """
+        This method sums the bytes received and sent by every interface in /proc/net/dev.
+        When interfaces is a dict, the counters of every interface are stored in it as well.
+        """
+        recv = sent = 0
+
+        # The first two lines are headers
+        for line in self.lines(self.net_dev)[2:]:
+            colon = line.find(b":")
+            fields = line[colon + 1:].split()
+            received, transmitted = int(fields[0]), int(fields[8])
+            recv += received
+            sent += transmitted
+
+            if interfaces is not None:
+                name = line[:colon].strip().decode()
+                if self.filters["network"].allowed(name):
+                    interfaces[name] = {"network_sent": transmitted, "network_recv": received}
+
+        snapshot.network_recv = recv
+        snapshot.network_sent = sent
+
+    def sample_tcp(self, snapshot):
+        """
+        This method counts the TCP sockets in each state, and reads the TCP counters of the kernel.
+        """
+        for field, count in count_states(self.tcp_tables).items():
+            setattr(snapshot, field, count)
+
+        files = {b"TcpExt:": self.netstat, b"Tcp:": self.snmp}
+        sizes = {group: proc_file.read() for group, proc_file in files.items()}
+
+        for field, (group, name) in TCP_COUNTERS.items():
+            setattr(snapshot, field, read_counter(files[group].buffer, sizes[group], group, name))
+
+    # =============== Breakdowns ===============
+    def sample_cpu_breakdown(self, snapshot):
+        cores = {}
+        snapshot.cpu_usage = self.read_cpu(cores)
+        snapshot.breakdown["cpu"] = cores
+
+    def sample_disk_breakdown(self, snapshot):
+        devices = {}
+        self.sample_disk(snapshot, devices)
+        snapshot.breakdown["disk"] = devices
+
+    def sample_network_breakdown(self, snapshot):
+        interfaces = {}
+        self.sample_network(snapshot, interfaces)
+        snapshot.breakdown["network"] = interfaces
+
+    def close(self):
+        """
+        This method stops the threads of the deadline, and closes the /proc files.
+        """
+        super().close()
+
+        for proc_file in self.files.values():
+            proc_file.close()
+
+        for table in self.tcp_tables:
+            table.close()
+
+        if self.netstat is not None:
+            self.netstat.close()
@@ -0,0 +1,132 @@
+"""
+This module is used to report the processes using the most CPU and memory, so that an alert on
+the host totals (e.g. cpu_usage) can be traced back to the processes causing it.
+
++ The processes are listed in a single pass of psutil.process_iter(), which only reads the
+  attributes that are reported (name, creation time, CPU times and memory), once per process.
++ psutil.process_iter() keeps the psutil.Process of every PID between passes. The collector keeps,
+  by (pid, creation time), the CPU time of every process at the previous pass, so the CPU usage is
+  measured between two passes, and a PID reused by a new process starts from scratch instead of
+  inheriting a wrong delta.
++ Only the top_n processes by CPU usage and the top_n by resident memory are reported, and never
+  more than max_series in total, so hosts with thousands of processes keep a bounded number of series.
++ Reading thousands of processes still takes a while (two /proc files per process on Linux), so
+  a background thread reads them every interval seconds, like the sensor cache (see sensor_cache.py).
+  The metric callbacks only read the last ranking, and never wait on a pass.
+"""
+
+import heapq, threading, time
+from operator import attrgetter
+from psutil import process_iter, cpu_count
+
+# Attributes read by process_iter(), all from the same one or two /proc files on Linux
+ATTRS = ["name", "create_time", "cpu_times", "memory_info"]
+
+class ProcessEntry:
+    """
+    A cached process, with its values at the last pass.
+    """
+    __slots__ = ("attributes", "cpu_time", "cpu_usage", "rss")
+
+    def __init__(self, pid, name):
+        self.attributes = {"pid": str(pid), "name": name}
+        self.cpu_time = None
+        self.cpu_usage = 0.0
+        self.rss = 0
+
+class ProcessCollector:
+    def __init__(self, top_n=10, max_series=20, interval=15.0):
+        """
+        top_n is the number of processes reported by CPU usage, and again by resident memory.
+        max_series is the maximum number of processes reported, whichever ranking they come from.
+        interval is the number of seconds between two passes.
+        """
+        self.top_n = top_n
+        self.max_series = max_series
+        self.interval = interval
+        self.cpus = cpu_count() or 1
+
+        # Cached processes by (pid, creation time); both are replaced in a single assignment by the refresh thread
+        self.processes = {}
+        self.top = []
+        self.collected = None
+        self.errors = 0
+
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    # =============== Refresh Thread ===============
+    def collect(self):
+        """
+        This method reads every process once, and ranks them.
+        The CPU usage of a process is its share of the CPU time of the whole host since the last pass,
+        so the usages of all processes add up to cpu_usage.
+        """
+        now = time.monotonic()
+        elapsed = (now - self.collected) * self.cpus if self.collected is not None else 0
+        processes = {}
+
+        for process in process_iter(ATTRS):
+            info = process.info
+
+            # e.g. the processes of other users on macOS
+            if info["cpu_times"] is None or info["memory_info"] is None:
+                continue
+
+            key = (process.pid, info["create_time"])
+            entry = self.processes.get(key)
+            if entry is None:
+                entry = ProcessEntry(process.pid, info["name"] or "")
+
+            cpu_time = info["cpu_times"].user + info["cpu_times"].system
+            if entry.cpu_time is not None and elapsed > 0:
+                entry.cpu_usage = round(max(cpu_time - entry.cpu_time, 0) / elapsed * 100, 1)
+
+            entry.cpu_time = cpu_time
+            entry.rss = info["memory_info"].rss
+            processes[key] = entry
+
+        # The processes that exited, or whose PID was reused, are forgotten
+        self.processes = processes
+        self.collected = now
+
+        entries = processes.values()
+        top = heapq.nlargest(self.top_n, entries, key=attrgetter("cpu_usage"))
+        top += heapq.nlargest(self.top_n, entries, key=attrgetter("rss"))
+        self.top = list(dict.fromkeys(top))[:self.max_series]
+
+    def refresh(self):
+        try:
+            self.collect()
+        except Exception as e:
+            self.errors += 1
+            print(f"Error reading processes: {e}")
+
+    def run(self):
+        # Like the CPU usage of the host, the usage of each process is measured from the first pass on
+        while not self.stop_event.is_set():
+            self.refresh()
+            self.stop_event.wait(self.interval)
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="process_collector", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=1.0):
+        """
+        This method stops the refresh thread. A pass still running is not waited for.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    # =============== Ranking ===============
+    def get(self):
+        """
+        This method returns the processes reported by the last pass, without waiting for a new one.
+        """
+        return self.top
+
+    def count(self):
+        return len(self.processes)
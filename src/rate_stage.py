@@ -0,0 +1,79 @@
+"""
+This module is used to turn monotonic counters into per-second rates.
+Each counter keeps its previous sample, so the rate is the delta between two
+consecutive snapshots divided by the time elapsed between them.
+
+A counter that goes backwards either wrapped around (32 or 64 bits) or was reset
+(e.g. a network interface was removed). Wraparounds are corrected; after a reset,
+no rate is reported for that sample.
+"""
+
+WRAP_LIMITS = (2 ** 32, 2 ** 64)
+
+class CounterRate:
+    """
+    The previous sample and the last rate of one counter.
+    """
+    __slots__ = ("previous", "previous_time", "rate")
+
+    def __init__(self):
+        self.previous = None
+        self.previous_time = None
+        self.rate = None
+
+    def update(self, value, timestamp):
+        """
+        This method updates the counter with a new sample.
+        It returns the rate per second since the previous sample, or None if it cannot be computed.
+        """
+        previous, previous_time = self.previous, self.previous_time
+        self.previous, self.previous_time = value, timestamp
+
+        if previous is None or timestamp <= previous_time:
+            self.rate = None
+            return None
+
+        delta = value - previous
+
+        if delta < 0:
+            delta = wrapped_delta(previous, value)
+
+        self.rate = None if delta is None else delta / (timestamp - previous_time)
+        return self.rate
+
+def wrapped_delta(previous, value):
+    """
+    This function returns the delta of a counter that went backwards, assuming it wrapped around.
+    It returns None when a wraparound is not plausible, meaning the counter was reset.
+    """
+    for limit in WRAP_LIMITS:
+        if previous < limit:
+            delta = value + limit - previous
+            # A wrapped counter only moved a little past its limit
+            return delta if delta < limit // 2 else None
+
+    return None
+
+class RateStage:
+    def __init__(self, fields):
+        """
+        fields maps each counter field of the snapshot to the field its rate is stored in.
+        """
+        self.fields = fields
+        self.counters = {field: CounterRate() for field in fields}
+
+    def update(self, snapshot, times=None, stale=()):
+        """
+        This method computes the rate of every counter of the snapshot and stores it in the snapshot.
+        times optionally maps a counter to the time it was read at, when it differs from the snapshot's.
+        The counters in stale were not read again; they keep their last rate.
+        """
+        for field, rate_field in self.fields.items():
+            counter = self.counters[field]
+
+            if field in stale:
+                setattr(snapshot, rate_field, counter.rate)
+                continue
+
+            timestamp = times.get(field, snapshot.monotonic) if times else snapshot.monotonic
+            setattr(snapshot, rate_field, counter.update(getattr(snapshot, field), timestamp))
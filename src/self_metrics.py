@@ -0,0 +1,231 @@
+"""
+This module is used to monitor the monitor itself.
+It exports the overhead of the agent under a separate meter ("system_monitor.self"):
++ agent_callback_duration: the duration of every metric callback
++ agent_export_duration and agent_export_failures_total: the latency and the failures of the exports
++ agent_alert_queue_depth and agent_alerts_dropped_total: the state of the alert queue
++ agent_alert_errors_total: the values the alert worker failed to evaluate, and the batches it failed to write
++ agent_process_cpu_usage and agent_process_rss: the CPU and memory used by the agent's process
++ agent_spooled_batches: the batches waiting in the export spool, when spooling is enabled
++ agent_source_timeouts_total: the collections in which each source missed its deadline
+
+That way, an alert can fire when the monitor is the one eating the node.
+"""
+
+import time
+import psutil
+
+from opentelemetry import metrics
+from opentelemetry.sdk.metrics.export import MetricExporter, MetricExportResult
+
+# Bucket boundaries of the duration histograms, in milliseconds
+CALLBACK_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100]
+EXPORT_BUCKETS = [1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+class SelfMetrics:
+    def __init__(self, monitor):
+        """
+        monitor is the SystemMonitor being observed.
+        Its alert manager and exporter are read when the metrics are collected, so they can be set up later.
+        """
+        self.monitor = monitor
+        self.process = psutil.Process()
+
+        # The first call of cpu_percent() always returns 0; start measuring now
+        self.process.cpu_percent(interval=None)
+
+        self.set_meter()
+        self.set_metrics()
+
+    def set_meter(self):
+        """
+        This method sets up the meter.
+        A separate meter keeps the agent's own metrics apart from the system metrics.
+        """
+        self.meter = metrics.get_meter("system_monitor.self")
+
+    def set_metrics(self):
+        """
+        This method sets up the metrics.
+        """
+        self.callback_duration = self.meter.create_histogram(
+            "agent_callback_duration",
+            unit="ms",
+            description="Duration of the metric callbacks",
+            explicit_bucket_boundaries_advisory=CALLBACK_BUCKETS,
+        )
+
+        self.export_duration = self.meter.create_histogram(
+            "agent_export_duration",
+            unit="ms",
+            description="Duration of the metric exports",
+            explicit_bucket_boundaries_advisory=EXPORT_BUCKETS,
+        )
+
+        self.export_failures = self.meter.create_counter(
+            "agent_export_failures_total",
+            description="Number of metric exports that failed",
+        )
+
+        self.alert_queue_depth = self.meter.create_observable_gauge(
+            "agent_alert_queue_depth",
+            callbacks=[self.alert_queue_callback],
+            description="Number of values waiting to be evaluated by the alert worker",
+        )
+
+        self.alerts_dropped = self.meter.create_observable_counter(
+            "agent_alerts_dropped_total",
+            callbacks=[self.alerts_dropped_callback],
+            description="Number of values dropped because the alert queue was full",
+        )
+
+        self.alert_errors = self.meter.create_observable_counter(
+            "agent_alert_errors_total",
+            callbacks=[self.alert_errors_callback],
+            description="Number of errors of the alert worker, by stage (evaluate or write)",
+        )
+
+        self.process_cpu = self.meter.create_observable_gauge(
+            "agent_process_cpu_usage",
+            callbacks=[self.process_cpu_callback],
+            unit="%",
+            description="CPU usage percentage of the agent's process",
+        )
+
+        self.process_rss = self.meter.create_observable_gauge(
+            "agent_process_rss",
+            callbacks=[self.process_rss_callback],
+            unit="By",
+            description="Resident memory of the agent's process in bytes",
+        )
+
+        self.spooled_batches = self.meter.create_observable_gauge(
+            "agent_spooled_batches",
+            callbacks=[self.spool_callback],
+            description="Number of export batches waiting in the spool",
+        )
+
+        self.source_timeouts = self.meter.create_observable_counter(
+            "agent_source_timeouts_total",
+            callbacks=[self.source_timeouts_callback],
+            description="Number of collections in which a source missed its deadline",
+        )
+
+    # =============== Wrappers ===============
+    def timed(self, name, callback):
+        """
+        This method wraps a metric callback so that its duration is recorded under the given name.
+        """
+        record = self.callback_duration.record
+        attributes = {"callback": name}
+
+        def timed_callback(options):
+            start = time.perf_counter()
+            try:
+                return callback(options)
+            finally:
+                record((time.perf_counter() - start) * 1000, attributes)
+
+        return timed_callback
+
+    def timed_exporter(self, exporter):
+        """
+        This method wraps an exporter so that the duration and the failures of its exports are recorded.
+        """
+        return TimedExporter(exporter, self)
+
+    # =============== Callbacks ===============
+    def alert_queue_callback(self, options: metrics.CallbackOptions) -> list[metrics.Observation]:
+        alert_manager = getattr(self.monitor, "alert_manager", None)
+
+        if alert_manager is None:
+            return []
+
+        return [metrics.Observation(value=alert_manager.alert_worker.depth(), attributes={})]
+
+    def alerts_dropped_callback(self, options: metrics.CallbackOptions) -> list[metrics.Observation]:
+        alert_manager = getattr(self.monitor, "alert_manager", None)
+
+        if alert_manager is None:
+            return []
+
+        return [metrics.Observation(value=alert_manager.alert_worker.dropped, attributes={})]
+
+    def alert_errors_callback(self, options: metrics.CallbackOptions) -> list[metrics.Observation]:
+        alert_manager = getattr(self.monitor, "alert_manager", None)
+
+        if alert_manager is None:
+            return []
+
+        worker = alert_manager.alert_worker
+        return [
+            metrics.Observation(value=worker.evaluation_errors, attributes={"stage": "evaluate"}),
+            metrics.Observation(value=worker.errors, attributes={"stage": "write"}),
+        ]
+
+    def process_cpu_callback(self, options: metrics.CallbackOptions) -> list[metrics.Observation]:
+        return [metrics.Observation(value=self.process.cpu_percent(interval=None), attributes={})]
+
+    def process_rss_callback(self, options: metrics.CallbackOptions) -> list[metrics.Observation]:
+        return [metrics.Observation(value=self.process.memory_info().rss, attributes={})]
+
+    def spool_callback(self, options: metrics.CallbackOptions) -> list[metrics.Observation]:
+        exporter = getattr(self.monitor, "collector_exporter", None)
+
+        # The spooling exporter may be wrapped by others (e.g. the coalescing exporter of the power scheduler)
+        while exporter is not None and not hasattr(exporter, "stats"):
+            exporter = getattr(exporter, "exporter", None)
+
+        if exporter is None:
+            return []
+
+        spool_stats = exporter.stats()
+        return [
+            metrics.Observation(value=spool_stats["spooled_batches"], attributes={"state": "pending"}),
+            metrics.Observation(value=spool_stats["dropped_batches"], attributes={"state": "dropped"}),
+        ]
+
+    def source_timeouts_callback(self, options: metrics.CallbackOptions) -> list[metrics.Observation]:
+        sampler = getattr(self.monitor, "sampler", None)
+
+        if sampler is None or sampler.deadline is None:
+            return []
+
+        return [
+            metrics.Observation(value=timeouts, attributes={"source": source})
+            for source, timeouts in sampler.timeouts.items()
+        ]
+
+class TimedExporter(MetricExporter):
+    def __init__(self, exporter, self_metrics):
+        """
+        This class records the duration and the failures of the exports of another exporter.
+        """
+        super().__init__(
+            preferred_temporality=exporter._preferred_temporality,
+            preferred_aggregation=exporter._preferred_aggregation,
+        )
+        self.exporter = exporter
+        self.self_metrics = self_metrics
+
+    def export(self, metrics_data, timeout_millis=10_000, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = self.exporter.export(metrics_data, timeout_millis=timeout_millis, **kwargs)
+        except Exception:
+            # An export that raises failed too
+            self.self_metrics.export_failures.add(1)
+            raise
+        finally:
+            self.self_metrics.export_duration.record((time.perf_counter() - start) * 1000)
+
+        if result != MetricExportResult.SUCCESS:
+            self.self_metrics.export_failures.add(1)
+
+        return result
+
+    def force_flush(self, timeout_millis=10_000):
+        return self.exporter.force_flush(timeout_millis)
+
+    def shutdown(self, timeout_millis=30_000, **kwargs):
+        self.exporter.shutdown(timeout_millis=timeout_millis, **kwargs)
@@ -0,0 +1,126 @@
+"""
+This module is used to read the temperature sensors and the battery without slowing down the exports.
+Reading them can take a long time on some hardware, since psutil walks many sysfs/hwmon files,
+so a background thread reads them on its own, slower, schedule and caches the readings.
+The metric callbacks only read the cache, and never wait on the sensors.
+
+Every reading comes with its age. A reading older than max_age (e.g. when a sensor read hangs)
+is still reported, but flagged as stale.
+"""
+
+import threading, time
+
+try:
+    from psutil import sensors_temperatures
+except ImportError:
+    # Only available on Linux and FreeBSD
+    sensors_temperatures = None
+
+try:
+    from psutil import sensors_battery
+except ImportError:
+    sensors_battery = None
+
+class SensorReadings:
+    """
+    The readings of one refresh.
+    temperatures is a list of (chip, sensor, degrees Celsius).
+    battery is (percent, seconds left or None, plugged in), or None without a battery.
+    """
+    __slots__ = ("monotonic", "temperatures", "battery")
+
+    def __init__(self, monotonic, temperatures, battery):
+        self.monotonic = monotonic
+        self.temperatures = temperatures
+        self.battery = battery
+
+def read_sensors():
+    """
+    This function reads the temperature sensors and the battery.
+    """
+    temperatures = []
+    if sensors_temperatures is not None:
+        for chip, entries in sensors_temperatures().items():
+            for index, entry in enumerate(entries):
+                temperatures.append((chip, entry.label or str(index), entry.current))
+
+    battery = sensors_battery() if sensors_battery is not None else None
+    if battery is not None:
+        # psutil reports the time left as a negative constant when it is unknown or unlimited
+        seconds_left = battery.secsleft if battery.secsleft >= 0 else None
+        battery = (battery.percent, seconds_left, bool(battery.power_plugged))
+
+    return SensorReadings(time.monotonic(), temperatures, battery)
+
+def sensors_available():
+    return sensors_temperatures is not None or sensors_battery is not None
+
+class SensorCache:
+    def __init__(self, interval=30.0, max_age=None, reader=read_sensors):
+        """
+        interval is the number of seconds between two refreshes.
+        Readings older than max_age seconds (three intervals by default) are stale.
+        """
+        self.interval = interval
+        self.max_age = max_age if max_age is not None else interval * 3
+        self.reader = reader
+
+        # Replaced in a single assignment by the refresh thread
+        self.readings = None
+        self.errors = 0
+
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    # =============== Refresh Thread ===============
+    def refresh(self):
+        try:
+            self.readings = self.reader()
+        except Exception as e:
+            self.errors += 1
+            print(f"Error reading sensors: {e}")
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.refresh()
+            self.stop_event.wait(self.interval)
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="sensor_cache", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=1.0):
+        """
+        This method stops the refresh thread. A sensor read that hangs is not waited for.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    # =============== Readings ===============
+    def get(self):
+        """
+        This method returns the cached readings, their age in seconds, and whether they are stale.
+        The readings are None until the first refresh is done.
+        """
+        readings = self.readings
+
+        if readings is None:
+            return None, None, True
+
+        age = time.monotonic() - readings.monotonic
+        return readings, age, age > self.max_age
+
+    def battery(self):
+        """
+        This method returns the battery charge (in percent) and whether the device is plugged in,
+        like power_scheduler.read_battery(), from the cache.
+        """
+        readings = self.readings
+
+        if readings is None or readings.battery is None:
+            return None, True
+
+        percent, _, plugged = readings.battery
+        return percent, plugged
@@ -0,0 +1,426 @@
+"""
+This module is used to take snapshots of the system metrics.
+Every source (CPU, RAM, disk, network and TCP) is sampled once per collection cycle
+and stored in a compact SystemSnapshot record.
+The callbacks of SystemMonitor read their values from the snapshot instead of
+calling psutil on their own, so each source is only read once per cycle.
+The per-second rates of the counters are computed once per snapshot as well.
+Only the enabled sources are sampled (see metric_registry.py).
+
+Sources can also be broken down per core, disk or network interface. The breakdown
+comes from the same call as the totals, so a source is still read once per cycle.
+
+With a deadline (see set_deadline()), the sources are read in parallel daemon threads, and a
+source that does not answer in time keeps its last values, flagged as stale. Its read
+goes on in the background, and its values are used once it returns, so one bad source
+never delays the export of the others.
+"""
+
+import os, sys, time
+from concurrent.futures import wait
+from collections import Counter
+from daemon_pool import DaemonPool
+from rate_stage import RateStage
+from tcp_stats import STATE_FIELDS, STATUS_FIELDS
+from psutil import cpu_times, virtual_memory, net_io_counters, disk_io_counters, net_connections
+
+# Sources that can be sampled, and the fields of the snapshot each one fills
+SOURCE_FIELDS = {
+    "cpu": ("cpu_usage",),
+    "memory": ("ram_usage",),
+    "disk": ("disk_busy_time", "disk_read_bytes", "disk_write_bytes"),
+    "network": ("network_sent", "network_recv"),
+    "tcp": STATE_FIELDS + ("tcp_listen_overflows", "tcp_listen_drops", "tcp_retransmits"),
+    # Only sampled from a cgroup (see cgroup_sampler.py)
+    "container": (
+        "container_cpu_limit", "container_cpu_throttled", "container_cpu_pressure",
+        "container_memory_usage", "container_memory_limit",
+    ),
+}
+SOURCES = tuple(SOURCE_FIELDS)
+
+# Sources sampled unless told otherwise; the TCP source reads the socket tables,
+# which are large on busy servers, so it has to be enabled explicitly.
+# The container source is added when running in a container (see SystemMonitor.set_registry())
+DEFAULT_SOURCES = ("cpu", "memory", "disk", "network")
+
+# Sources that can be broken down, and the attribute naming each of their series
+BREAKDOWN_ATTRIBUTES = {
+    "cpu": "cpu",
+    "disk": "device",
+    "network": "interface",
+}
+
+# Counter fields of the snapshot, and the fields their per-second rates are stored in
+RATE_FIELDS = {
+    "disk_busy_time": "disk_busy_rate",
+    "disk_read_bytes": "disk_read_rate",
+    "disk_write_bytes": "disk_write_rate",
+    "network_sent": "network_sent_rate",
+    "network_recv": "network_recv_rate",
+    "tcp_listen_overflows": "tcp_listen_overflow_rate",
+    "tcp_listen_drops": "tcp_listen_drop_rate",
+    "tcp_retransmits": "tcp_retransmit_rate",
+}
+
+class SystemSnapshot:
+    """
+    A compact record holding the values sampled in one collection cycle.
+    """
+    __slots__ = (
+        "monotonic",
+        "host",
+        "cpu_usage",
+        "ram_usage",
+        "disk_busy_time",
+        "disk_read_bytes",
+        "disk_write_bytes",
+        "network_sent",
+        "network_recv",
+        "tcp_established",
+        "tcp_syn_sent",
+        "tcp_syn_recv",
+        "tcp_fin_wait",
+        "tcp_time_wait",
+        "tcp_closing",
+        "tcp_close_wait",
+        "tcp_last_ack",
+        "tcp_listen",
+        "tcp_listen_overflows",
+        "tcp_listen_drops",
+        "tcp_retransmits",
+        "container_cpu_limit",
+        "container_cpu_throttled",
+        "container_cpu_pressure",
+        "container_memory_usage",
+        "container_memory_limit",
+        "disk_busy_rate",
+        "disk_read_rate",
+        "disk_write_rate",
+        "network_sent_rate",
+        "network_recv_rate",
+        "tcp_listen_overflow_rate",
+        "tcp_listen_drop_rate",
+        "tcp_retransmit_rate",
+        "breakdown",
+        "stale",
+    )
+
+    def __init__(self, host=None):
+        self.monotonic = 0.0
+        self.host = host
+        self.cpu_usage = 0.0
+        self.ram_usage = 0.0
+        self.disk_busy_time = 0
+        self.disk_read_bytes = 0
+        self.disk_write_bytes = 0
+        self.network_sent = 0
+        self.network_recv = 0
+
+        # Number of TCP sockets in each state, and the TCP counters of the kernel
+        for field in STATE_FIELDS:
+            setattr(self, field, 0)
+        self.tcp_listen_overflows = 0
+        self.tcp_listen_drops = 0
+        self.tcp_retransmits = 0
+
+        # Limits and usage of the container, None until its cgroup is read
+        self.container_cpu_limit = None
+        self.container_cpu_throttled = 0
+        self.container_cpu_pressure = None
+        self.container_memory_usage = None
+        self.container_memory_limit = None
+
+        # Rates are None until two snapshots have been taken
+        self.disk_busy_rate = None
+        self.disk_read_rate = None
+        self.disk_write_rate = None
+        self.network_sent_rate = None
+        self.network_recv_rate = None
+        self.tcp_listen_overflow_rate = None
+        self.tcp_listen_drop_rate = None
+        self.tcp_retransmit_rate = None
+
+        # Values of each core, disk or interface by source, e.g. {"disk": {"sda": {"disk_read_bytes": 512, ...}}}
+        self.breakdown = {}
+
+        # Sources that missed their deadline, whose values are the last known ones
+        self.stale = frozenset()
+
+class SnapshotSampler:
+    def __init__(self, max_age=1.0, sources=DEFAULT_SOURCES):
+        """
+        max_age is the number of seconds a snapshot is reused for.
+        It must be shorter than the export interval and longer than one collection cycle,
+        so that all callbacks of the same cycle share the same snapshot.
+        sources are the sources to sample (see SOURCE_FIELDS); the fields of the others keep their initial value.
+        """
+        self.max_age = max_age
+        self.snapshot = SystemSnapshot(os.getenv("HOST"))
+        self.sampled = False
+
+        self.sources = tuple(sources)
+        self.fields = {field for source in self.sources for field in SOURCE_FIELDS[source]}
+        self.rate_stage = RateStage({field: rate for field, rate in RATE_FIELDS.items() if field in self.fields})
+
+        # Whether a disk is a whole disk (and not a partition)
+        self.storage_devices = {}
+
+        # CPU times of the previous sample, of the host (None) and of each core, used to compute the CPU usage.
+        # psutil.cpu_percent() keeps them per thread instead, and the deadline's thread pool changes threads.
+        self.last_times = {}
+
+        # Deadline of the sources, see set_deadline()
+        self.deadline = None
+        self.executor = None
+        self.pending = {}
+        self.closed = False
+        self.timeouts = dict.fromkeys(self.sources, 0)
+
+        self.set_breakdown({})
+
+    def set_deadline(self, deadline):
+        """
+        This method makes every source answer within deadline seconds.
+        The sources are then read in a small pool of daemon threads (see daemon_pool.py), one thread per source at most.
+        A source that misses the deadline keeps its last values and is flagged as stale in the snapshot;
+        it is neither read again nor waited for until its pending read returns, nor when the agent exits.
+        """
+        self.deadline = deadline
+        self.executor = DaemonPool("source", max_idle=max(len(self.sources), 1))
+
+    def set_breakdown(self, filters):
+        """
+        This method enables the breakdown of some sources.
+        filters maps each source to break down to the DeviceFilter choosing its series (see device_filter.py).
+        A source that is not broken down is read with the cheaper call returning its totals only.
+        """
+        self.filters = filters
+        self.readers = [
+            getattr(self, f"sample_{source}_breakdown" if source in filters else f"sample_{source}")
+            for source in self.sources
+        ]
+
+    def get(self):
+        """
+        This method returns the snapshot of the current collection cycle.
+        The system is only sampled again when the snapshot is older than max_age,
+        and the rates are updated along with every new sample.
+        Once the sampler is closed, the last snapshot is returned (e.g. to a collection that outlived the shutdown).
+        """
+        now = time.monotonic()
+
+        if self.closed:
+            return self.snapshot
+
+        if not self.sampled or now - self.snapshot.monotonic >= self.max_age:
+            if self.deadline is None:
+                self.sample(now)
+                self.rate_stage.update(self.snapshot)
+            else:
+                times = self.sample_with_deadline(now)
+                stale = {field for source in self.snapshot.stale for field in SOURCE_FIELDS[source]}
+                self.rate_stage.update(self.snapshot, times, stale)
+
+        return self.snapshot
+
+    def sample(self, now=None):
+        """
+        This method samples every enabled source once and stores the values in the snapshot.
+        The snapshot object is reused to avoid allocating a new record every cycle.
+        """
+        snapshot = self.snapshot
+
+        for read in self.readers:
+            read(snapshot)
+
+        snapshot.monotonic = time.monotonic() if now is None else now
+        self.sampled = True
+
+        return snapshot
+
+    def sample_with_deadline(self, now=None):
+        """
+        This method reads every source in the thread pool, waiting at most deadline seconds,
+        and stores the values of the sources that answered in the snapshot.
+        Each source is read into a snapshot of its own, so a late read never writes to the shared one.
+        It returns the time each field was read at, since a late read is used one or more cycles later.
+        """
+        snapshot = self.snapshot
+        submitted = []
+
+        for source, read in zip(self.sources, self.readers):
+            if source not in self.pending:
+                scratch = SystemSnapshot()
+                future = self.executor.submit(self.read_source, read, scratch)
+                self.pending[source] = (future, scratch)
+                submitted.append(future)
+
+        wait(submitted, timeout=self.deadline)
+
+        times = {}
+        stale = set()
+
+        for source, (future, scratch) in list(self.pending.items()):
+            if not future.done():
+                stale.add(source)
+                self.timeouts[source] += 1
+                continue
+
+            del self.pending[source]
+
+            if future.exception() is not None:
+                print(f"Error sampling the {source} source: {future.exception()}")
+                stale.add(source)
+                continue
+
+            for field in SOURCE_FIELDS[source]:
+                setattr(snapshot, field, getattr(scratch, field))
+                times[field] = scratch.monotonic
+
+            if source in scratch.breakdown:
+                snapshot.breakdown[source] = scratch.breakdown[source]
+
+        snapshot.stale = frozenset(stale)
+        snapshot.monotonic = time.monotonic() if now is None else now
+        self.sampled = True
+
+        return times
+
+    @staticmethod
+    def read_source(read, scratch):
+        read(scratch)
+        scratch.monotonic = time.monotonic()
+
+    # =============== Sources ===============
+    def times_usage(self, core, times):
+        """
+        This method returns the CPU usage percentage of the host (core None) or of a core since the previous call
+        for the same one, like psutil.cpu_percent(interval=None). It is 0 on the first call.
+        """
+        total = sum(times)
+
+        # guest and guest_nice are already accounted for in user and nice on Linux
+        total -= getattr(times, "guest", 0) + getattr(times, "guest_nice", 0)
+        busy = total - times.idle - getattr(times, "iowait", 0)
+
+        last_busy, last_total = self.last_times.get(core, (busy, total))
+        self.last_times[core] = (busy, total)
+
+        delta_total = total - last_total
+        if delta_total <= 0:
+            return 0.0
+
+        return round(min(max(busy - last_busy, 0) / delta_total * 100, 100.0), 1)
+
+    def sample_cpu(self, snapshot):
+        snapshot.cpu_usage = self.times_usage(None, cpu_times())
+
+    def sample_memory(self, snapshot):
+        snapshot.ram_usage = virtual_memory().percent
+
+    def sample_disk(self, snapshot):
+        disk = disk_io_counters()
+
+        # disk_io_counters() returns None when there are no disks (e.g. some containers)
+        if disk is not None:
+            snapshot.disk_busy_time = getattr(disk, "busy_time", 0) / 1000
+            snapshot.disk_read_bytes = disk.read_bytes
+            snapshot.disk_write_bytes = disk.write_bytes
+
+    def sample_network(self, snapshot):
+        net = net_io_counters()
+
+        if net is not None:
+            snapshot.network_sent = net.bytes_sent
+            snapshot.network_recv = net.bytes_recv
+
+    def sample_tcp(self, snapshot):
+        """
+        This method counts the TCP sockets in each state with psutil, which builds one object per socket.
+        psutil does not report the listen queue overflows, drops and retransmits, which stay at 0.
+        The /proc backend counts the sockets much faster (see tcp_stats.py).
+        """
+        counts = dict.fromkeys(STATE_FIELDS, 0)
+
+        for status, count in Counter(connection.status for connection in net_connections("tcp")).items():
+            if status in STATUS_FIELDS:
+                counts[STATUS_FIELDS[status]] += count
+
+        for field, count in counts.items():
+            setattr(snapshot, field, count)
+
+    # =============== Breakdowns ===============
+    def is_storage_device(self, name):
+        """
+        This method tells whether a disk is a whole disk, the same way psutil does on Linux.
+        Partitions are skipped, since whole disks already account for them.
+        The result is cached per device name.
+        """
+        is_device = self.storage_devices.get(name)
+
+        if is_device is None:
+            path = f"/sys/block/{(name.decode() if isinstance(name, bytes) else name).replace('/', '!')}"
+            is_device = not sys.platform.startswith("linux") or os.path.exists(path)
+            self.storage_devices[name] = is_device
+
+        return is_device
+
+    def sample_cpu_breakdown(self, snapshot):
+        """
+        The total is the mean of the cores, so a single psutil call is made.
+        """
+        cores = [self.times_usage(core, times) for core, times in enumerate(cpu_times(percpu=True))]
+        allowed = self.filters["cpu"].allowed
+
+        snapshot.cpu_usage = round(sum(cores) / len(cores), 1) if cores else 0.0
+        snapshot.breakdown["cpu"] = {
+            str(core): {"cpu_usage": usage} for core, usage in enumerate(cores) if allowed(str(core))
+        }
+
+    def sample_disk_breakdown(self, snapshot):
+        allowed = self.filters["disk"].allowed
+        busy_time = read_bytes = write_bytes = 0
+        devices = {}
+
+        for name, disk in disk_io_counters(perdisk=True).items():
+            if not self.is_storage_device(name):
+                continue
+
+            busy = getattr(disk, "busy_time", 0) / 1000
+            busy_time += busy
+            read_bytes += disk.read_bytes
+            write_bytes += disk.write_bytes
+
+            if allowed(name):
+                devices[name] = {"disk_busy_time": busy, "disk_read_bytes": disk.read_bytes, "disk_write_bytes": disk.write_bytes}
+
+        snapshot.disk_busy_time = busy_time
+        snapshot.disk_read_bytes = read_bytes
+        snapshot.disk_write_bytes = write_bytes
+        snapshot.breakdown["disk"] = devices
+
+    def sample_network_breakdown(self, snapshot):
+        allowed = self.filters["network"].allowed
+        sent = recv = 0
+        interfaces = {}
+
+        for name, net in net_io_counters(pernic=True).items():
+            sent += net.bytes_sent
+            recv += net.bytes_recv
+
+            if allowed(name):
+                interfaces[name] = {"network_sent": net.bytes_sent, "network_recv": net.bytes_recv}
+
+        snapshot.network_sent = sent
+        snapshot.network_recv = recv
+        snapshot.breakdown["network"] = interfaces
+
+    def close(self):
+        """
+        This method stops the threads of the deadline, if any. A read still pending is not waited for.
+        """
+        self.closed = True
+
+        if self.executor is not None:
+            self.executor.shutdown()
@@ -0,0 +1,134 @@
+"""
+This module is used to count the TCP connections by state, and to read the TCP counters of the
+kernel, straight from /proc on Linux. psutil.net_connections() builds one object per socket
+(and looks up the process owning each one), which takes seconds on a proxy with 100k sockets.
+
++ /proc/net/tcp and /proc/net/tcp6 are read in fixed-size chunks into a reusable buffer. The
+  state of every line is matched with a compiled regular expression and counted by Counter in C,
+  so the memory used does not grow with the number of sockets, and no line is ever split into fields.
++ The listen queue overflows and drops come from the TcpExt group of /proc/net/netstat, and the
+  retransmitted segments from the Tcp group of /proc/net/snmp.
+
+Like the other /proc files (see proc_sampler.py), the files are opened once and kept open.
+"""
+
+import os, re
+from collections import Counter
+
+# State column of /proc/net/tcp (see include/net/tcp_states.h), and the snapshot field it is counted in
+TCP_STATES = {
+    b"01": "tcp_established",
+    b"02": "tcp_syn_sent",
+    b"03": "tcp_syn_recv",
+    b"04": "tcp_fin_wait",
+    b"05": "tcp_fin_wait",
+    b"06": "tcp_time_wait",
+    b"07": "tcp_closing",
+    b"08": "tcp_close_wait",
+    b"09": "tcp_last_ack",
+    b"0A": "tcp_listen",
+    b"0B": "tcp_closing",
+    # NEW_SYN_RECV: connection requests that have not been accepted yet
+    b"0C": "tcp_syn_recv",
+}
+
+# Same, for the status names of psutil.net_connections()
+STATUS_FIELDS = {
+    "ESTABLISHED": "tcp_established",
+    "SYN_SENT": "tcp_syn_sent",
+    "SYN_RECV": "tcp_syn_recv",
+    "FIN_WAIT1": "tcp_fin_wait",
+    "FIN_WAIT2": "tcp_fin_wait",
+    "TIME_WAIT": "tcp_time_wait",
+    "CLOSE": "tcp_closing",
+    "CLOSE_WAIT": "tcp_close_wait",
+    "LAST_ACK": "tcp_last_ack",
+    "LISTEN": "tcp_listen",
+    "CLOSING": "tcp_closing",
+}
+
+STATE_FIELDS = tuple(dict.fromkeys(TCP_STATES.values()))
+
+# Counters of /proc/net/netstat and /proc/net/snmp: the group they are in, and their name
+TCP_COUNTERS = {
+    "tcp_listen_overflows": (b"TcpExt:", b"ListenOverflows"),
+    "tcp_listen_drops": (b"TcpExt:", b"ListenDrops"),
+    "tcp_retransmits": (b"Tcp:", b"RetransSegs"),
+}
+
+# The state is the two hex digits after the remote port (e.g. "0100007F:0050 0A").
+# No other column is made of four hex digits after a colon, then a space and two hex digits.
+STATE_PATTERN = re.compile(rb":[0-9A-F]{4} ([0-9A-F]{2}) ")
+
+class TcpTable:
+    """
+    A /proc/net/tcp file that is kept open and counted chunk by chunk.
+    """
+    __slots__ = ("path", "fd", "buffer", "view")
+
+    def __init__(self, path, chunk_size=65536):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        self.buffer = bytearray(chunk_size)
+        self.view = memoryview(self.buffer)
+
+    def count(self, counter):
+        """
+        This method adds the number of sockets in each state (e.g. b"01") to counter.
+        The file is read from the beginning, one chunk at a time; a line cut at the end of a chunk
+        is moved to the start of the buffer and completed by the next chunk.
+        """
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        carried = 0
+
+        while True:
+            size = os.readv(self.fd, [self.view[carried:]])
+
+            if size == 0:
+                return counter
+
+            end = carried + size
+            last = self.buffer.rfind(b"\n", 0, end) + 1
+            counter.update(STATE_PATTERN.findall(self.buffer, 0, last))
+
+            carried = end - last
+            self.view[:carried] = self.view[last:end]
+
+    def close(self):
+        self.view.release()
+        os.close(self.fd)
+
+def count_states(tables):
+    """
+    This function returns the number of sockets of the tables in each state, by snapshot field.
+    """
+    counter = Counter()
+    for table in tables:
+        table.count(counter)
+
+    counts = dict.fromkeys(STATE_FIELDS, 0)
+    for state, count in counter.items():
+        if state in TCP_STATES:
+            counts[TCP_STATES[state]] += count
+
+    return counts
+
+def read_counter(buffer, size, group, name):
+    """
+    This function parses one counter of /proc/net/netstat or /proc/net/snmp, where every group
+    is a line of names followed by a line of values, both starting with the group (e.g. b"TcpExt:").
+    It returns 0 when the kernel does not have the counter.
+    """
+    start = buffer.find(group, 0, size)
+
+    if start == -1:
+        return 0
+
+    middle = buffer.find(b"\n", start, size) + 1
+    end = buffer.find(b"\n", middle, size)
+    names = buffer[start:middle].split()
+
+    if name not in names:
+        return 0
+
+    return int(buffer[middle:end if end != -1 else size].split()[names.index(name)])
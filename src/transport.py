@@ -0,0 +1,162 @@
+"""
+This module is used to choose how the metrics are sent to the OpenTelemetry Collector.
+The transport is set with OTLP_PROTOCOL:
++ "http/protobuf" (default) sends them to the OTLP/HTTP receiver, on port 4318
++ "grpc" sends them to the OTLP/gRPC receiver, on port 4317
+
+OTLP_COMPRESSION sets the compression of the payloads, "gzip" (default) or "none".
+OTLP_TEMPORALITY sets the aggregation temporality of the exported sums and histograms:
++ "cumulative" (default) reports the total since the start, for every instrument
++ "delta" reports the change since the previous export, for counters and histograms
++ "lowmemory" reports deltas for synchronous counters and histograms only, whose state is then
+  dropped after every export, and cumulative values for the observable counters
+Both transports keep their connection to the collector open between exports,
+so each export only pays for the payload, and not for a new connection.
+"""
+
+import gzip
+import requests
+from requests.adapters import HTTPAdapter
+
+from opentelemetry.exporter.otlp.proto.http import Compression
+from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
+from opentelemetry.sdk.metrics import (
+    Counter, Histogram, ObservableCounter, ObservableGauge, ObservableUpDownCounter, UpDownCounter,
+)
+from opentelemetry.sdk.metrics.export import AggregationTemporality
+
+PORTS = {"http/protobuf": 4318, "grpc": 4317}
+
+# Instruments reported as deltas by each temporality; the others are cumulative
+DELTA_INSTRUMENTS = {
+    "cumulative": (),
+    "delta": (Counter, Histogram, ObservableCounter),
+    "lowmemory": (Counter, Histogram),
+}
+
+def preferred_temporality(temporality="cumulative"):
+    """
+    This function returns the temporality of every instrument for the given OTLP_TEMPORALITY.
+    """
+    if temporality not in DELTA_INSTRUMENTS:
+        raise ValueError(f"Unknown temporality {temporality!r}, expected one of {', '.join(DELTA_INSTRUMENTS)}")
+
+    return {
+        instrument: AggregationTemporality.DELTA if instrument in DELTA_INSTRUMENTS[temporality] else AggregationTemporality.CUMULATIVE
+        for instrument in (Counter, UpDownCounter, Histogram, ObservableCounter, ObservableUpDownCounter, ObservableGauge)
+    }
+
+def create_session():
+    """
+    This function creates a requests session with a single pooled keep-alive connection.
+    Retries are left to the exporter and to the export spool.
+    """
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0))
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0))
+
+    return session
+
+def create_transport(host, protocol="http/protobuf", compression="gzip", timeout=10, port=None, temporality="cumulative", **exporter_options):
+    """
+    This function creates the exporter for the chosen protocol, along with the sender
+    used to replay the spooled batches over the same kind of connection.
+    port defaults to the collector's port for the protocol.
+    temporality is the aggregation temporality of the exporter (see preferred_temporality).
+    exporter_options are passed on to the exporter (e.g. preferred_aggregation).
+    If the gRPC exporter is not installed, it falls back to OTLP/HTTP.
+    """
+    gzip_enabled = compression == "gzip"
+    exporter_options.setdefault("preferred_temporality", preferred_temporality(temporality))
+
+    if protocol == "grpc":
+        try:
+            return create_grpc_transport(f"{host}:{port or PORTS['grpc']}", gzip_enabled, timeout, **exporter_options)
+        except ImportError:
+            print("opentelemetry-exporter-otlp-proto-grpc is not installed, falling back to OTLP/HTTP")
+
+    endpoint = f"http://{host}:{port or PORTS['http/protobuf']}/v1/metrics"
+    session = create_session()
+    exporter = OTLPMetricExporter(
+        endpoint=endpoint,
+        compression=Compression.Gzip if gzip_enabled else Compression.NoCompression,
+        session=session,
+        timeout=timeout,
+        **exporter_options,
+    )
+
+    return exporter, HTTPSender(endpoint, session, gzip_enabled, timeout)
+
+def create_grpc_transport(endpoint, gzip_enabled, timeout, **exporter_options):
+    """
+    This function creates the OTLP/gRPC exporter and its sender.
+    gRPC multiplexes every export over one long-lived HTTP/2 channel.
+    """
+    import grpc
+    from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter as GRPCMetricExporter
+
+    compression = grpc.Compression.Gzip if gzip_enabled else grpc.Compression.NoCompression
+    exporter = GRPCMetricExporter(
+        endpoint=endpoint,
+        insecure=True,
+        compression=compression,
+        timeout=timeout,
+        **exporter_options,
+    )
+
+    return exporter, GRPCSender(endpoint, compression, timeout)
+
+class HTTPSender:
+    def __init__(self, endpoint, session, gzip_enabled=True, timeout=10):
+        """
+        This class sends encoded export batches to an OTLP/HTTP endpoint.
+        It shares the exporter's session, so both reuse the same connection to the collector.
+        """
+        self.endpoint = endpoint
+        self.session = session
+        self.gzip_enabled = gzip_enabled
+        self.timeout = timeout
+        self.headers = {"Content-Type": "application/x-protobuf"}
+
+        if gzip_enabled:
+            self.headers["Content-Encoding"] = "gzip"
+
+    def send(self, payload):
+        """
+        This method sends one batch, and returns whether the collector accepted it.
+        """
+        if self.gzip_enabled:
+            payload = gzip.compress(payload)
+
+        try:
+            response = self.session.post(self.endpoint, data=payload, headers=self.headers, timeout=self.timeout)
+        except requests.exceptions.RequestException:
+            return False
+
+        return response.ok
+
+class GRPCSender:
+    def __init__(self, endpoint, compression, timeout=10):
+        """
+        This class sends encoded export batches to an OTLP/gRPC endpoint, over its own channel.
+        """
+        import grpc
+        from opentelemetry.proto.collector.metrics.v1.metrics_service_pb2_grpc import MetricsServiceStub
+
+        self.channel = grpc.insecure_channel(endpoint, compression=compression)
+        self.stub = MetricsServiceStub(self.channel)
+        self.timeout = timeout
+
+    def send(self, payload):
+        """
+        This method sends one batch, and returns whether the collector accepted it.
+        """
+        import grpc
+        from opentelemetry.proto.collector.metrics.v1.metrics_service_pb2 import ExportMetricsServiceRequest
+
+        try:
+            self.stub.Export(ExportMetricsServiceRequest.FromString(payload), timeout=self.timeout)
+        except grpc.RpcError:
+            return False
+
+        return True
@@ -0,0 +1,158 @@
+"""
+This module is used to sample the system metrics faster than they are exported.
+A background thread takes a sample every few hundred milliseconds and stores the values
+in fixed-size ring buffers. At export time, each metric is summarised over the window
+since the previous export as min/max/mean/p95, so short CPU or IO bursts between
+two exports are not lost, without raising the export rate.
+
+Gauge fields (e.g. cpu_usage) are stored as they are sampled.
+Counter fields (e.g. network_sent) are stored as per-second rates between two samples.
+"""
+
+import math, threading, time
+from array import array
+from rate_stage import CounterRate
+
+STATS = ("min", "max", "mean", "p95")
+
+class RingBuffer:
+    """
+    A fixed-size buffer of floats backed by an array; the oldest values are overwritten when it is full.
+    """
+    __slots__ = ("data", "capacity", "index", "count")
+
+    def __init__(self, capacity):
+        self.data = array("d", bytes(8 * capacity))
+        self.capacity = capacity
+        self.index = 0
+        self.count = 0
+
+    def append(self, value):
+        self.data[self.index] = value
+        self.index = (self.index + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def values(self):
+        """
+        This method returns the values currently in the buffer (in no particular order).
+        """
+        return self.data[:self.count]
+
+    def clear(self):
+        self.index = 0
+        self.count = 0
+
+def summarize(values):
+    """
+    This function returns the min, max, mean and p95 of the values, or None if there are none.
+    """
+    count = len(values)
+
+    if not count:
+        return None
+
+    ordered = sorted(values)
+    return {
+        "min": ordered[0],
+        "max": ordered[-1],
+        "mean": sum(ordered) / count,
+        "p95": ordered[math.ceil(0.95 * count) - 1],
+    }
+
+class WindowSampler:
+    def __init__(self, sampler, interval=0.25, export_interval=5.0,
+                 gauges=("cpu_usage", "ram_usage"),
+                 counters=("disk_busy_time", "network_sent", "network_recv")):
+        """
+        sampler is a SnapshotSampler dedicated to this thread, sampled every interval seconds.
+        The ring buffers hold twice the number of samples of one export interval,
+        so a late export does not lose the beginning of its window.
+        Fields of the sources that the sampler does not sample are skipped.
+        """
+        self.sampler = sampler
+        self.interval = interval
+        self.gauges = tuple(field for field in gauges if field in sampler.fields)
+        self.counters = tuple(field for field in counters if field in sampler.fields)
+
+        capacity = max(2, math.ceil(export_interval / interval) * 2)
+        self.buffers = {field: RingBuffer(capacity) for field in self.gauges + self.counters}
+        self.rates = {field: CounterRate() for field in self.counters}
+
+        # Summary of the last window, shared by the callbacks of the same export cycle
+        self.summary = {}
+        self.summary_time = None
+        self.max_age = export_interval / 2
+
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    # =============== Sampling ===============
+    def sample(self):
+        """
+        This method takes one sample and appends it to the ring buffers.
+        """
+        snapshot = self.sampler.sample()
+        now = snapshot.monotonic
+
+        with self.lock:
+            for field in self.gauges:
+                self.buffers[field].append(getattr(snapshot, field))
+
+            # Counters are turned into per-second rates between two samples
+            for field in self.counters:
+                rate = self.rates[field].update(getattr(snapshot, field), now)
+                if rate is not None:
+                    self.buffers[field].append(rate)
+
+    def run(self):
+        """
+        This method samples every interval seconds until stop() is called.
+        The schedule is based on the start time, so it does not drift with the cost of each sample.
+        """
+        next_time = time.monotonic()
+
+        while not self.stop_event.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Error sampling metrics: {e}")
+
+            next_time += self.interval
+            delay = next_time - time.monotonic()
+
+            # Skip the missed samples instead of catching up in a burst
+            if delay < 0:
+                next_time = time.monotonic()
+                delay = 0
+
+            self.stop_event.wait(delay)
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="window_sampler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    # =============== Export ===============
+    def get(self):
+        """
+        This method returns the summary of the current window for every field.
+        The window is summarised and reset once per export cycle; the callbacks of the same cycle share it.
+        """
+        now = time.monotonic()
+
+        if self.summary_time is None or now - self.summary_time >= self.max_age:
+            with self.lock:
+                self.summary = {field: summarize(buffer.values()) for field, buffer in self.buffers.items()}
+                for buffer in self.buffers.values():
+                    buffer.clear()
+
+            self.summary_time = now
+
+        return self.summary